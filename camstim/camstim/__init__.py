@@ -1,7 +1,14 @@
+import os
+if os.environ.get("CAMSTIM_HEADLESS"):
+    # pyglet's shadow window needs a display.  Has to be turned off before
+    # anything imports pyglet.gl.  See headless.py
+    import pyglet
+    pyglet.options['shadow_window'] = False
+
 from sweepstim import SweepStim, Stimulus, NaturalScenes, MovieStim
 from behavior import Behavior, Foraging, VisualObject
 from experiment import Experiment, Timetrials
-from window import Window, Warp
+from window import Window, Warp, WarpRenderer
 from misc import ImageStimNumpyuByte
 
 __version__ = "0.2.4"
@@ -191,6 +191,14 @@ class BehaviorBase(EObject):
                                  v in self.items.iteritems()})
         return super(BehaviorBase, self).package()
 
+    def stream_sources(self):
+        sources = super(BehaviorBase, self).stream_sources()
+        for name in ["encoders", "rewards", "lick_sensors"]:
+            for i, device in enumerate(getattr(self, name)):
+                for source in device.stream_sources():
+                    sources.append(((name, i) + source[0],) + source[1:])
+        return sources
+
     def add_encoder(self, encoder):
         """ Adds a behavior encoder.
         """
@@ -654,6 +662,14 @@ class Behavior(BehaviorBase):
                 logging.info("Volume limit of {} reached.".format(self._volume_limit))
                 self._close()
 
+    def stream_sources(self):
+        sources = super(Behavior, self).stream_sources()
+        for k, v in self.stimuli.items():
+            if hasattr(v, "stream_sources"):
+                for source in v.stream_sources():
+                    sources.append((("stimuli", k) + source[0],) + source[1:])
+        return sources
+
     def package(self):
         self.window = str(self.window)
         self.stimuli = OrderedDict({k:v.package() for k,v in self.stimuli.items()})
@@ -2013,6 +2029,9 @@ class BehaviorEncoder(EObject):
         self.dx = np.array(self.dx, dtype=np.float32)
         return super(BehaviorEncoder, self).package()
 
+    def stream_sources(self):
+        return [(("dx",), self, "dx")]
+
 class _BaseReward(EObject):
     """
     Base class for rewards.  Used for both keyboard and NIDAQ based rewards.
@@ -2030,6 +2049,9 @@ class _BaseReward(EObject):
     def update(self, index=None):
         self._update_count += 1
 
+    def stream_sources(self):
+        return [(("reward_times",), self, "reward_times")]
+
     def reward(self, volume=None):
         """
         Triggers a reward.  Sends signal.
@@ -2160,6 +2182,9 @@ class _BaseLickSensor(EObject):
     def test(self):
         return True
 
+    def stream_sources(self):
+        return [(("lick_events",), self, "lick_events")]
+
     def update(self, index=None):
         """
         Updates the data, emits signal if lick occurred.
@@ -0,0 +1,61 @@
+"""
+texture_upload_benchmark.py
+
+Times per-frame texture uploads of 1920x1080 movie frames with
+    ImageStimNumpyuByte, for each upload mode:
+        full: glTexImage2D every frame (previous behavior)
+        stream: glTexSubImage2D
+        pbo: glTexSubImage2D through alternating pixel buffer objects
+
+"call" is the time spent in setReplaceImage, "frame" is the time until the
+    upload is done (glFinish).
+
+>python texture_upload_benchmark.py [n_frames]
+
+"""
+import sys
+from timeit import default_timer
+
+import numpy as np
+import pyglet
+from psychopy import visual
+
+from camstim import ImageStimNumpyuByte
+
+GL = pyglet.gl
+
+
+def bench(window, frames, n_frames, upload):
+    stim = ImageStimNumpyuByte(window, image=frames[0], size=(1920, 1080),
+                               units='pix', upload=upload)
+    stim.setReplaceImage(frames[0])  # allocation isn't part of the timing
+    GL.glFinish()
+    call_times, frame_times = [], []
+    for i in range(n_frames):
+        frame = frames[i % len(frames)]
+        t0 = default_timer()
+        stim.setReplaceImage(frame)
+        t1 = default_timer()
+        stim.draw()
+        GL.glFinish()
+        t2 = default_timer()
+        call_times.append(t1 - t0)
+        frame_times.append(t2 - t0)
+    return stim.upload, np.array(call_times)*1000, np.array(frame_times)*1000
+
+
+def main(n_frames=300):
+    window = visual.Window(size=(1920, 1080), units='pix', fullscr=False)
+    rng = np.random.RandomState(0)
+    frames = rng.randint(0, 256, (32, 1080, 1920), dtype=np.uint8)
+    for upload in ['full', 'stream', 'pbo']:
+        used, call, frame = bench(window, frames, n_frames, upload)
+        print("{:<7} call: {:.3f} ms (max {:.3f})  frame: {:.3f} ms "
+              "(max {:.3f})".format(used, np.median(call), call.max(),
+                                    np.median(frame), frame.max()))
+    window.close()
+
+
+if __name__ == "__main__":
+    n_frames = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    main(n_frames)
@@ -0,0 +1,54 @@
+"""
+warp_benchmark.py
+
+Times the warp pass of a flip across grid sizes, for each warp renderer:
+    quads: GL_QUADS, four vertices per grid cell (previous behavior)
+    indexed: indexed GL_TRIANGLES sharing the grid's vertices
+
+Each warp is drawn and then waited for (glFinish), so times include the GPU.
+
+>python warp_benchmark.py [n_frames]
+
+"""
+import sys
+import time
+
+import numpy as np
+import pyglet
+
+from camstim import Window, Warp, WarpRenderer
+
+GL = pyglet.gl
+
+GRID_SIZES = [50, 100, 200, 300, 500]
+
+
+def bench(gridsize, renderer, n_frames):
+    window = Window(fullscr=True, monitor='testMonitor', screen=0,
+                    warp=Warp.Spherical, warpGridsize=gridsize,
+                    warpRenderer=renderer, warpCache=False)
+    for _ in range(10):  # warm up
+        window.flip()
+    times = []
+    for _ in range(n_frames):
+        GL.glFinish()
+        t0 = time.clock()
+        window.drawWarp()
+        GL.glFinish()
+        times.append(time.clock() - t0)
+    window.close()
+    return np.array(times)*1000
+
+
+def main(n_frames=300):
+    for gridsize in GRID_SIZES:
+        for name, renderer in [('quads', WarpRenderer.Quads),
+                               ('indexed', WarpRenderer.Indexed)]:
+            t = bench(gridsize, renderer, n_frames)
+            print("grid {:>4} {:<8} {:.3f} ms (max {:.3f})".format(
+                gridsize, name, np.median(t), t.max()))
+
+
+if __name__ == "__main__":
+    n_frames = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    main(n_frames)
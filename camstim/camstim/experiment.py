@@ -11,11 +11,16 @@ import signal
 import pprint
 import datetime
 import platform
+import threading
+import Queue
+import cPickle as pickle
 from collections import OrderedDict
 
+import numpy as np
 from qtpy import QtCore
 
-from misc import getPlatformInfo, printHeader, save_session, CAMSTIM_DIR
+from misc import getPlatformInfo, printHeader, save_session, CAMSTIM_DIR, \
+    wecanpicklethat, dump_pickleable
 
 if "Windows" in platform.system():
     try:
@@ -44,6 +49,10 @@ import logging
 class Experiment(QtCore.QObject):
     """
     Defines a basic behavior or stimulus experiment.
+
+    Set `stream_output` before starting to write the items' growing data
+        (encoder dx, licks, rewards...) to disk every `stream_interval`
+        seconds during the session.  See OutputStream.
     """
 
     started = QtCore.Signal()
@@ -64,6 +73,11 @@ class Experiment(QtCore.QObject):
         self.threads = []
         self._qthreads = []
 
+        self.stream_output = False
+        self.stream_interval = 10.0
+        self._output_stream = None
+        self._stream_timer = None
+
         self._app = QtCore.QCoreApplication(sys.argv)
         self.closed.connect(self._app.quit)
         signal.signal(signal.SIGINT, self.exit_handler)
@@ -101,6 +115,8 @@ class Experiment(QtCore.QObject):
         self.start_time = datetime.datetime.now()
         for item in self.items.values():
             item.start()
+        if self.stream_output:
+            self._setup_output_stream()
         for thread in self.threads:
             QtCore.QTimer.singleShot(1, thread.run)
         self.started.emit()
@@ -111,12 +127,30 @@ class Experiment(QtCore.QObject):
         #is this necessary?
         self._update_count += 1
 
+    def _setup_output_stream(self):
+        """ Starts streaming the items' data to disk.
+        """
+        path = os.path.join(CAMSTIM_DIR, "output/%s.stream" %
+                            self.start_time.strftime('%y%m%d%H%M%S'))
+        self._output_stream = OutputStream(path)
+        for name, item in self.items.iteritems():
+            if hasattr(item, "stream_sources"):
+                for source in item.stream_sources():
+                    self._output_stream.add_source(
+                        ("items", name) + source[0], *source[1:])
+        self._stream_timer = QtCore.QTimer()
+        self._stream_timer.timeout.connect(self._output_stream.flush)
+        self._stream_timer.start(int(self.stream_interval*1000))
+        logging.info("Streaming output to: {}".format(path))
+
     def close(self):
         """ Ends the session.  Closes all items and threads, saves
             output file.
         """
         self.stop_time = datetime.datetime.now()
         self._output_file = OutputFile()
+        if self._stream_timer:
+            self._stream_timer.stop()
 
         for item in self.items.values():
             item.close()
@@ -131,8 +165,14 @@ class Experiment(QtCore.QObject):
         self.items = OrderedDict({k: v.package() for k, v in self.items.iteritems()})
 
         #_ = [pprint.pprint(item) for item in wecanpicklethat(self.__dict__).items()]
-        self._output_file.add_data(self.__dict__)
-        self._output_file.save()
+        if self._output_stream:
+            output = dict(self.__dict__)
+            self._output_stream.pop_streamed(output)
+            self._output_stream.close(wecanpicklethat(output))
+            self._output_file.path = self._output_stream.path
+        else:
+            self._output_file.add_data(self.__dict__)
+            self._output_file.save()
 
         logging.info("Experiment saved to: {}".format(self._output_file.path))
 
@@ -194,6 +234,19 @@ class EObject(QtCore.QObject):
     def package(self):
         return wecanpicklethat(self.__dict__)
 
+    def stream_sources(self):
+        """
+        Lists that grow during the session and can be streamed to disk (see
+            OutputStream), as (path, object, attribute) tuples.  The path is
+            where the list ends up in this object's packaged output.
+        """
+        sources = []
+        for name, item in getattr(self, "items", {}).iteritems():
+            if hasattr(item, "stream_sources"):
+                for source in item.stream_sources():
+                    sources.append((("items", name) + source[0],) + source[1:])
+        return sources
+
 
 class ETimer(QtCore.QTimer):
     """ Extends QTimer execept handles conversion to msecs, since that is
@@ -354,8 +407,6 @@ class OutputFile(QtCore.QObject):
         self.dt_str = self.dt.strftime('%y%m%d%H%M%S')
 
     def save(self, path=""):
-        import cPickle as pickle
-        output = wecanpicklethat(self._output)
         if path:
             self.path = path
         if self.path:
@@ -371,7 +422,7 @@ class OutputFile(QtCore.QObject):
             path = os.path.join(dirname, self.dt_str+"-"+filename)
             logging.warning("File path already exists, saving to: {}".format(path))
         with open(path, 'wb') as f:
-            pickle.dump(output, f)
+            dump_pickleable(self._output, f)
         self.path = path
 
 
@@ -379,25 +430,183 @@ class OutputFile(QtCore.QObject):
         self._output.update(data_dict)
 
 
-def wecanpicklethat(datadict):
+class OutputStream(object):
     """
-    Input is a dictionary.
-        Attempts to pickle every item.  If it doesn't pickle it is discarded
-        and its key is added to the output as "unpickleable"
+    Append-only session output file.  Lists that grow during the session
+        (frame intervals, encoder dx, lick and reward events...) are added as
+        sources, and their new entries are appended to the file in chunks by
+        a background thread.  `close` writes the rest of the output, without
+        the streamed values, as the last record.  If the session crashes,
+        everything up to the last chunk is still on disk.
+
+    The file is a sequence of pickled records:
+        ("header", {"version": ..., "created": ...})
+        ("chunk", path, entries)
+        ("tail", output, {path: (dtype, scale)})
+
+    Use `read_output_stream` to get the same dictionary as an output .pkl.
+
+    Args:
+        path (str): output file path.
+        chunk_frames (int): # of updates between chunks.
+
     """
-    import cPickle as pickle
-    pickleable = {}
-    unpickleable = []
-    for k, v in datadict.iteritems():
+    version = 1
+
+    def __init__(self, path, chunk_frames=600):
+        self.path = path
+        self.chunk_frames = chunk_frames
+        self._sources = []
+        self._streamed = None
+        dirname = os.path.dirname(path)
+        if dirname and not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        self._file = open(path, 'wb')
+        self._records = Queue.Queue()
+        self._write(("header", {"version": self.version,
+                                "created": datetime.datetime.now()}))
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def add_source(self, path, obj, attr, scale=None):
+        """
+        Adds a list to stream.
+
+        Args:
+            path (tuple): keys/indices of the list in the packaged output.
+            obj (object): object that has the list.
+            attr (str): attribute name of the list.
+            scale (float): factor the packaged values are multiplied by.
+        """
+        self._sources.append([tuple(path), obj, attr, scale, 0])
+
+    def update(self, index):
+        """
+        Queues a chunk every `chunk_frames` updates.
+        """
+        if index % self.chunk_frames == 0:
+            self.flush()
+
+    def flush(self):
+        """
+        Queues the entries added to each source since the last chunk.
+        """
+        for source in self._sources:
+            path, obj, attr, scale, written = source
+            values = getattr(obj, attr, None)
+            if values is None or len(values) <= written:
+                continue
+            self._records.put(("chunk", path, values[written:]))
+            source[4] = len(values)
+
+    def pop_streamed(self, output):
+        """
+        Removes the streamed values from the packaged output.  Done by `close`
+            if it hasn't been done already.
+        """
+        self._streamed = {}
+        for path, obj, attr, scale, written in self._sources:
+            try:
+                parent = _get_path(output, path[:-1])
+                value = parent.pop(path[-1])
+            except (KeyError, IndexError, TypeError, AttributeError):
+                continue
+            dtype = value.dtype.str if isinstance(value, np.ndarray) else None
+            self._streamed[path] = (dtype, scale)
+
+    def close(self, output):
+        """
+        Writes the last chunks and the rest of the output, and closes the
+            file.  The streamed values are removed from `output`.
+        """
+        self.flush()
+        if self._streamed is None:
+            self.pop_streamed(output)
+        self._records.put(("tail", output, self._streamed))
+        self._records.put(None)
+        self._thread.join()
+
+    def _write(self, record):
+        pickle.dump(record, self._file, pickle.HIGHEST_PROTOCOL)
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def _run(self):
         try:
-            if k[0] != "_":  # we don't want private counters and such
-                test = v
-                _ = pickle.dumps(test)
-                pickleable[k] = v
-        except:
-            unpickleable.append(k)
-    pickleable['unpickleable'] = unpickleable
-    return pickleable
+            while True:
+                record = self._records.get()
+                if record is None:
+                    return
+                self._write(record)
+        finally:
+            self._file.close()
+
+
+def _get_path(data, path):
+    for key in path:
+        data = data[key]
+    return data
+
+
+def read_output_stream(path):
+    """
+    Reads a file written by OutputStream.
+
+    Returns:
+        dict: the session output, with the streamed values put back where
+            they were.  If the session didn't finish, only the streamed values
+            are available: {"incomplete": True, "streams": {path: values}}.
+    """
+    chunks = OrderedDict()
+    tail = None
+    with open(path, 'rb') as f:
+        while True:
+            try:
+                record = pickle.load(f)
+            except EOFError:
+                break
+            except Exception as e:
+                # last record was cut short
+                logging.warning("Truncated output stream {}: {}".format(path, e))
+                break
+            if record[0] == "chunk":
+                chunks.setdefault(record[1], []).extend(record[2])
+            elif record[0] == "tail":
+                tail = record[1:]
+
+    if tail is None:
+        return {"incomplete": True, "streams": chunks}
+
+    output, streamed = tail
+    for stream_path, values in chunks.iteritems():
+        if stream_path not in streamed:
+            continue
+        dtype, scale = streamed[stream_path]
+        if dtype is not None:
+            values = np.array(values)
+            if scale is not None:
+                values = values * scale
+            values = values.astype(dtype)
+        _get_path(output, stream_path[:-1])[stream_path[-1]] = values
+    for stream_path, (dtype, scale) in streamed.iteritems():
+        if stream_path not in chunks:
+            # streamed but empty
+            value = [] if dtype is None else np.array([], dtype=dtype)
+            _get_path(output, stream_path[:-1])[stream_path[-1]] = value
+    return output
+
+
+def stream2pkl(path, pkl_path=None):
+    """
+    Converts a file written by OutputStream to an output .pkl.  Returns the
+        .pkl path.
+    """
+    pkl_path = pkl_path or os.path.splitext(path)[0] + ".pkl"
+    output = read_output_stream(path)
+    with open(pkl_path, 'wb') as f:
+        pickle.dump(output, f)
+    return pkl_path
 
 
 if __name__ == '__main__':
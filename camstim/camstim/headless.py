@@ -0,0 +1,143 @@
+"""
+headless.py
+
+Stand-ins for the psychopy window and stimuli so that experiments can run
+    without a display or GPU.  Useful for benchmarking the frame loop and
+    session generation in containers.
+
+Pyglet creates a hidden "shadow" window as soon as `pyglet.gl` is imported,
+    which fails without a display.  Set the environment variable
+    CAMSTIM_HEADLESS=1 before importing camstim to turn that off.
+
+Example:
+    window = NullWindow()
+    stim = Stimulus(NullStimulus(), {'Ori': ([0, 90], 0)}, sweep_length=1.0)
+    ss = SweepStim(window, stimuli=[stim])
+    ss.run()
+
+"""
+import logging
+from timeit import default_timer
+
+import numpy as np
+
+
+class NullMonitor(object):
+    """
+    Just enough of `psychopy.monitors.Monitor` for `misc.getMonitorInfo`.
+    """
+    def __init__(self, name="headless", size_pix=(1920, 1200), width_cm=52.0,
+                 distance_cm=15.0):
+        self.name = name
+        self._size_pix = list(size_pix)
+        self._width_cm = width_cm
+        self._distance_cm = distance_cm
+
+    def getGamma(self):
+        return None
+
+    def getGammaGrid(self):
+        return np.ones((4, 3))
+
+    def getDistance(self):
+        return self._distance_cm
+
+    def getSizePix(self):
+        return self._size_pix
+
+    def getWidth(self):
+        return self._width_cm
+
+    def getCalibDate(self):
+        return None
+
+
+class _NullWinHandle(object):
+    """
+    Swallows calls to the pyglet window.
+    """
+    def __getattr__(self, name):
+        return self._noop
+
+    def _noop(self, *args, **kwargs):
+        pass
+
+
+class NullWindow(object):
+    """
+    Window that doesn't render anything.  `flip` returns immediately, so the
+        frame loop runs unthrottled, but frame intervals are still recorded.
+
+    Args:
+        size (tuple): window size in pixels.
+        monitor (object): monitor object.  Defaults to a `NullMonitor`.
+        screen (int): screen number.
+
+    """
+    headless = True
+
+    def __init__(self, size=(1920, 1200), monitor=None, screen=0):
+        self.size = np.array(size)
+        self.monitor = monitor or NullMonitor(size_pix=size)
+        self.screen = screen
+        self.winHandle = _NullWinHandle()
+        self.frameIntervals = []
+        self.recordFrameIntervals = False
+        self.lastWarpDuration = 0.0
+        self.flipCounter = 0
+        self._lastFrameTime = None
+
+    def setRecordFrameIntervals(self, value=True):
+        self.recordFrameIntervals = value
+        self._lastFrameTime = None
+
+    def flip(self, clearBuffer=True):
+        now = default_timer()
+        if self.recordFrameIntervals and self._lastFrameTime is not None:
+            self.frameIntervals.append(now - self._lastFrameTime)
+        self._lastFrameTime = now
+        self.flipCounter += 1
+
+    def getMovieFrame(self, buffer='front'):
+        pass
+
+    def saveMovieFrames(self, fileName, *args, **kwargs):
+        logging.warning("Headless window has no frames to save.")
+
+    def close(self):
+        pass
+
+    def get_config(self):
+        return {
+            "headless": True,
+            "size": self.size.tolist(),
+        }
+
+
+class NullStimulus(object):
+    """
+    Stands in for a psychopy stimulus.  Any `set<Param>` call stores the value
+        in the lowercase attribute, except for the params that `Stimulus`
+        handles itself (TF, PosX, PosY).
+
+    Args:
+        pos (tuple): initial position.
+
+    """
+    _special_params = ("TF", "PosX", "PosY")
+
+    def __init__(self, pos=(0, 0)):
+        self.pos = pos
+        self.draw_count = 0
+
+    def __getattr__(self, name):
+        if name.startswith("set") and name[3:] not in self._special_params:
+            attr = name[3:].lower()
+
+            def set_function(value, *args, **kwargs):
+                setattr(self, attr, value)
+            return set_function
+        raise AttributeError(name)
+
+    def draw(self, win=None):
+        self.draw_count += 1
@@ -51,6 +51,10 @@ triggerdiline = 0
 trigger_delay_sec = 0.0
 savesweeptable = True
 eyetracker = False
+frame_profiler = False                # record per-frame phase timings
+frame_profiler_length = 360000        # frames kept by the profiler
+stream_output = False                 # write output during the session (.stream file) instead of a .pkl at the end
+stream_chunk_frames = 600             # frames between streamed chunks
 
 [Sync]
 sync_sqr = False
@@ -157,6 +161,52 @@ def set_config(path, section, value):
     """ Sets a config file value. INCOMPLETE and UNUSED """
     parser = ConfigParser.RawConfigParser()
 
+class SweepTable(object):
+    """
+    Read-only, lazily evaluated `list(itertools.product(*dimlist))`.
+
+    Row i is computed on demand by treating i as a mixed-radix number with one
+        digit per dimension, the last dimension changing fastest.  Pickles as
+        the per-dimension value lists instead of the expanded product.
+
+    Args:
+        dimlist (list): ordered list of the values for each dimension.
+
+    """
+    def __init__(self, dimlist):
+        self.dimlist = list(dimlist)
+        self.shape = tuple(len(values) for values in self.dimlist)
+        self._strides = []
+        stride = 1
+        for n in reversed(self.shape):
+            self._strides.insert(0, stride)
+            stride *= n
+        self._length = stride
+        self._digits = zip(self.dimlist, self._strides, self.shape)
+
+    def __len__(self):
+        return self._length
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in xrange(*index.indices(self._length))]
+        if index < 0:
+            index += self._length
+        if not 0 <= index < self._length:
+            raise IndexError("Sweep table index out of range.")
+        return tuple(values[(index // stride) % n]
+                     for values, stride, n in self._digits)
+
+    def __iter__(self):
+        return itertools.product(*self.dimlist)
+
+    def __repr__(self):
+        return "SweepTable(shape=%s)" % (self.shape,)
+
+    def __reduce__(self):
+        return (SweepTable, (self.dimlist,))
+
+
 def buildSweepTable(sweep, runs=1, blanksweeps=0):
     """
 
@@ -203,7 +253,7 @@ def buildSweepTable(sweep, runs=1, blanksweeps=0):
                 dimnames.append(k)  # get ordered name array
 
     dimlist = [sweep[k][0] for k in dimnames]  # get ordered value array
-    sweeptable = list(itertools.product(*dimlist))  # get full ordered table
+    sweeptable = SweepTable(dimlist)  # full ordered table, built lazily
     sweeporder = range(sweepcount)
 
     # Add blank sweeps
@@ -302,13 +352,71 @@ def printHeader():
 
 def getSweepFrames(sweeporder, sweeptime, preexpsec, postexpsec, postsweepsec, fps):
     """ Gets the sweep frame (start,stop) list in frame domain """
-    sweepframelist = []
-    frame = int(preexpsec * fps)
-    for i in range(len(sweeporder)):
-        frames = (frame, frame + int(fps * sweeptime) - 1)
-        sweepframelist.append(frames)
-        frame = frames[1] + int(fps) * postsweepsec + 1
-    return sweepframelist
+    sweepframes = int(fps * sweeptime)
+    starts = int(preexpsec * fps) + numpy.arange(len(sweeporder)) * (
+        sweepframes + int(fps) * postsweepsec)
+    return zip(starts.tolist(), (starts + sweepframes - 1).tolist())
+
+
+def build_frame_list(sweep_order, sweep_frames, blank_frames=0, start_frame=0,
+                     stop_frame=None):
+    """ Builds the per-frame sweep array for a stimulus.
+
+    Each sweep in `sweep_order` is shown for `sweep_frames` frames and is
+        followed by `blank_frames` blank frames.  The array is padded with
+        `start_frame` blank frames and truncated at `stop_frame` if provided.
+
+    Returns:
+        numpy.ndarray: int32 array, -1 for blank frames and sweep # otherwise.
+
+    """
+    sweep_order = numpy.asarray(sweep_order, dtype=numpy.int32).reshape(-1)
+    sweeps = numpy.full((len(sweep_order), sweep_frames + blank_frames), -1,
+                        dtype=numpy.int32)
+    sweeps[:, :sweep_frames] = sweep_order[:, numpy.newaxis]
+    frame_list = numpy.concatenate((
+        numpy.full(start_frame, -1, dtype=numpy.int32), sweeps.reshape(-1)))
+    if stop_frame is not None:
+        frame_list = frame_list[:stop_frame]
+    return frame_list
+
+
+def apply_display_sequence(frame_list, display_intervals, fps):
+    """ Lays a frame list out over a set of display intervals.
+
+    Frames from `frame_list` are consumed in order while inside an interval.
+        Everything before the first interval and between intervals is blank.
+        Nothing is added after the last interval.
+
+    Args:
+        frame_list (numpy.ndarray): frame list with no display sequence.
+        display_intervals (numpy.ndarray): Nx2 array of (start, stop) seconds.
+        fps (float): display frame rate.
+
+    Returns:
+        numpy.ndarray: int32 array, -1 for blank frames and sweep # otherwise.
+
+    """
+    starts, stops = display_intervals[:, 0], display_intervals[:, 1]
+    shown = ((stops - starts)*fps).astype(int)
+    # intervals stop drawing frames once the frame list is used up
+    consumed = numpy.minimum(numpy.cumsum(shown), len(frame_list))
+    taken = numpy.diff(numpy.concatenate(([0], consumed)))
+    grey = numpy.zeros(len(display_intervals), dtype=int)
+    grey[:-1] = numpy.clip(((starts[1:] - stops[:-1])*fps).astype(int), 0, None)
+
+    # segment lengths alternate blank/shown: pad, shown0, grey0, shown1, ...
+    lengths = numpy.empty(2*len(display_intervals) + 1, dtype=int)
+    lengths[0] = int(fps*starts[0])
+    lengths[1::2] = taken
+    lengths[2::2] = grey
+    visible = numpy.zeros(len(lengths), dtype=bool)
+    visible[1::2] = True
+    mask = numpy.repeat(visible, lengths)
+
+    seq = numpy.full(len(mask), -1, dtype=numpy.int32)
+    seq[mask] = frame_list[:consumed[-1]]
+    return seq
 
 
 class prettyfloat(float):
@@ -357,24 +465,95 @@ def createConfig(path):
     f.close()
 
 
-def wecanpicklethat(datadict):
-    """ Input is a dictionary.
-        Attempts to pickle every item.  If it doesn't pickle it is discarded
-        and its key is added to the output as "unpickleable"
+_PLAIN_TYPES = frozenset([int, long, float, complex, bool, str, unicode,
+                          type(None)])
+
+
+def _is_plain(value, depth=2):
+    """ Checks whether a value is made only of types that always pickle
+        (numbers, strings, numeric arrays and lists, tuples and dicts of
+        those), so it doesn't have to be pickled to find out.
+    """
+    t = type(value)
+    if t in _PLAIN_TYPES:
+        return True
+    if t is numpy.ndarray:
+        return not value.dtype.hasobject
+    if isinstance(value, numpy.generic):
+        return not isinstance(value, numpy.object_)
+    if depth and t in (list, tuple):
+        if set(map(type, value)) <= _PLAIN_TYPES:
+            return True
+        return all(_is_plain(v, depth-1) for v in value)
+    if depth and t is dict:
+        return all(type(k) in _PLAIN_TYPES and _is_plain(v, depth-1)
+                   for k, v in value.iteritems())
+    return False
+
+
+def _pickleable_items(datadict, dumps):
+    """ Yields (key, value, pickled value) for the items of a dictionary that
+        pickle, and finally ("unpickleable", [keys], None).  Values of plain
+        types aren't pickled unless `dumps` is given.
     """
     import cPickle as pickle
-    pickleable = {}
     unpickleable = []
     for k, v in datadict.iteritems():
         try:
             if k[0] != "_":  # we don't want private counters and such
-                test = v
-                teststring = pickle.dumps(test)
-                pickleable[k] = v
-        except:
+                if dumps:
+                    yield k, v, dumps(v)
+                elif _is_plain(v):
+                    yield k, v, None
+                else:
+                    pickle.dumps(v)
+                    yield k, v, None
+        except Exception:
             unpickleable.append(k)
-    pickleable['unpickleable'] = unpickleable
-    return pickleable
+    yield 'unpickleable', unpickleable, None
+
+
+def wecanpicklethat(datadict):
+    """ Input is a dictionary.
+        Attempts to pickle every item.  If it doesn't pickle it is discarded
+        and its key is added to the output as "unpickleable"
+    """
+    return {k: v for k, v, _ in _pickleable_items(datadict, None)}
+
+
+def dump_pickleable(datadict, f, protocol=0):
+    """ Pickles a dictionary to an open file, like
+        `pickle.dump(wecanpicklethat(datadict), f)`, but pickles every item
+        only once.  Each item is pickled on its own and written right away
+        as an entry of the dictionary, so only one item's pickle is in
+        memory at a time.
+
+    Args:
+        datadict (dict): data to pickle
+        f (file): open file to write to
+        protocol (int): pickle protocol
+
+    Returns:
+        list: keys of the items that were left out as unpickleable
+
+    """
+    import cPickle as pickle
+    from pickle import PROTO, MARK, DICT, SETITEM, STOP
+    dumps = lambda obj: pickle.dumps(obj, protocol)
+    # items are written between the pickle's header and STOP
+    start = 2 if protocol >= 2 else 0
+    if start:
+        f.write(PROTO + chr(protocol))
+    f.write(MARK + DICT)
+    for k, v, pickled in _pickleable_items(datadict, dumps):
+        if pickled is None:
+            pickled = dumps(v)
+        f.write(dumps(k)[start:-1])
+        f.write(pickled[start:-1])
+        f.write(SETITEM)
+        del pickled
+    f.write(STOP)
+    return v  # "unpickleable" is the last item
 
 
 def save_session(mouse_id, dt, data, script="", adjustment={}):
@@ -475,22 +654,11 @@ def setGammaRamp(pygletWindow, newRamp, nAttempts=3):
 
 
 def pickle2hdf5(pickle_file):
-    """ Safely converts a pickle file to an hdf5 file, prints anything that doesn't convert. """
-    import hdf5pickle
-    import tables
-    import cPickle as pickle
-    fname = pickle_file.split(".")[0]
-    h5 = tables.openFile(fname + ".h5", 'w')
-    pkl = open(pickle_file, 'rb')
-    data = pickle.load(pkl)
-    for k, v in data.iteritems():
-        try:
-            hdf5pickle.dump(v, h5, "/" + k)
-        except Exception, e:
-            print k, v, e
-
-    h5.close()
-    pkl.close()
+    """ Converts a pickle file to a columnar HDF5 output file, see
+        `camstim.output`.  Returns the path of the new file.
+    """
+    from output import pkl2output
+    return pkl2output(pickle_file, os.path.splitext(pickle_file)[0] + ".h5")
 
 
 class SyncSquare(visual.GratingStim):
@@ -533,6 +701,14 @@ class ImageStimNumpyuByte(visual.ImageStim):
 
     '''Subclass of ImageStim which allows fast updates of numpy ubyte images,
        bypassing all internal PsychoPy format conversions.
+
+       upload sets how new images are sent to the texture:
+           'full': reallocates the texture for every image (glTexImage2D).
+           'stream': reallocates only when the size changes, otherwise
+               replaces the texture contents (glTexSubImage2D).
+           'pbo': same as 'stream', but through two alternating pixel buffer
+               objects, so the transfer to the texture is done by the driver
+               asynchronously.  Falls back to 'stream' if not supported.
     '''
 
     def __init__(self,
@@ -554,13 +730,18 @@ class ImageStimNumpyuByte(visual.ImageStim):
                  texRes=128,
                  name='',
                  autoLog=True,
-                 maskParams=None):
+                 maskParams=None,
+                 upload='pbo'):
 
         if image is None or type(image) != numpy.ndarray or len(image.shape) != 2:
             raise ValueError(
                 'ImageStimNumpyuByte must be numpy.ubyte ndarray (0-255)')
 
         self.interpolate = interpolate
+        self.upload = upload
+        self._texShape = None
+        self._pbos = None
+        self._pboIndex = 0
 
         # convert incoming Uint to RGB trio only during initialization to keep PsychoPy happy
         # else, error is: ERROR   numpy arrays used as textures should be in
@@ -602,6 +783,80 @@ class ImageStimNumpyuByte(visual.ImageStim):
         Use this function instead of 'setImage' to bypass format conversions
         and increase movie playback rates.
         '''
+        tex = numpy.ascontiguousarray(tex)
+        if self.upload == 'full' or tex.shape != self._texShape:
+            self._allocTexture(tex)
+        elif self._pbos is not None:
+            self._uploadPBO(tex)
+        else:
+            self._uploadSubImage(tex)
+
+    def _getTexID(self):
+        try:
+            return self._texID  # psychopy renamed this at some point.
+        except AttributeError:
+            return self.texID
+
+    def _uploadSubImage(self, tex):
+        '''
+        Replaces the texture contents with an image of the same size.
+        '''
+        GL.glBindTexture(GL.GL_TEXTURE_2D, self._getTexID())
+        GL.glTexSubImage2D(GL.GL_TEXTURE_2D, 0, 0, 0,
+                           tex.shape[1], tex.shape[0],
+                           GL.GL_LUMINANCE, GL.GL_UNSIGNED_BYTE, tex.ctypes)
+
+    def _uploadPBO(self, tex):
+        '''
+        Replaces the texture contents with an image of the same size, through
+        the next pixel buffer object.  The buffer is orphaned first so the
+        driver doesn't wait for a transfer still using it.
+        '''
+        GL.glBindTexture(GL.GL_TEXTURE_2D, self._getTexID())
+        GL.glBindBuffer(GL.GL_PIXEL_UNPACK_BUFFER,
+                        self._pbos[self._pboIndex])
+        GL.glBufferData(GL.GL_PIXEL_UNPACK_BUFFER, tex.nbytes, None,
+                        GL.GL_STREAM_DRAW)
+        ptr = GL.glMapBuffer(GL.GL_PIXEL_UNPACK_BUFFER, GL.GL_WRITE_ONLY)
+        if ptr:
+            ctypes.memmove(ptr, tex.ctypes.data, tex.nbytes)
+            GL.glUnmapBuffer(GL.GL_PIXEL_UNPACK_BUFFER)
+            # data pointer is an offset into the bound buffer
+            GL.glTexSubImage2D(GL.GL_TEXTURE_2D, 0, 0, 0,
+                               tex.shape[1], tex.shape[0],
+                               GL.GL_LUMINANCE, GL.GL_UNSIGNED_BYTE, None)
+            GL.glBindBuffer(GL.GL_PIXEL_UNPACK_BUFFER, 0)
+        else:
+            GL.glBindBuffer(GL.GL_PIXEL_UNPACK_BUFFER, 0)
+            self._uploadSubImage(tex)
+        self._pboIndex = 1 - self._pboIndex
+
+    def _initPBOs(self, nbytes):
+        '''
+        Creates the pixel buffer objects for 'pbo' uploads, if supported.
+        '''
+        from pyglet.gl import gl_info
+        if self._pbos is not None:
+            GL.glDeleteBuffers(2, self._pbos)
+            self._pbos = None
+        if not (gl_info.have_version(2, 1) or
+                gl_info.have_extension('GL_ARB_pixel_buffer_object')):
+            logging.warning("Pixel buffer objects not supported, "
+                            "using glTexSubImage2D uploads.")
+            self.upload = 'stream'
+            return
+        self._pbos = (GL.GLuint * 2)()
+        GL.glGenBuffers(2, self._pbos)
+        for pbo in self._pbos:
+            GL.glBindBuffer(GL.GL_PIXEL_UNPACK_BUFFER, pbo)
+            GL.glBufferData(GL.GL_PIXEL_UNPACK_BUFFER, nbytes, None,
+                            GL.GL_STREAM_DRAW)
+        GL.glBindBuffer(GL.GL_PIXEL_UNPACK_BUFFER, 0)
+
+    def _allocTexture(self, tex):
+        '''
+        (Re)allocates the texture for an image and sets its parameters.
+        '''
         #intensity = tex.astype(numpy.ubyte)
         intensity = tex
         internalFormat = GL.GL_LUMINANCE
@@ -613,10 +868,7 @@ class ImageStimNumpyuByte(visual.ImageStim):
         # data[:,:,2] = intensity#B
         data = intensity
         texture = tex.ctypes  # serialise
-        try:
-            tid = self._texID  # psychopy renamed this at some point.
-        except AttributeError:
-            tid = self.texID
+        tid = self._getTexID()
         GL.glEnable(GL.GL_TEXTURE_2D)
         GL.glBindTexture(GL.GL_TEXTURE_2D, tid)
         # makes the texture map wrap (this is actually default anyway)
@@ -634,7 +886,9 @@ class ImageStimNumpyuByte(visual.ImageStim):
                         # [JRG] for non-square, want data.shape[1], data.shape[0]
                         data.shape[1], data.shape[0], 0,
                         pixFormat, dataType, texture)
-        pass
+        self._texShape = tex.shape
+        if self.upload == 'pbo':
+            self._initPBOs(tex.nbytes)
 
 if __name__ == "__main__":
     pass
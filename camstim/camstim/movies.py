@@ -0,0 +1,465 @@
+"""
+movies.py
+
+Indexed movies: variants of a movie (reversed, scrubbed, etc.) stored as a
+    sequence of frame indices into one frame array, so that each unique frame
+    is stored and loaded once.
+
+An indexed movie is an .npz file with:
+    index: the frame # in the frame array for each frame of the movie.
+    frames: file name of the frame array (.npy), in the same folder.
+
+Frame arrays are loaded once per session and shared by every indexed movie
+    that uses them.
+
+Decoded frames can be kept in a `FrameCache`, shared by the movies of a session,
+    so that clips shown in every block are only read from disk once.
+
+Movies are played from local copies.  `MovieStager` makes them, concurrently,
+    and keeps a manifest so that a copy is only reused if it is complete and
+    its source hasn't changed.
+
+Example:
+    save_indexed_movie("movie_rev.npz", "movie_frames.npy", range(269, -1, -1))
+    movie = IndexedMovie.from_file("movie_rev.npz", mmap_mode='r')
+
+"""
+import os
+import json
+import hashlib
+import logging
+import tempfile
+import threading
+from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
+
+import numpy as np
+
+from misc import CAMSTIM_DIR, check_dirs
+
+_frame_stores = {}
+_stager = None
+
+
+def save_indexed_movie(path, frames_path, index):
+    """
+    Saves an indexed movie.
+
+    Args:
+        path (str): path of the .npz file to save.
+        frames_path (str): path of the frame array.  Must be in the same
+            folder as `path`.
+        index (array-like): frame # in the frame array for each frame.
+    """
+    folder = os.path.dirname(os.path.abspath(path))
+    if os.path.dirname(os.path.abspath(frames_path)) != folder:
+        raise ValueError("Frame array must be in the same folder as the "
+                         "indexed movie: {}".format(frames_path))
+    np.savez(path, index=np.asarray(index, dtype=np.int32),
+             frames=os.path.basename(frames_path))
+
+
+def get_frames_path(path):
+    """
+    Returns the path of the frame array used by an indexed movie.
+    """
+    data = np.load(path)
+    try:
+        frames = str(data['frames'])
+    finally:
+        data.close()
+    return os.path.join(os.path.dirname(path), frames)
+
+
+def load_frames(path, mmap_mode=None):
+    """
+    Loads a frame array, or returns it if it has already been loaded with the
+        same `mmap_mode`.
+    """
+    key = (os.path.abspath(path), mmap_mode)
+    if key not in _frame_stores:
+        frames = np.load(path, mmap_mode=mmap_mode)
+        if not frames.flags['C_CONTIGUOUS']:
+            frames = np.ascontiguousarray(frames)
+        _frame_stores[key] = frames
+    return _frame_stores[key]
+
+
+def clear_frame_stores():
+    """
+    Forgets the loaded frame arrays.
+    """
+    _frame_stores.clear()
+
+
+def unique_frames_nbytes(paths):
+    """
+    Returns the memory needed to hold every frame used by a set of movies
+        (.npy) and indexed movies (.npz), counting frames they share once.
+        Use it to size a `FrameCache`.
+    """
+    used = OrderedDict()  # frame array path: frame #s
+    for path in paths:
+        if not path.endswith(".npz"):
+            used[os.path.abspath(path)] = None  # every frame
+            continue
+        data = np.load(path)
+        try:
+            index = data['index']
+        finally:
+            data.close()
+        frames_path = os.path.abspath(get_frames_path(path))
+        frame_nums = used.setdefault(frames_path, set())
+        if frame_nums is not None:
+            frame_nums.update(np.unique(index).tolist())
+    nbytes = 0
+    for frames_path, frame_nums in used.iteritems():
+        frames = np.load(frames_path, mmap_mode='r')
+        frame_nbytes = frames.dtype.itemsize * int(np.prod(frames.shape[1:]))
+        n_frames = len(frames) if frame_nums is None else len(frame_nums)
+        nbytes += n_frames * frame_nbytes
+        del frames
+    return nbytes
+
+
+class IndexedMovie(object):
+    """
+    A movie whose frames are looked up in a (shared) frame array.  Indexing
+        a frame and len() work like they do for a (t, y, x) array.
+
+    Args:
+        frames (numpy.ndarray): frame array.
+        index (array-like): frame # in `frames` for each frame of the movie.
+
+    """
+    def __init__(self, frames, index):
+        self.frames = frames
+        self.index = np.asarray(index, dtype=np.int64).reshape(-1)
+        if len(self.index) and (self.index.min() < 0 or
+                                self.index.max() >= len(frames)):
+            raise IndexError("Movie index out of range of its frames.")
+        self.ndim = frames.ndim
+        self.dtype = frames.dtype
+        self.shape = (len(self.index),) + frames.shape[1:]
+
+    @staticmethod
+    def from_file(path, mmap_mode=None):
+        """
+        Loads an indexed movie.  Its frame array is shared with any other
+            movie loaded with the same `mmap_mode`.
+        """
+        data = np.load(path)
+        try:
+            index = data['index']
+        finally:
+            data.close()
+        frames = load_frames(get_frames_path(path), mmap_mode)
+        return IndexedMovie(frames, index)
+
+    def to_array(self):
+        """
+        Returns the movie as a (t, y, x) array (a copy).
+        """
+        return self.frames[self.index]
+
+    def __len__(self):
+        return len(self.index)
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            return IndexedMovie(self.frames, self.index[item])
+        return self.frames[self.index[item]]
+
+    def __iter__(self):
+        for i in self.index:
+            yield self.frames[i]
+
+    def __repr__(self):
+        return "IndexedMovie(shape=%s, unique_frames=%s)" % (
+            self.shape, len(self.frames))
+
+
+class FrameCache(object):
+    """
+    Least recently used cache of movie frames, keyed by (frame array path,
+        frame #), with a memory budget.  Frames are stored as read-only copies,
+        so they stay in memory even if their movie is memory-mapped.
+
+    Args:
+        max_bytes (int): memory budget.  The least recently used frames are
+            evicted to stay under it.
+
+    """
+    def __init__(self, max_bytes):
+        self.max_bytes = int(max_bytes)
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._frames = OrderedDict()
+
+    def get(self, key, load):
+        """
+        Returns the frame for `key`, calling `load()` to read it if it isn't
+            cached.
+        """
+        frame = self._frames.pop(key, None)
+        if frame is not None:
+            self.hits += 1
+            self._frames[key] = frame  # most recently used
+            return frame
+        self.misses += 1
+        frame = np.array(load())
+        frame.flags.writeable = False
+        if frame.nbytes <= self.max_bytes:
+            self._frames[key] = frame
+            self.nbytes += frame.nbytes
+            while self.nbytes > self.max_bytes:
+                _, evicted = self._frames.popitem(last=False)
+                self.nbytes -= evicted.nbytes
+        return frame
+
+    def clear(self):
+        self._frames.clear()
+        self.nbytes = 0
+
+    def __len__(self):
+        return len(self._frames)
+
+    def __contains__(self, key):
+        return key in self._frames
+
+    def __repr__(self):
+        return "FrameCache(frames=%s, nbytes=%s, max_bytes=%s)" % (
+            len(self), self.nbytes, self.max_bytes)
+
+
+class CachedMovie(object):
+    """
+    A movie (array or `IndexedMovie`) whose frames are read through a
+        `FrameCache`.  Indexing a frame and len() work like they do for the
+        movie.
+
+    Args:
+        movie (numpy.ndarray or IndexedMovie): movie to read.
+        path (str): path of the movie's frame array, used in the cache keys.
+        cache (FrameCache): frame cache, usually shared by every movie.
+
+    """
+    def __init__(self, movie, path, cache):
+        self.movie = movie
+        self.frames = getattr(movie, 'frames', movie)
+        self.index = getattr(movie, 'index', None)
+        self.path = os.path.abspath(path)
+        self.cache = cache
+        self.ndim = movie.ndim
+        self.dtype = movie.dtype
+        self.shape = movie.shape
+
+    def __len__(self):
+        return len(self.movie)
+
+    def _key(self, item):
+        if self.index is not None:
+            item = self.index[item]
+        elif item < 0:
+            item += len(self.frames)
+        return (self.path, int(item))
+
+    def is_cached(self, item):
+        """
+        Returns whether frame `item` of the movie is in the cache.
+        """
+        return self._key(item) in self.cache
+
+    def __getitem__(self, item):
+        key = self._key(item)
+        frames = self.frames
+        return self.cache.get(key, lambda: frames[key[1]])
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __repr__(self):
+        return "CachedMovie(%r, %r)" % (self.movie, self.cache)
+
+
+class MovieStager(object):
+    """
+    Copies movies to a local folder.  Copies are written to a temp file and
+        renamed when complete, and recorded in a manifest (manifest.json) with
+        their size, md5 and mtime, and the size and mtime of their source.  A
+        local copy is reused only if none of those have changed.
+
+    If the source folder has a manifest.json of its own ({file name: {"size":
+        ..., "md5": ...}}), copies are also checked against it.
+
+    Indexed movies (.npz) are staged with their frame arrays.
+
+    Args:
+        local_dir (str): folder to copy movies to.  Defaults to
+            CAMSTIM_DIR/movies.
+        threads (int): number of files to copy at once.
+
+    """
+    manifest_name = "manifest.json"
+    chunk_size = 4 * 1024 * 1024
+
+    def __init__(self, local_dir=None, threads=4):
+        self.local_dir = local_dir or os.path.join(CAMSTIM_DIR, "movies")
+        self.threads = threads
+        check_dirs(self.local_dir)
+        self.manifest_path = os.path.join(self.local_dir, self.manifest_name)
+        self.manifest = self._read_manifest(self.manifest_path)
+        self._staged = {}
+        self._source_manifests = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _read_manifest(path):
+        if not os.path.isfile(path):
+            return {}
+        try:
+            with open(path, 'r') as f:
+                return json.load(f)
+        except ValueError:
+            logging.warning("Corrupt movie manifest, ignoring: {}".format(path))
+            return {}
+
+    def _write_manifest(self):
+        fd, tmp_path = tempfile.mkstemp(dir=self.local_dir, suffix=".tmp")
+        with os.fdopen(fd, 'w') as f:
+            json.dump(self.manifest, f, indent=2, sort_keys=True)
+        _replace(tmp_path, self.manifest_path)
+
+    def _get_source_entry(self, source):
+        folder, filename = os.path.split(os.path.abspath(source))
+        with self._lock:
+            if folder not in self._source_manifests:
+                path = os.path.join(folder, self.manifest_name)
+                self._source_manifests[folder] = self._read_manifest(path)
+            return self._source_manifests[folder].get(filename)
+
+    def is_valid(self, source):
+        """
+        Returns whether the local copy of `source` can be reused.
+        """
+        local_path = self.get_local_path(source)
+        entry = self.manifest.get(os.path.basename(local_path))
+        if entry is None or not os.path.isfile(local_path):
+            return False
+        local_stat = os.stat(local_path)
+        if (local_stat.st_size != entry['size'] or
+                local_stat.st_mtime != entry['mtime']):
+            return False
+        try:
+            source_stat = os.stat(source)
+        except OSError:
+            # source unavailable, trust the verified copy
+            logging.warning("Movie source unavailable: {}".format(source))
+            return True
+        return (entry['source'] == os.path.abspath(source) and
+                source_stat.st_size == entry['source_size'] and
+                source_stat.st_mtime == entry['source_mtime'])
+
+    def get_local_path(self, source):
+        return os.path.join(self.local_dir, os.path.basename(source))
+
+    def _copy(self, source):
+        """
+        Copies `source` to a temp file while hashing it, checks it, and
+            renames it to its local path.
+        """
+        local_path = self.get_local_path(source)
+        source_stat = os.stat(source)
+        md5 = hashlib.md5()
+        fd, tmp_path = tempfile.mkstemp(dir=self.local_dir, suffix=".part")
+        try:
+            with os.fdopen(fd, 'wb') as dst, open(source, 'rb') as src:
+                while True:
+                    chunk = src.read(self.chunk_size)
+                    if not chunk:
+                        break
+                    md5.update(chunk)
+                    dst.write(chunk)
+                dst.flush()
+                os.fsync(dst.fileno())
+            size = os.path.getsize(tmp_path)
+            expected = self._get_source_entry(source) or {}
+            if size != expected.get('size', source_stat.st_size):
+                raise IOError("Incomplete copy of {}: {} of {} bytes".format(
+                    source, size, expected.get('size', source_stat.st_size)))
+            if expected.get('md5', md5.hexdigest()) != md5.hexdigest():
+                raise IOError("Copy of {} doesn't match md5 {}".format(
+                    source, expected['md5']))
+            _replace(tmp_path, local_path)
+        except:
+            if os.path.isfile(tmp_path):
+                os.remove(tmp_path)
+            raise
+        with self._lock:
+            self.manifest[os.path.basename(local_path)] = {
+                'source': os.path.abspath(source),
+                'source_size': source_stat.st_size,
+                'source_mtime': source_stat.st_mtime,
+                'size': size,
+                'md5': md5.hexdigest(),
+                'mtime': os.stat(local_path).st_mtime,
+            }
+            self._write_manifest()
+        return local_path
+
+    def stage_file(self, source):
+        """
+        Returns the local path of `source`, copying it if there is no valid
+            local copy.
+        """
+        if source in self._staged:
+            return self._staged[source]
+        local_path = self.get_local_path(source)
+        if self.is_valid(source):
+            print("Movie file already exists locally @ {}".format(local_path))
+        else:
+            print("Movie not saved locally, copying {}...".format(source))
+            self._copy(source)
+            print("... Done!")
+        self._staged[source] = local_path
+        return local_path
+
+    def stage(self, sources):
+        """
+        Stages movies (and the frame arrays of indexed movies) concurrently.
+            Returns their local paths.
+        """
+        files = []
+        for source in sources:
+            files.append(source)
+            if source.endswith(".npz"):
+                files.append(get_frames_path(source))
+        files = sorted(set(files), key=files.index)
+        pool = ThreadPool(max(1, min(self.threads, len(files))))
+        try:
+            pool.map(self.stage_file, files)
+        finally:
+            pool.close()
+            pool.join()
+        return [self._staged[source] for source in sources]
+
+
+def get_stager():
+    """
+    Returns the session's movie stager, creating it if necessary.
+    """
+    global _stager
+    if _stager is None:
+        _stager = MovieStager()
+    return _stager
+
+
+def _replace(src, dst):
+    """
+    Renames `src` to `dst`, replacing it (os.rename doesn't on Windows).
+    """
+    if os.path.exists(dst):
+        os.remove(dst)
+    os.rename(src, dst)
@@ -0,0 +1,410 @@
+"""
+output.py
+
+Columnar session output files, that can be read one field at a time.
+
+A session output (the dictionary saved in the .pkl) is stored as a tree:
+    dicts, and lists that hold dicts (like "stimuli"), are groups.  List items
+        are named by their index, so the first stimulus is "stimuli/0".
+    numeric arrays, and lists or tuples of numbers of one type, are datasets.
+        Large ones are chunked and compressed.
+    numbers and strings are attributes (metadata) of their group.
+    anything else is pickled into a uint8 dataset.
+
+Files are HDF5 (needs h5py) or, without h5py, .npz with one compressed member
+    per dataset.  Reading a field only reads that field:
+
+    with open_output("session.h5") as output:
+        intervals = output["intervalsms"]
+        sweep_order = output["stimuli/0/sweep_order"]
+        vsynccount = output["vsynccount"]
+
+Notes:
+    dict keys are saved as strings.
+    lists of numbers load as lists of Python numbers.
+
+"""
+import os
+import urllib
+import cPickle as pickle
+from collections import OrderedDict
+
+import numpy as np
+
+try:
+    import h5py
+except ImportError:
+    h5py = None
+
+
+HDF5_SIGNATURE = b"\x89HDF\r\n\x1a\n"
+HDF5_EXTENSIONS = (".h5", ".hdf5")
+NPZ_META = "__output__"  # npz member with the groups' attributes
+CHUNK_MIN_BYTES = 64*1024  # smaller datasets aren't chunked or compressed
+MAX_ATTR_BYTES = 16*1024  # longer strings are stored as datasets
+
+_SCALAR_TYPES = (int, long, float, bool, str, unicode, np.number, np.bool_)
+_NUMBER_TYPES = frozenset([int, long, float, bool])
+
+
+def _quote(key):
+    return str(key).replace("%", "%25").replace("/", "%2F")
+
+
+def _path(field):
+    """ Path of a field given as "stimuli/0/sweep_order". """
+    return "/".join(_quote(name) for name in field.strip("/").split("/")
+                    if name)
+
+
+def _join(group, name):
+    return group + "/" + name if group else name
+
+
+def _is_group(value):
+    if isinstance(value, dict):
+        return True
+    if isinstance(value, (list, tuple)):
+        return any(isinstance(v, (dict, list, tuple)) and _is_group(v)
+                   for v in value)
+    return False
+
+
+def _storable(dtype):
+    """ Whether arrays of a dtype can be datasets (numbers and bytes). """
+    if dtype.names:
+        return all(_storable(dtype.fields[name][0]) for name in dtype.names)
+    return dtype.base.kind in "biufcS"
+
+
+def _as_array(value):
+    """
+    Gets the array a value is stored as, with its type name, or None if it
+        isn't an array or a list of numbers.
+    """
+    if isinstance(value, np.ndarray):
+        if not _storable(value.dtype):
+            return None
+        return np.asarray(value), 'ndarray'
+    if type(value) in (list, tuple):
+        types = set(map(type, value))
+        if len(types) > 1 or not all(t in _NUMBER_TYPES or
+                                     issubclass(t, (np.number, np.bool_))
+                                     for t in types):
+            return None
+        array = np.asarray(value)
+        if array.dtype.hasobject or array.ndim != 1:
+            return None
+        return array, type(value).__name__
+    return None
+
+
+def _is_attribute(value):
+    if not isinstance(value, _SCALAR_TYPES):
+        return False
+    if isinstance(value, (str, unicode)):
+        return len(value) <= MAX_ATTR_BYTES
+    return True
+
+
+def flatten_output(output):
+    """
+    Splits an output dictionary into groups and datasets.
+
+    Returns:
+        groups (OrderedDict): {group path: attributes}, the attribute "_kind"
+            is the group's type ("dict", "list" or "tuple").
+        datasets (OrderedDict): {dataset path: (array, pytype)}, pytype is
+            how the array is loaded ("ndarray", "list", "tuple" or "pickle").
+
+    """
+    groups, datasets = OrderedDict(), OrderedDict()
+
+    def add_group(path, value):
+        if isinstance(value, dict):
+            items = [(_quote(k), v) for k, v in value.iteritems()]
+        else:
+            items = [(str(i), v) for i, v in enumerate(value)]
+        attrs = {'_kind': type(value).__name__
+                 if type(value) in (list, tuple) else 'dict'}
+        groups[path] = attrs
+        for name, v in items:
+            child = _join(path, name)
+            if _is_group(v):
+                add_group(child, v)
+            elif _is_attribute(v):
+                attrs[name] = v
+            else:
+                array = _as_array(v)
+                if array is None:
+                    pickled = pickle.dumps(v, pickle.HIGHEST_PROTOCOL)
+                    array = np.frombuffer(pickled, dtype=np.uint8), 'pickle'
+                datasets[child] = array
+
+    add_group("", output)
+    return groups, datasets
+
+
+def _write_hdf5(path, groups, datasets):
+    if h5py is None:
+        raise ImportError("h5py is required for HDF5 output files, save an "
+                          ".npz instead.")
+    with h5py.File(path, 'w') as f:
+        for group_path, attrs in groups.iteritems():
+            group = f.require_group(group_path) if group_path else f
+            for name, value in attrs.iteritems():
+                group.attrs[name] = value
+        for dataset_path, (array, pytype) in datasets.iteritems():
+            if array.nbytes >= CHUNK_MIN_BYTES:
+                dataset = f.create_dataset(dataset_path, data=array,
+                                           chunks=True, compression='gzip',
+                                           shuffle=True)
+            else:
+                dataset = f.create_dataset(dataset_path, data=array)
+            dataset.attrs['pytype'] = pytype
+
+
+def _write_npz(path, groups, datasets):
+    meta = {'groups': groups,
+            'datasets': {k: pytype for k, (_, pytype) in datasets.iteritems()}}
+    members = {k: array for k, (array, _) in datasets.iteritems()}
+    members[NPZ_META] = np.frombuffer(
+        pickle.dumps(meta, pickle.HIGHEST_PROTOCOL), dtype=np.uint8)
+    with open(path, 'wb') as f:
+        np.savez_compressed(f, **members)
+
+
+def save_output(output, path, format=None):
+    """
+    Saves an output dictionary as a columnar output file.
+
+    Args:
+        output (dict): session output
+        path (str): file path
+        format (str): "hdf5" or "npz".  Defaults to the file extension, or
+            HDF5 if h5py is installed.
+
+    Returns:
+        str: the path of the file
+
+    """
+    ext = os.path.splitext(path)[1].lower()
+    if format is None:
+        if ext == ".npz":
+            format = "npz"
+        elif ext in HDF5_EXTENSIONS or h5py is not None:
+            format = "hdf5"
+        else:
+            format = "npz"
+    if format == "npz" and ext != ".npz":
+        path += ".npz"
+    elif format == "hdf5" and ext not in HDF5_EXTENSIONS:
+        path += ".h5"
+
+    groups, datasets = flatten_output(output)
+    dirname = os.path.dirname(path)
+    if dirname and not os.path.isdir(dirname):
+        os.makedirs(dirname)
+    if format == "hdf5":
+        _write_hdf5(path, groups, datasets)
+    elif format == "npz":
+        _write_npz(path, groups, datasets)
+    else:
+        raise ValueError("Unknown output format: {}".format(format))
+    return path
+
+
+def pkl2output(pkl_path, path=None, format=None):
+    """
+    Converts an output .pkl to a columnar output file.  Returns its path.
+    """
+    with open(pkl_path, 'rb') as f:
+        output = pickle.load(f)
+    path = path or os.path.splitext(pkl_path)[0]
+    return save_output(output, path, format)
+
+
+class _HDF5Reader(object):
+    def __init__(self, path):
+        if h5py is None:
+            raise ImportError("h5py is required to read HDF5 output files.")
+        self._file = h5py.File(path, 'r')
+
+    def is_group(self, path):
+        return isinstance(self._file.get(path or "/"), h5py.Group)
+
+    def is_dataset(self, path):
+        return path != "" and isinstance(self._file.get(path), h5py.Dataset)
+
+    def attrs(self, path):
+        attrs = {}
+        for name, value in self._file[path or "/"].attrs.iteritems():
+            if isinstance(value, np.generic):
+                value = value.item()
+            attrs[name] = value
+        return attrs
+
+    def children(self, path):
+        return list(self._file[path or "/"].keys())
+
+    def read(self, path):
+        dataset = self._file[path]
+        return dataset[()], dataset.attrs['pytype']
+
+    def close(self):
+        self._file.close()
+
+
+class _NPZReader(object):
+    def __init__(self, path):
+        self._file = np.load(path)
+        meta = pickle.loads(self._file[NPZ_META].tobytes())
+        self._groups = meta['groups']
+        self._datasets = meta['datasets']
+        self._children = {k: [] for k in self._groups}
+        for child in list(self._groups) + list(self._datasets):
+            if child:
+                parent, _, name = child.rpartition("/")
+                self._children[parent].append(name)
+
+    def is_group(self, path):
+        return path in self._groups
+
+    def is_dataset(self, path):
+        return path in self._datasets
+
+    def attrs(self, path):
+        return dict(self._groups[path])
+
+    def children(self, path):
+        return list(self._children[path])
+
+    def read(self, path):
+        return self._file[path], self._datasets[path]
+
+    def close(self):
+        self._file.close()
+
+
+class SessionOutput(object):
+    """
+    Reads a columnar output file lazily.  Fields are read when they are
+        asked for, by path: output["stimuli/0/sweep_order"].  Asking for a
+        group reads everything in it.
+
+    Args:
+        path (str): HDF5 or .npz output file
+
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            signature = f.read(len(HDF5_SIGNATURE))
+        if signature == HDF5_SIGNATURE:
+            self._reader = _HDF5Reader(path)
+        else:
+            self._reader = _NPZReader(path)
+
+    def __getitem__(self, field):
+        field = _path(field)
+        group, _, name = field.rpartition("/")
+        if self._reader.is_dataset(field):
+            return self._read_dataset(field)
+        if self._reader.is_group(field):
+            return self.load(field)
+        if self._reader.is_group(group):
+            attrs = self._reader.attrs(group)
+            if name in attrs and name != '_kind':
+                return attrs[name]
+        raise KeyError(field)
+
+    def __contains__(self, field):
+        try:
+            self[field]
+        except KeyError:
+            return False
+        return True
+
+    def keys(self, group=""):
+        """
+        Names of the fields in a group.
+        """
+        group = _path(group)
+        if not self._reader.is_group(group):
+            raise KeyError(group)
+        names = [k for k in self._reader.attrs(group) if k != '_kind']
+        names += self._reader.children(group)
+        return [urllib.unquote(k) for k in names]
+
+    def attrs(self, group=""):
+        """
+        Metadata (numbers and strings) of a group.
+        """
+        group = _path(group)
+        if not self._reader.is_group(group):
+            raise KeyError(group)
+        attrs = self._reader.attrs(group)
+        attrs.pop('_kind')
+        return {urllib.unquote(k): v for k, v in attrs.iteritems()}
+
+    def _read_dataset(self, path):
+        array, pytype = self._reader.read(path)
+        if pytype == 'pickle':
+            return pickle.loads(array.tobytes())
+        elif pytype == 'list':
+            return array.tolist()
+        elif pytype == 'tuple':
+            return tuple(array.tolist())
+        return array
+
+    def load(self, group=""):
+        """
+        Reads a group, by default the whole output, as it was saved.
+        """
+        group = _path(group)
+        if not self._reader.is_group(group):
+            raise KeyError(group)
+        attrs = self._reader.attrs(group)
+        kind = attrs.pop('_kind')
+        values = dict(attrs)
+        for name in self._reader.children(group):
+            path = _join(group, name)
+            if self._reader.is_dataset(path):
+                values[name] = self._read_dataset(path)
+            else:
+                values[name] = self.load(path)
+        if kind == 'dict':
+            return {urllib.unquote(k): v for k, v in values.iteritems()}
+        items = [values[str(i)] for i in range(len(values))]
+        return tuple(items) if kind == 'tuple' else items
+
+    def close(self):
+        self._reader.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def open_output(path):
+    """
+    Opens a columnar output file for reading.  See `SessionOutput`.
+    """
+    return SessionOutput(path)
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(
+        description="Converts output .pkl files to columnar output files.")
+    parser.add_argument("pkl_files", nargs="+")
+    parser.add_argument("--format", choices=["hdf5", "npz"])
+    args = parser.parse_args()
+    for pkl_path in args.pkl_files:
+        print(pkl2output(pkl_path, format=args.format))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+"""
+profiler.py
+
+Per-frame timing instrumentation for SweepStim.
+
+Each frame of the experiment loop is split into phases (stimulus updates, item
+    updates, the warp pass, the buffer flip and the keyboard check) which are
+    timed with a high resolution clock and written to a preallocated ring
+    buffer.  Nothing is allocated while the experiment is running.
+
+"""
+import logging
+from timeit import default_timer
+
+import numpy as np
+
+
+PHASES = ('stimuli', 'items', 'warp', 'flip', 'keys')
+
+
+class FrameProfiler(object):
+    """
+    Records per-frame phase timings into a ring buffer.
+
+    Args:
+        length (int): number of frames to keep.  Once full, the oldest frames
+            are overwritten.
+        timer (callable): clock used for timing, in seconds.
+
+    """
+    columns = ('frame', 'start') + PHASES
+
+    def __init__(self, length=360000, timer=default_timer):
+        self.length = int(length)
+        self.timer = timer
+        self.buffer = np.zeros((self.length, len(self.columns)),
+                               dtype=np.float64)
+        self.count = 0
+
+    def record(self, frame, t0, t1, t2, t3, t4, warp=0.0):
+        """
+        Records one frame.  `t0`-`t4` are the timestamps taken before the
+            stimulus update, item update, flip and key check, and after the
+            key check.  `warp` is the part of the flip spent on the warp pass.
+        """
+        row = self.buffer[self.count % self.length]
+        row[0] = frame
+        row[1] = t0
+        row[2] = t1 - t0
+        row[3] = t2 - t1
+        row[4] = warp
+        row[5] = t3 - t2 - warp
+        row[6] = t4 - t3
+        self.count += 1
+
+    def get_timings(self):
+        """
+        Gets the recorded timings in frame order.
+
+        Returns:
+            numpy.ndarray: (frames, columns) array of frame #, start time and
+                the duration of each phase in seconds.
+
+        """
+        if self.count <= self.length:
+            return self.buffer[:self.count].copy()
+        cursor = self.count % self.length
+        return np.concatenate((self.buffer[cursor:], self.buffer[:cursor]))
+
+    def summary(self, threshold=1.5):
+        """
+        Finds dropped frames and attributes each one to the phase that overran.
+
+        A frame is dropped if the time until the next frame starts is more than
+            `threshold` times the mean, which matches `Stim.printFrameInfo`.
+            The phase blamed for a drop is the one that exceeded its own
+            median duration by the most.
+
+        Returns:
+            dict: dropped frame #s and intervals, the phase blamed for each,
+                a count per phase and the median duration of each phase.
+
+        """
+        timings = self.get_timings()
+        durations = timings[:, 2:]
+        medians = np.median(durations, axis=0) if len(timings) else \
+            np.zeros(len(PHASES))
+        summary = {
+            'frames': [],
+            'intervals': [],
+            'phases': [],
+            'phase_counts': dict.fromkeys(PHASES, 0),
+            'phase_medians': dict(zip(PHASES, medians.tolist())),
+        }
+        if len(timings) < 2:
+            return summary
+
+        intervals = np.diff(timings[:, 1])
+        dropped = np.flatnonzero(intervals > threshold*intervals.mean())
+        blame = np.argmax(durations[dropped] - medians, axis=1)
+        summary['frames'] = timings[dropped, 0].astype(int).tolist()
+        summary['intervals'] = intervals[dropped].tolist()
+        summary['phases'] = [PHASES[i] for i in blame]
+        for phase in summary['phases']:
+            summary['phase_counts'][phase] += 1
+        return summary
+
+    def print_report(self, threshold=1.5):
+        """
+        Logs the dropped frame summary.
+        """
+        summary = self.summary(threshold)
+        medians = ", ".join("%s=%.2fms" % (p, summary['phase_medians'][p]*1000)
+                            for p in PHASES)
+        logging.info("Median frame phase durations: {}".format(medians))
+        logging.info("Dropped frames by phase: {}".format(
+            ", ".join("%s=%i" % (p, summary['phase_counts'][p])
+                      for p in PHASES)))
+        for frame, interval, phase in zip(summary['frames'],
+                                          summary['intervals'],
+                                          summary['phases']):
+            logging.debug("Frame {} took {:.1f}ms ({} overran)".format(
+                frame, interval*1000, phase))
+        return summary
+
+    def package(self):
+        """
+        Package for serializing.
+        """
+        return {
+            'columns': self.columns,
+            'timings': self.get_timings(),
+            'frames_recorded': self.count,
+            'dropped': self.summary(),
+        }
@@ -0,0 +1,282 @@
+"""
+schedule.py
+
+Run-length encoded frame schedules for stimuli, and a scheduler that uses them
+    to work out which stimuli are active on each frame.
+
+A stimulus frame list is mostly long runs of the same value, so instead of one
+    int32 per frame we store one (start frame, length, sweep #) triplet per
+    sweep run.  Frames that aren't covered by a run are blank (-1).
+
+"""
+from bisect import bisect_right
+
+import numpy as np
+
+
+class FrameSchedule(object):
+    """
+    Compact replacement for a dense frame list.
+
+    Args:
+        starts (iterable): start frame of each run.  Must be increasing.
+        lengths (iterable): length of each run in frames.
+        sweeps (iterable): sweep # displayed during each run.
+        total_frames (int): total length of the schedule, including any
+            trailing blank frames.
+
+    """
+    def __init__(self, starts=(), lengths=(), sweeps=(), total_frames=0):
+        self.starts = np.asarray(starts, dtype=np.int64).reshape(-1)
+        self.lengths = np.asarray(lengths, dtype=np.int64).reshape(-1)
+        self.sweeps = np.asarray(sweeps, dtype=np.int32).reshape(-1)
+        self.total_frames = int(total_frames)
+
+        # plain lists are much faster than numpy for scalar bisection
+        self._starts = self.starts.tolist()
+        self._ends = (self.starts + self.lengths).tolist()
+        self._sweeps = self.sweeps.tolist()
+        self._hint = 0
+
+    @staticmethod
+    def from_sweeps(sweep_order, sweep_frames, blank_frames=0, start_frame=0,
+                    stop_frame=None):
+        """
+        Builds a schedule where each sweep in `sweep_order` is shown for
+            `sweep_frames` frames followed by `blank_frames` blank frames.
+            Mirrors `misc.build_frame_list`.
+        """
+        order = np.asarray(sweep_order, dtype=np.int32).reshape(-1)
+        period = sweep_frames + blank_frames
+        starts = start_frame + np.arange(len(order), dtype=np.int64)*period
+        lengths = np.full(len(order), sweep_frames, dtype=np.int64)
+        total_frames = start_frame + len(order)*period
+
+        if stop_frame is not None:
+            total_frames = max(min(total_frames, stop_frame), 0)
+            lengths = np.clip(total_frames - starts, 0, sweep_frames)
+
+        # blank sweeps and empty runs are just blank frames
+        keep = (order != -1) & (lengths > 0)
+        return FrameSchedule(starts[keep], lengths[keep], order[keep],
+                             total_frames)
+
+    @staticmethod
+    def from_frame_list(frame_list):
+        """
+        Encodes a dense frame list.
+        """
+        frame_list = np.asarray(frame_list, dtype=np.int32).reshape(-1)
+        if len(frame_list) == 0:
+            return FrameSchedule()
+        changes = np.flatnonzero(np.diff(frame_list)) + 1
+        starts = np.concatenate(([0], changes))
+        lengths = np.diff(np.concatenate((starts, [len(frame_list)])))
+        sweeps = frame_list[starts]
+        keep = sweeps != -1
+        return FrameSchedule(starts[keep], lengths[keep], sweeps[keep],
+                             len(frame_list))
+
+    def display(self, display_intervals, fps):
+        """
+        Lays this schedule out over a set of display intervals and returns the
+            result as a new schedule.  Mirrors `misc.apply_display_sequence`.
+
+        Args:
+            display_intervals (numpy.ndarray): Nx2 array of (start, stop) sec.
+            fps (float): display frame rate.
+
+        """
+        starts, stops = display_intervals[:, 0], display_intervals[:, 1]
+        shown = ((stops - starts)*fps).astype(np.int64)
+        consumed = np.minimum(np.cumsum(shown), self.total_frames)
+        base_starts = np.concatenate(([0], consumed[:-1]))
+        taken = consumed - base_starts
+        grey = np.zeros(len(display_intervals), dtype=np.int64)
+        grey[:-1] = np.clip(((starts[1:] - stops[:-1])*fps).astype(np.int64),
+                            0, None)
+        pad = int(fps*starts[0])
+        out_starts = pad + np.concatenate(([0], np.cumsum(taken + grey)[:-1]))
+
+        run_ends = self.starts + self.lengths
+        new_starts, new_lengths, new_sweeps = [], [], []
+        for lo, n, offset in zip(base_starts, taken, out_starts):
+            if n == 0:
+                continue
+            hi = lo + n
+            a = np.searchsorted(run_ends, lo, side='right')
+            b = np.searchsorted(self.starts, hi, side='left')
+            s = np.clip(self.starts[a:b], lo, hi)
+            e = np.clip(run_ends[a:b], lo, hi)
+            new_starts.append(s - lo + offset)
+            new_lengths.append(e - s)
+            new_sweeps.append(self.sweeps[a:b])
+
+        total_frames = pad + int(taken.sum() + grey.sum())
+        if not new_starts:
+            return FrameSchedule(total_frames=total_frames)
+        return FrameSchedule(np.concatenate(new_starts),
+                             np.concatenate(new_lengths),
+                             np.concatenate(new_sweeps),
+                             total_frames)
+
+    def get_total_frames(self):
+        """
+        Returns the total # of frames in the schedule.
+        """
+        return self.total_frames
+
+    def get_upcoming(self, frame, count):
+        """
+        Returns the sweeps of the (up to) `count` runs that start after
+            `frame`.
+        """
+        i = bisect_right(self._starts, frame)
+        return self._sweeps[i:i + count]
+
+    def __len__(self):
+        return self.total_frames
+
+    def __getitem__(self, frame):
+        """
+        Sweep # for a frame, -1 for blank frames.  Raises IndexError past the
+            end of the schedule, just like indexing a frame list.
+        """
+        if not 0 <= frame < self.total_frames:
+            raise IndexError("Frame %s outside of schedule." % frame)
+        # frames are almost always requested in order, so try the last run
+        #   and the one after it before bisecting
+        i = self._hint
+        starts = self._starts
+        if i < len(starts) and starts[i] <= frame:
+            if i + 1 < len(starts) and starts[i+1] <= frame:
+                i = bisect_right(starts, frame) - 1
+        else:
+            i = bisect_right(starts, frame) - 1
+        if i < 0:
+            return -1
+        self._hint = i
+        if frame < self._ends[i]:
+            return self._sweeps[i]
+        return -1
+
+    def to_array(self):
+        """
+        Materializes the dense frame list.
+
+        Returns:
+            numpy.ndarray: int32 array, -1 for blank frames and sweep #
+                otherwise.
+
+        """
+        frame_list = np.full(self.total_frames, -1, dtype=np.int32)
+        if len(self.starts):
+            offsets = np.repeat(self.starts - np.cumsum(self.lengths) +
+                                self.lengths, self.lengths)
+            frames = np.arange(self.lengths.sum()) + offsets
+            frame_list[frames] = np.repeat(self.sweeps, self.lengths)
+        return frame_list
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for k in ('_starts', '_ends', '_sweeps', '_hint'):
+            state.pop(k, None)
+        return state
+
+    def __setstate__(self, state):
+        self.__init__(state['starts'], state['lengths'], state['sweeps'],
+                      state['total_frames'])
+
+
+class ActiveStimulusScheduler(object):
+    """
+    Works out which stimuli need to be updated on each frame.
+
+    Stimuli with a `frame_schedule` only do anything during their sweep runs,
+        so they are only dispatched while a run contains the current frame.
+        Anything else (stimulus arrays, custom stimuli) is dispatched every
+        frame.  The frame range is split into segments over which the set of
+        active stimuli doesn't change, and each segment keeps the stimuli in
+        their original draw order.
+
+    Args:
+        stimuli (list): stimuli in draw order.
+
+    """
+    def __init__(self, stimuli):
+        self.stimuli = list(stimuli)
+
+        intervals = {}
+        boundaries = [np.zeros(1, dtype=np.int64)]
+        for i, stim in enumerate(self.stimuli):
+            schedule = getattr(stim, "frame_schedule", None)
+            if schedule is None:
+                continue
+            starts, ends = self._merge_runs(schedule)
+            intervals[i] = (starts, ends)
+            boundaries.extend((starts, ends))
+
+        # segment boundaries and which stimuli are active in each segment
+        self.boundaries = np.unique(np.concatenate(boundaries))
+        active = np.ones((len(self.stimuli), len(self.boundaries)), dtype=bool)
+        for i, (starts, ends) in intervals.items():
+            if len(starts) == 0:
+                active[i] = False
+                continue
+            j = np.searchsorted(starts, self.boundaries, side='right') - 1
+            active[i] = (j >= 0) & (self.boundaries < ends[np.maximum(j, 0)])
+
+        # segments with the same active set share one tuple
+        groups = {}
+        self.segments = []
+        for column in active.T:
+            key = column.tobytes()
+            if key not in groups:
+                groups[key] = tuple(s for s, a in zip(self.stimuli, column)
+                                    if a)
+            self.segments.append(groups[key])
+
+        self._boundaries = self.boundaries.tolist()
+        self._segment = 0
+
+    @staticmethod
+    def _merge_runs(schedule):
+        """
+        Merges back-to-back sweep runs into active intervals.
+
+        Returns:
+            tuple: (starts, ends) arrays of the active intervals.
+
+        """
+        starts, lengths = schedule.starts, schedule.lengths
+        keep = lengths > 0
+        starts, ends = starts[keep], (starts + lengths)[keep]
+        if len(starts) == 0:
+            return starts, ends
+        gaps = np.flatnonzero(starts[1:] > ends[:-1])
+        return (np.concatenate((starts[:1], starts[gaps + 1])),
+                np.concatenate((ends[gaps], ends[-1:])))
+
+    def get_active(self, frame):
+        """
+        Gets the stimuli that should be updated on this frame.
+
+        Args:
+            frame (int): frame number.
+
+        Returns:
+            tuple: active stimuli in draw order.
+
+        """
+        # frames are almost always requested in order
+        i = self._segment
+        boundaries = self._boundaries
+        if boundaries[i] <= frame:
+            if i + 1 < len(boundaries) and boundaries[i+1] <= frame:
+                i += 1
+                if i + 1 < len(boundaries) and boundaries[i+1] <= frame:
+                    i = bisect_right(boundaries, frame) - 1
+        else:
+            i = max(bisect_right(boundaries, frame) - 1, 0)
+        self._segment = i
+        return self.segments[i]
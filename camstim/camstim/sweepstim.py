@@ -17,20 +17,26 @@ import time
 import sys
 import socket
 import os
+import shutil
 import logging
 import math
-import shutil
-from collections import OrderedDict
+import io
+import threading
+import Queue
+from collections import OrderedDict, deque
 
 from psychopy import visual, event
 import numpy as np
 
 from stim import Stim
-from experiment import EObject, OutputFile
+from experiment import EObject, OutputFile, OutputStream, stream2pkl
 from synchro import SyncPulse, SyncSquare
 ##TODO: find better place for stuff in Core.py
 from misc import buildSweepTable, getSweepFrames, getConfig, wecanpicklethat, \
-    getMonitorInfo, getPlatformInfo, check_dirs, ImageStimNumpyuByte, CAMSTIM_DIR
+    SweepTable, getMonitorInfo, getPlatformInfo, check_dirs, ImageStimNumpyuByte, CAMSTIM_DIR
+from schedule import FrameSchedule, ActiveStimulusScheduler
+from movies import IndexedMovie, CachedMovie, get_frames_path, get_stager
+from profiler import FrameProfiler
 
 
 class Stimulus(EObject):
@@ -131,6 +137,44 @@ class Stimulus(EObject):
             self.sweep_params, self.runs, self.blank_sweeps)
         if self.shuffle:
             random.shuffle(self.sweep_order)
+        self._build_setters()
+
+    def _build_setters(self):
+        """
+        Resolves the setter for each sweep table dimension once, so that a new
+            sweep doesn't have to look them up by name.
+        """
+        self._setters = [self._get_setter(k) for k in self.dimnames]
+
+    def _get_setter(self, name):
+        """
+        Gets the function that applies a sweep param to the stimulus.  Uses the
+            psychopy stimulus' `set<name>` method if it has one.
+        """
+        set_function = getattr(self.stim, "set%s" % name, None)
+        if set_function is not None:
+            return set_function
+        elif name == 'TF':
+            return self._set_tf
+        elif name == 'PosX':
+            return self._set_pos_x
+        elif name == 'PosY':
+            return self._set_pos_y
+        else:
+            logging.warning("Sweep param incorrectly formatted: %s" % name)
+            return self._skip_param
+
+    def _set_tf(self, value):
+        self.on_draw['TF'] = value
+
+    def _set_pos_x(self, value):
+        self.stim.setPos((value, self.stim.pos[1]))
+
+    def _set_pos_y(self, value):
+        self.stim.setPos((self.stim.pos[0], value))
+
+    def _skip_param(self, value):
+        pass
 
     def _build_sweep_frames(self):
         """
@@ -142,7 +186,8 @@ class Stimulus(EObject):
 
     def _build_frame_list(self):
         """
-        Builds frame array.  Array is -1 for blank periods, and sweep # otherwise.
+        Builds the frame schedule.  Frames are -1 for blank periods, and sweep #
+            otherwise.
         """
 
         #we don't want to build a normal frame list if we have a custom
@@ -153,23 +198,27 @@ class Stimulus(EObject):
 
         self._build_sweep_frames()
 
-        seq = []
-
-        # start time
-        seq.extend([-1]*int(self.fps*self.start_time))
-
-        # sweeps
-        for index, sweep in enumerate(self.sweep_frames):
-            seq.extend([self.sweep_order[index]]*(int(sweep[1]-sweep[0]+1)))
-            seq.extend([-1]*int(self.fps*self.blank_length))
-
         # stop time?
         if self.stop_time:
             stop_frame = int(self.fps*self.stop_time)
-            seq = seq[:stop_frame]
+        else:
+            stop_frame = None
+
+        self.frame_schedule = FrameSchedule.from_sweeps(
+            self.sweep_order,
+            int(self.fps*self.sweep_length),
+            int(self.fps*self.blank_length),
+            int(self.fps*self.start_time),
+            stop_frame)
+        self.total_frames = self.frame_schedule.get_total_frames()
 
-        self.frame_list = np.array(seq, dtype=np.int32)
-        self.total_frames = len(self.frame_list)
+    @property
+    def frame_list(self):
+        """
+        Dense frame array built from the frame schedule.  Array is -1 for blank
+            periods, and sweep # otherwise.
+        """
+        return self.frame_schedule.to_array()
 
     def get_total_frames(self):
         """
@@ -179,7 +228,7 @@ class Stimulus(EObject):
             int: total frames in experiment.
 
         """
-        return len(self.frame_list)
+        return self.frame_schedule.get_total_frames()
 
     def get_total_time(self):
         """
@@ -210,7 +259,7 @@ class Stimulus(EObject):
         """
         self.current_frame = frame
         try:
-            sweep_number = self.frame_list[frame]
+            sweep_number = self.frame_schedule[frame]
         except IndexError:
             #stimulus finished
             return
@@ -222,25 +271,20 @@ class Stimulus(EObject):
             return
         else:
             #new sweep
-            # TODO: do this zip() operation elsewhere for performance
-            for k, v in zip(self.dimnames, self.sweep_table[
-                            sweep_number]):
-                try:
-                    set_function = getattr(self.stim, "set%s" % k)
-                    set_function(v)
-                except Exception as e:
-                    if k == 'TF':
-                        self.on_draw[k] = v
-                    elif k == 'PosX':
-                        self.stim.setPos((v, self.stim.pos[1]))
-                    elif k == 'PosY':
-                        self.stim.setPos((self.stim.pos[0], v))
-                    else:
-                        print("Sweep param incorrectly formatted:", k, v, e)
+            for set_function, v in zip(self._setters,
+                                       self.sweep_table[sweep_number]):
+                set_function(v)
         self._current_sweep = sweep_number
 
         self.draw()
 
+    def close(self):
+        """
+        Called once the session is over.  Releases anything the stimulus
+            holds on to (threads, files).
+        """
+        pass
+
     def draw(self):
         """
         Draws the stimulus.  Implements any "on_draw" effects.
@@ -327,8 +371,6 @@ class Stimulus(EObject):
                 Tuple or list of intervals in the form [(start, stop),...
 
         """
-        seq = []
-
         display_intervals = np.array(display_intervals)  # rectangular
 
         #ensure the display intervals are formatted correctly
@@ -350,33 +392,15 @@ class Stimulus(EObject):
             raise ValueError("Stops are not monotonically increasing.")
 
         #build the basic list assuming no gaps
-        seq0 = []
-
         self._build_sweep_frames()
 
-        for index, sweep in enumerate(self.sweep_frames):
-            seq0.extend([self.sweep_order[index]]*(int(sweep[1]-sweep[0]+1)))
-            seq0.extend([-1]*int(self.fps*self.blank_length))
+        seq0 = FrameSchedule.from_sweeps(self.sweep_order,
+                                         int(self.fps*self.sweep_length),
+                                         int(self.fps*self.blank_length))
 
         #create a new sequence that includes the display intervals
-        seq = []
-        s0 = display_intervals[0,0]  #first start
-        seq.extend([-1]*int(self.fps*s0))  #pad until first start
-
-        for i, (start, stop) in enumerate(display_intervals):
-            frames_to_add = int((stop-start)*self.fps)
-            seq.extend(seq0[:frames_to_add])
-            try:
-                next_start = display_intervals[i+1, 0]
-            except IndexError:
-                #end of sequence
-                break
-            grey_frames_to_add = int((next_start-stop)*self.fps)
-            seq.extend([-1]*grey_frames_to_add)
-            seq0 = seq0[frames_to_add:]
-
-        self.frame_list = np.array(seq, dtype=np.int32)
-        self.total_frames = len(self.frame_list)
+        self.frame_schedule = seq0.display(display_intervals, self.fps)
+        self.total_frames = self.frame_schedule.get_total_frames()
         self.display_sequence = display_intervals#.tolist()
 
     def package(self):
@@ -389,7 +413,16 @@ class Stimulus(EObject):
             self.sweep_params = self.sweep_params.keys()
         self_dict = self.__dict__
         self_dict['stim'] = str(self_dict['stim'])
-        return wecanpicklethat(self_dict)
+        output = wecanpicklethat(self_dict)
+        if isinstance(self.sweep_table, SweepTable):
+            # plain data, so that output files load without camstim.  The
+            #   table is itertools.product(*dimlist), in dimnames order.
+            output['sweep_table'] = {'dimnames': list(self.dimnames),
+                                     'dimlist': list(self.sweep_table.dimlist)}
+        # output files have always had the dense frame list
+        output.pop('frame_schedule', None)
+        output['frame_list'] = self.frame_list
+        return output
 
 class GratingStim(Stimulus):
     """
@@ -447,10 +480,79 @@ class GratingStim(Stimulus):
                                           save_sweep_table=True)
 
 
+class MovieReadAhead(object):
+    """
+    Reads upcoming frames of a memory-mapped numpy movie in a background
+        thread, so that they are in the OS page cache before they are drawn.
+        Reads go through a file handle, which releases the GIL, unlike page
+        faults on the memory map itself.
+
+    Args:
+        movie (numpy.memmap): movie loaded with `np.load(path, mmap_mode=...)`
+        path (str): path to the movie's .npy file
+
+    """
+    def __init__(self, movie, path):
+        self.path = path
+        self.offset = movie.offset
+        self.frame_bytes = movie[0].nbytes
+        self.n_frames = len(movie)
+        self._requests = Queue.Queue()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def request(self, frames):
+        """
+        Requests frames to be read.  Replaces any request not yet started.
+        """
+        self._requests.put(list(frames))
+
+    def close(self, timeout=1.0):
+        """
+        Stops the read thread, waiting up to `timeout` seconds for it to
+            finish the read it is doing.
+        """
+        self._requests.put(None)
+        self._thread.join(timeout)
+
+    def _run(self):
+        buf = bytearray(self.frame_bytes)
+        recent = deque()
+        with io.open(self.path, 'rb', buffering=0) as f:
+            while True:
+                frames = self._requests.get()
+                # skip to the latest request
+                while frames is not None and not self._requests.empty():
+                    frames = self._requests.get()
+                if frames is None:
+                    return
+                for frame in frames:
+                    if frame in recent or not 0 <= frame < self.n_frames:
+                        continue
+                    f.seek(self.offset + frame * self.frame_bytes)
+                    f.readinto(buf)
+                    recent.append(frame)
+                if len(recent) > 2 * len(frames):
+                    for _ in range(len(recent) - 2 * len(frames)):
+                        recent.popleft()
+
+
 class MovieStim(Stimulus):
     """
     A movie stimulus designed for playing Numpy uint8 movies of arbitrary
         size/resolution.
+
+    `mmap_mode` (ex: 'r') memory-maps the local copy of the movie instead of
+        loading it, so frames are paged in as they are drawn.  `read_ahead`
+        sets how many upcoming frames are read in the background.
+
+    Also plays indexed movies (.npz, see movies.py), whose frame arrays are
+        loaded once and shared between movies.
+
+    `frame_cache` (movies.FrameCache) keeps the frames that are shown in
+        memory, so that clips shown repeatedly are only read once.  Pass the
+        same cache to every movie of a session.
     """
     def __init__(self,
                  movie_path,
@@ -468,10 +570,15 @@ class MovieStim(Stimulus):
                  flip_v=False,
                  flip_h=False,
                  interpolate=False,
+                 mmap_mode=None,
+                 read_ahead=0,
+                 frame_cache=None,
                  ):
 
         self.movie_path = movie_path
         self.frame_length = frame_length
+        self.mmap_mode = mmap_mode
+        self.read_ahead = read_ahead
 
         movie_data = self.load_movie(movie_path)
 
@@ -483,8 +590,16 @@ class MovieStim(Stimulus):
                                                 flipVert=flip_v,
                                                 flipHoriz=flip_h,
                                                 interpolate=interpolate)
+        self._cached_movie = None
+        if frame_cache is not None:
+            self._cached_movie = CachedMovie(
+                movie_data, getattr(self, 'frames_local_path',
+                                    self.movie_local_path), frame_cache)
+            movie_frames = self._cached_movie
+        else:
+            movie_frames = movie_data
         sweep_params = {
-            'ReplaceImage': (movie_data, 0),
+            'ReplaceImage': (movie_frames, 0),
         }
         super(MovieStim, self).__init__(psychopy_stimulus,
                                         sweep_params,
@@ -498,47 +613,95 @@ class MovieStim(Stimulus):
                                         fps=fps,
                                         save_sweep_table=False)
 
+        # frame # in the frame array for each sweep, for indexed movies
+        self._frame_index = getattr(movie_data, 'index', None)
+        frames = getattr(movie_data, 'frames', movie_data)
+        self._read_ahead = None
+        if isinstance(frames, np.memmap) and read_ahead > 0:
+            self._read_ahead = MovieReadAhead(frames, frames.filename)
+
+    def update(self, frame):
+        """
+        Updates the movie.  Requests upcoming frames to be read ahead when a
+            new frame is shown.
+        """
+        last_sweep = self._current_sweep
+        super(MovieStim, self).update(frame)
+        if self._read_ahead is not None and self._current_sweep != last_sweep:
+            upcoming = self.frame_schedule.get_upcoming(frame, self.read_ahead)
+            if self._cached_movie is not None:
+                # no need to read frames that are already cached
+                upcoming = [i for i in upcoming
+                            if not self._cached_movie.is_cached(i)]
+            if self._frame_index is not None:
+                upcoming = self._frame_index[upcoming]
+            self._read_ahead.request(upcoming)
+
+    def close(self):
+        """
+        Stops reading ahead.
+        """
+        if self._read_ahead is not None:
+            self._read_ahead.close()
+            self._read_ahead = None
+
     def _local_copy(self, source):
         """
-        Creates a local copy of a movie.
+        Creates a local copy of a movie, or reuses a valid one.  Use
+            `movies.get_stager().stage(paths)` to copy the movies of a session
+            concurrently beforehand.
         """
-        filename = os.path.basename(source)
-        local_dir = os.path.join(CAMSTIM_DIR, "movies")
-        check_dirs(local_dir)
-        local_path = os.path.join(local_dir, filename)
-        if os.path.isfile(local_path):
-            print("Movie file already exists locally @ {}".format(local_path))
-        else:
-            print("Movie not saved locally, copying...")
-            shutil.copy(source, local_path)
-            print("... Done!")
-        return local_path
+        return get_stager().stage_file(source)
 
     def load_movie(self, path):
         """
-        Loads a movie from a specified path.  Currently only supports .npy files.
+        Loads a movie from a specified path.  Currently only supports .npy
+            files and indexed movies (.npz).
         """
         if path[-3:] == "npy":
             return self.load_numpy_movie(path)
+        elif path[-3:] == "npz":
+            return self.load_indexed_movie(path)
         else:
             raise IOError("Incorrect movie file type.")
 
     def load_numpy_movie(self, path):
         """
         Loads a numpy movie.  Ensures that it is read as a contiguous array and
-            three dimensional.
+            three dimensional.  Memory-maps it if `mmap_mode` is set.
         """
         self.movie_local_path = self._local_copy(path)
-        movie_data = np.ascontiguousarray(np.load(self.movie_local_path))
+        movie_data = np.load(self.movie_local_path, mmap_mode=self.mmap_mode)
+        if not movie_data.flags['C_CONTIGUOUS']:
+            if self.mmap_mode:
+                logging.warning("Movie isn't C-contiguous, can't memory-map "
+                                "it: {}".format(self.movie_local_path))
+            movie_data = np.ascontiguousarray(movie_data)
+
+        self._check_movie(movie_data)
+        return movie_data
 
-        # check shape/type
+    def load_indexed_movie(self, path):
+        """
+        Loads an indexed movie.  Copies its frame array locally as well, and
+            shares it with other movies that use it.
+        """
+        self.movie_local_path = self._local_copy(path)
+        self.frames_local_path = self._local_copy(get_frames_path(path))
+        movie_data = IndexedMovie.from_file(self.movie_local_path,
+                                            self.mmap_mode)
+        self._check_movie(movie_data)
+        return movie_data
+
+    def _check_movie(self, movie_data):
+        """
+        Checks shape/type of a movie.
+        """
         if movie_data.ndim != 3:
             raise ValueError("Movie must have 3 dimenstions: (t, y, x))")
         if not movie_data.dtype in [np.uint8, np.ubyte]:
             raise ValueError("Movie must be dtype numpy.uint8")
 
-        return movie_data
-
 class NaturalScenes(Stimulus):
     """
     Modified version of Stimulus class for natural scenes.  Has special sweep
@@ -645,7 +808,7 @@ class NaturalScenes(Stimulus):
         """
         self.current_frame = frame
         try:
-            sweep_number = self.frame_list[frame]
+            sweep_number = self.frame_schedule[frame]
         except IndexError:
             #stimulus finished
             return
@@ -732,6 +895,10 @@ class StimulusArray(Stimulus):
         for stim in self.stimuli:
             stim.update(frame)
 
+    def close(self):
+        for stim in self.stimuli:
+            stim.close()
+
     def package(self):
         self.stimuli = [stim.package() for stim in self.stimuli]
         return wecanpicklethat(self.__dict__)
@@ -783,6 +950,7 @@ class SweepStim(Stim):
         self.sweepstim_text = ""
 
         self.stimuli = []
+        self._scheduler = None
 
         for stim in stimuli:
             self.add_stimulus(stim)
@@ -793,6 +961,15 @@ class SweepStim(Stim):
 
         self.vsynccount = 0
 
+        self._headless = getattr(window, "headless", False)
+
+        if self.config['frame_profiler']:
+            self._profiler = FrameProfiler(self.config['frame_profiler_length'])
+        else:
+            self._profiler = None
+
+        self._output_stream = None
+
         #set up required submodules
         self._setup_syncpulse()
         self._setup_syncsquare()
@@ -910,6 +1087,7 @@ class SweepStim(Stim):
             self.stimuli.insert(index, stimulus)
         else:
             self.stimuli.append(stimulus)
+        self._scheduler = None
 
     def _load_stimulus(self, path):
         """
@@ -925,6 +1103,7 @@ class SweepStim(Stim):
             self.stimuli.pop(index)
         else:
             self.stimuli.remove(stimulus)
+        self._scheduler = None
 
     def add_item(self, item, name=""):
         """
@@ -966,8 +1145,12 @@ class SweepStim(Stim):
         self._setup_run()
 
         # experiment
+        if self._profiler:
+            update = self._profiled_update
+        else:
+            update = self.update
         for frame in range(self.total_frames):
-            self.update(frame)
+            update(frame)
 
         self._takedown_run()
 
@@ -990,6 +1173,10 @@ class SweepStim(Stim):
 
         #import pdb; pdb.set_trace()
         self.total_frames = self._count_total_frames()
+        self._build_scheduler()
+
+        if self.config['stream_output']:
+            self._setup_output_stream()
 
         self._printExpInfo()
 
@@ -1048,6 +1235,24 @@ class SweepStim(Stim):
         self.vsynccount += 1
         self._check_keys()
 
+    def _profiled_update(self, frame):
+        """
+        Same as `update` but records how long each phase of the frame takes.
+        """
+        timer = self._profiler.timer
+        t0 = timer()
+        self._update_stimuli(frame)
+        t1 = timer()
+        self._update_items(frame)
+        t2 = timer()
+        self.flip()
+        t3 = timer()
+        self.vsynccount += 1
+        self._check_keys()
+        t4 = timer()
+        self._profiler.record(frame, t0, t1, t2, t3, t4,
+                              getattr(self.window, "lastWarpDuration", 0.0))
+
     def flip(self):
         if self.framepulse:
             self.framepulse.set_high()
@@ -1057,15 +1262,63 @@ class SweepStim(Stim):
         if self.movie_output:
             self.window.getMovieFrame()
 
+    def _build_scheduler(self):
+        """
+        Precomputes which stimuli are active on each frame.  Needs to be
+            rebuilt if the stimuli or their display sequences change.
+        """
+        self._scheduler = ActiveStimulusScheduler(self.stimuli)
+
     def _update_stimuli(self, frame):
-        for stim in self.stimuli:
+        if self._scheduler is None:
+            self._build_scheduler()
+        for stim in self._scheduler.get_active(frame):
             stim.update(frame)
 
     def _update_items(self, frame):
         for item in self.items.values():
             item.update(frame)
+        if self._output_stream:
+            self._output_stream.update(frame)
+
+    def _get_output_path(self, ext):
+        """
+        Output file path for the script, in CAMSTIM_DIR/output.
+        """
+        return os.path.join(CAMSTIM_DIR, "output", os.path.splitext(
+            os.path.basename(self.script))[0] + ext)
+
+    def _setup_output_stream(self):
+        """
+        Starts streaming the session's frame intervals and item data (encoder
+            dx, licks, rewards...) to disk.  See experiment.OutputStream.
+        """
+        path = self._get_output_path(".stream")
+        if os.path.isfile(path):
+            path = os.path.join(os.path.dirname(path),
+                                datetime.datetime.now().strftime('%y%m%d%H%M%S')
+                                + "-" + os.path.basename(path))
+            logging.warning("File path already exists, streaming to: {}".format(path))
+        self._output_stream = OutputStream(path, self.config['stream_chunk_frames'])
+        for source in self.stream_sources():
+            self._output_stream.add_source(*source)
+        logging.info("streaming output to %s" % path)
+
+    def stream_sources(self):
+        """
+        Lists that grow during the session, see EObject.stream_sources.
+        """
+        sources = [(("intervalsms",), self.window, "frameIntervals", 1000)]
+        for name, item in self.items.iteritems():
+            if hasattr(item, "stream_sources"):
+                for source in item.stream_sources():
+                    sources.append((("items", name) + source[0],) + source[1:])
+        return sources
 
     def _check_keys(self):
+        if self._headless:
+            # no keyboard without a window
+            return
         for keys in event.getKeys(timeStamped=True):
             if keys[0]in ['escape', 'q']:
                 self.escape_pressed = True
@@ -1134,9 +1387,13 @@ class SweepStim(Stim):
         self.stopdatetime = datetime.datetime.now()
         print("Actual experiment duration: %s" % timestr)
         print("Actual vsync count: %i" % self.vsynccount)
+        print("Actual frame rate: %.1f frames/sec" % (
+            self.vsynccount/max(self.stop_time-self.start_time, 1e-9)))
         print("Actual end time: %s" % str(self.stopdatetime))
 
         self.printFrameInfo()  #also saves intervalsms
+        if self._profiler:
+            self._profiler.print_report()
 
         self._cleanup()
 
@@ -1149,6 +1406,8 @@ class SweepStim(Stim):
         """
         self.items = OrderedDict({k: v.package() for k, v in self.items.iteritems()})
         self.stimuli = [stim.package() for stim in self.stimuli]
+        if self._profiler:
+            self.frame_timing = self._profiler.package()
 
         self.scripttext = open(self.script, 'r').read()
         self.monitor = getMonitorInfo(self.monitor)
@@ -1169,36 +1428,67 @@ class SweepStim(Stim):
         for i in self.items.values():
             i.close()
 
+        for stim in self.stimuli:
+            stim.close()
+
         #save output
         self._save_output()
 
+    def _backup_output(self, path):
+        """
+        Copies an output file to backupdir/<mouseid>/output.  If a backup with
+            the same name exists the copy's name is prefixed with the date and
+            time, like the output file itself.  Returns the backup's path.
+        """
+        mouse_dir = os.path.join(self.config['backupdir'],
+                                 self.config['mouseid']+"/output")
+        if not os.path.isdir(mouse_dir):
+            os.makedirs(mouse_dir)
+        filename = os.path.basename(path)
+        backup_path = os.path.join(mouse_dir, filename)
+        if os.path.exists(backup_path):
+            backup_path = os.path.join(mouse_dir,
+                                       datetime.datetime.now().strftime('%y%m%d%H%M%S')
+                                       + "-" + filename)
+            logging.warning("Backup path already exists, backing up to: {}".format(backup_path))
+        logging.info("Backing up output at %s" % backup_path)
+        shutil.copy(path, backup_path)
+        logging.info("Backup complete!")
+        return backup_path
+
     def _save_output(self):
         """
         Saves the experiment data to a file.
         """
         packaged = self.package()
-        packaged = wecanpicklethat(packaged)
 
-        output_file = OutputFile()
-        #_ = [pprint.pprint(item) for item in wecanpicklethat(self.__dict__).items()]
-        output_file.add_data(packaged)
+        backupdir = self.config['backupdir']
+        mouseid = self.config['mouseid']
+
+        if self._output_stream:
+            # already on disk, no need to check them
+            self._output_stream.pop_streamed(packaged)
+            output_path = self._output_stream.path
+            logging.info("finishing output stream at %s..." % output_path)
+            self._output_stream.close(wecanpicklethat(packaged))
+            logging.info("output saved successfully!")
+            if backupdir:
+                self._backup_output(output_path)
+        else:
+            output_file = OutputFile()
+            #_ = [pprint.pprint(item) for item in wecanpicklethat(self.__dict__).items()]
+            output_file.add_data(packaged)
 
-        output_filename = os.path.splitext(os.path.basename(self.script))[0] + ".pkl"
-        logdir = os.path.join(CAMSTIM_DIR, 'output')
-        output_path = os.path.join(logdir, output_filename)
+            output_path = self._get_output_path(".pkl")
 
-        logging.info("saving pkl file at %s..." % output_path)
-        output_file.save(output_path)
-        logging.info("output saved successfully!")
+            logging.info("saving pkl file at %s..." % output_path)
+            output_file.save(output_path)
+            logging.info("output saved successfully!")
+            # prefixed with the date and time if the path was taken
+            output_path = output_file.path
 
-        backupdir = self.config['backupdir']
-        mouseid = self.config['mouseid']
-        if backupdir:
-            mouse_dir = os.path.join(backupdir, mouseid+"/output")
-            backup_path = os.path.join(mouse_dir, output_filename)
-            logging.info("Backing up pkl file at %s" % backup_path)
-            output_file.save(backup_path)
-            logging.info("Backup complete!")
+            if backupdir:
+                self._backup_output(output_path)
 
         # LIMS
         lims_upload = self.lims_config['lims_upload']
@@ -1208,7 +1498,10 @@ class SweepStim(Stim):
             from foraging import LimsBehaviorUpload
             lbi = LimsBehaviorUpload(mouseid, dummy=lims_dummy)
             summary = {}  # for now
-            success = lbi.upload(output_file.path, summary)
+            if self._output_stream:
+                # LIMS takes .pkl files
+                output_path = stream2pkl(output_path)
+            success = lbi.upload(output_path, summary)
             if success:
                 logging.info("LIMS upload complete!")
             else:
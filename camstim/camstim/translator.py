@@ -5,18 +5,36 @@ Translates new-style trials into old ones.
 
 Useful for backwards compatibility with old behavior code.
 
+The stimulus log, response log and rewards of a translated file are
+    structured arrays (one row per frame, lick or reward), unless the
+    translator is made with `legacy_logs=True`.
+
 """
 import datetime
 import pickle
 
 import numpy as np
 
+STIM_LOG_DTYPE = np.dtype([('frame', np.int64), ('state', np.bool_),
+                           ('ori', np.float64)])
+RESPONSE_LOG_DTYPE = np.dtype([('frame', np.int64)])
+REWARD_DTYPE = np.dtype([('time', np.float64), ('frame', np.int64)])
+HEADLESS_INTERVAL_MS = 16.0  # vsync interval used when there were no graphics
+
 
 class TrialTranslator(object):
-    """ 
+    """ Translates new-style trials and output files.
+
+    Args:
+        task (object): unused
+        legacy_logs (bool): build the stimulus and response logs as lists of
+            dicts (one per frame or lick), rewards as an (n, 2) float array
+            and vsync intervals as a list, like older versions did.
+
     """
-    def __init__(self, task=None):
+    def __init__(self, task=None, legacy_logs=False):
         self._task = task
+        self.legacy_logs = legacy_logs
 
     def translate_trial(self, new_trial):
         """ Creates an old-style (forating 1) trial out of a new trial
@@ -74,16 +92,21 @@ class TrialTranslator(object):
         if len(intervals) == 0:
             # ran headless (no graphics)
             vsyncs = exp_data['items']['behavior']['update_count']
-            intervals = [16.0] * vsyncs
-        return intervals
+            if self.legacy_logs:
+                return [HEADLESS_INTERVAL_MS] * vsyncs
+            return np.full(vsyncs, HEADLESS_INTERVAL_MS)
+        if self.legacy_logs:
+            return intervals
+        return np.asarray(intervals, dtype=np.float64)
 
     def find_rewards(self, exp_data):
         """ Finds array of reward [time, frame]
         """
         trials = self.find_trial_logs(exp_data)
-        rewards = np.array([t['rewards'][0] for t in trials if t['rewards']],
-                           dtype=np.float)
-        return rewards
+        rewards = [tuple(t['rewards'][0]) for t in trials if t['rewards']]
+        if self.legacy_logs:
+            return np.array(rewards, dtype=np.float)
+        return np.array(rewards, dtype=REWARD_DTYPE)
 
     def find_licks(self, exp_data):
         """ Finds frames where licks occurred?
@@ -98,26 +121,32 @@ class TrialTranslator(object):
         return exp_data['items']['behavior']['encoders'][0]['dx']
 
     def make_stim_log(self, exp_data):
-        """
+        """ Stimulus state for each vsync.  See STIM_LOG_DTYPE.
         """
         vsyncs = exp_data['items']['behavior']['update_count']
         draw_log = exp_data['items']['behavior']['stimuli'].items()[0][1]['draw_log'] #GROSS
-        log = []
-        for i in range(vsyncs):
-            entry = {
-                'frame': i,
-                'state': bool(draw_log[i]),
-                'ori': 0,
-            }
-            log.append(entry)
+        if self.legacy_logs:
+            log = []
+            for i in range(vsyncs):
+                entry = {
+                    'frame': i,
+                    'state': bool(draw_log[i]),
+                    'ori': 0,
+                }
+                log.append(entry)
+            return log
+        log = np.zeros(vsyncs, dtype=STIM_LOG_DTYPE)
+        log['frame'] = np.arange(vsyncs)
+        log['state'] = np.asarray(draw_log)[log['frame']].astype(np.bool_)
         return log
 
     def make_response_log(self, exp_data):
-        """ 
+        """ Frame of each response.  See RESPONSE_LOG_DTYPE.
         """
         licks = self.find_licks(exp_data)
-        log = [{'frame': i} for i in licks]
-        return log
+        if self.legacy_logs:
+            return [{'frame': i} for i in licks]
+        return np.array([(i,) for i in licks], dtype=RESPONSE_LOG_DTYPE)
 
     def translate_file(self, new_data, output_path=""):
         """ 
@@ -126,6 +155,8 @@ class TrialTranslator(object):
             # TODO: prepare for non-pickle files? zipped files?
             with open(new_data, 'rb') as f:
                 data = pickle.load(f)
+        else:
+            data = new_data
 
         try:
             data['items']['behavior']
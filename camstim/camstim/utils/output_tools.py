@@ -1,9 +1,34 @@
 """
+output_tools.py
+
+Extracts the type schema of output files (every value replaced by its type),
+    and compares them to the output spec to find schema drift.  Files are
+    read in parallel, one at a time per process, and schemas are cached by
+    file hash so that each output is only read once.
+
+>python -m camstim.utils.output_tools C:/camstim/output
+>python -m camstim.utils.output_tools session1.pkl session2.pkl --processes 4
+>python -m camstim.utils.output_tools session.pkl --dump
+
 """
-import pickle
+import os
+import sys
+import glob
+import hashlib
+import argparse
+import tempfile
+import multiprocessing
+import cPickle as pickle
+from collections import OrderedDict
 
 import yaml
 
+SCHEMA_CACHE_DIR = os.path.join(os.path.expanduser('~/camstim/'),
+                                "schema_cache")
+SCHEMA_VERSION = 1  # bump when the schemas change
+SPEC_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..",
+                         "..", "docs", "spec", "annotated_doc_output_spec.yaml")
+
 
 def dict2types(input_dict):
     """ Converts a dictionary into a matching dictionary
@@ -37,9 +62,14 @@ def list2types(input_list):
     return output_list
 
 def item2typestr(item):
-    typestr = str(type(item))
-    return typestr.lstrip("<type '").rstrip("'>").replace("NoneType", "None")
-    
+    """ Type name of an item, with its module unless it is a builtin. """
+    t = type(item)
+    if t is type(None):
+        return "None"
+    if t.__module__ == "__builtin__":
+        return t.__name__
+    return "{}.{}".format(t.__module__, t.__name__)
+
 
 def output2types(path):
     """ Converts an output file to a type dict.
@@ -49,11 +79,183 @@ def output2types(path):
     return dict2types(data)
 
 
+def file_hash(path, blocksize=1024*1024):
+    """ SHA1 of a file's contents. """
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(blocksize), b""):
+            sha1.update(block)
+    return sha1.hexdigest()
+
+
+def cached_output2types(path, cache_dir=SCHEMA_CACHE_DIR):
+    """ Like `output2types`, but the schema is cached by the file's hash.
+            Set `cache_dir` to None to skip the cache.
+    """
+    if cache_dir is None:
+        return output2types(path)
+    key = "{}_{}".format(SCHEMA_VERSION, file_hash(path))
+    cache_path = os.path.join(cache_dir, key + ".pkl")
+    try:
+        with open(cache_path, 'rb') as f:
+            return pickle.load(f)
+    except Exception:
+        pass  # not cached, or a bad cache file
+    schema = output2types(path)
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+    # written to a temp file first, so that a partly written file is never
+    #   loaded
+    fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix=".tmp")
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(schema, f, pickle.HIGHEST_PROTOCOL)
+        if os.path.exists(cache_path):
+            os.remove(cache_path)  # os.rename doesn't replace on Windows
+        os.rename(tmp_path, cache_path)
+    except:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return schema
+
+
+def load_spec(path=SPEC_PATH):
+    """ Loads an output spec (a type schema written by hand, in yaml). """
+    with open(path, 'r') as f:
+        return yaml.safe_load(f)
+
+
+def _typestr(schema):
+    if isinstance(schema, dict):
+        return "dict"
+    if isinstance(schema, list):
+        return "list"
+    return str(schema)
+
+
+def diff_schema(schema, spec, path=""):
+    """ Compares a type schema to a spec.
+
+    In the spec, an empty dict or list means any dict or list, and list items
+        are compared to the spec's items in order, its last item repeating
+        ("[float, ...]" is a list of floats).  List indices are left out of
+        the paths, so each difference is listed once.
+
+    Returns:
+        list: (path, difference, expected, found), where difference is
+            "missing", "extra" or "type".
+
+    """
+    diffs = []
+    if isinstance(spec, dict) and isinstance(schema, dict):
+        if not spec:
+            return diffs
+        for k, v in spec.iteritems():
+            key_path = "{}/{}".format(path, k)
+            if k not in schema:
+                diffs.append((key_path, "missing", _typestr(v), None))
+            else:
+                diffs.extend(diff_schema(schema[k], v, key_path))
+        for k, v in schema.iteritems():
+            if k not in spec:
+                diffs.append(("{}/{}".format(path, k), "extra", None,
+                              _typestr(v)))
+    elif isinstance(spec, list) and isinstance(schema, list):
+        items = [i for i in spec if i != "..."]
+        if items:
+            for i, item in enumerate(schema):
+                diffs.extend(diff_schema(item, items[min(i, len(items)-1)],
+                                         path + "/[]"))
+    elif _typestr(spec) != _typestr(schema):
+        diffs.append((path or "/", "type", _typestr(spec), _typestr(schema)))
+    # drop repeats from list items
+    return list(OrderedDict.fromkeys(diffs))
+
+
+def _file_schema(args):
+    """ Pool worker: (path, schema, error) for one output file. """
+    path, cache_dir = args
+    try:
+        return path, cached_output2types(path, cache_dir), None
+    except Exception as e:
+        return path, None, "{}: {}".format(type(e).__name__, e)
+
+
+def iter_schemas(paths, processes=None, cache_dir=SCHEMA_CACHE_DIR):
+    """ Yields (path, schema, error) for output files as they are read, in
+            parallel.  Each process reads one file at a time.
+    """
+    tasks = [(path, cache_dir) for path in paths]
+    if processes == 1:
+        for task in tasks:
+            yield _file_schema(task)
+        return
+    pool = multiprocessing.Pool(processes)
+    try:
+        for result in pool.imap_unordered(_file_schema, tasks, chunksize=1):
+            yield result
+    finally:
+        pool.terminate()
+
+
+def find_outputs(paths):
+    """ Output files in a list of files and folders. """
+    found = []
+    for path in paths:
+        if os.path.isdir(path):
+            found.extend(sorted(glob.glob(os.path.join(path, "*.pkl"))))
+        else:
+            found.append(path)
+    return found
+
+
 def main():
-    path = r"C:\Users\derricw\camstim\output\180215141113.pkl"
-    type_dict = output2types(path)
-    with open("test.yaml", 'w') as f:
-        yaml.dump(type_dict, f)
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("outputs", nargs="+",
+                        help="output files, or folders of .pkl files")
+    parser.add_argument("--spec", default=SPEC_PATH)
+    parser.add_argument("--processes", type=int, default=None,
+                        help="defaults to the # of cpus")
+    parser.add_argument("--cache_dir", default=SCHEMA_CACHE_DIR)
+    parser.add_argument("--no_cache", action="store_true")
+    parser.add_argument("--dump", action="store_true",
+                        help="print the schemas (yaml) instead of comparing "
+                             "them to the spec")
+    args = parser.parse_args()
+
+    paths = find_outputs(args.outputs)
+    cache_dir = None if args.no_cache else args.cache_dir
+    spec = None if args.dump else load_spec(args.spec)
+
+    counts = OrderedDict()  # difference: # of files
+    n_read = 0
+    for path, schema, error in iter_schemas(paths, args.processes, cache_dir):
+        if error:
+            print("{}: could not read ({})".format(path, error))
+            continue
+        n_read += 1
+        if args.dump:
+            print("# {}".format(path))
+            yaml.safe_dump(schema, sys.stdout, default_flow_style=False)
+            continue
+        diffs = diff_schema(schema, spec)
+        print("{}: {} differences".format(path, len(diffs)))
+        for diff in diffs:
+            counts[diff] = counts.get(diff, 0) + 1
+
+    if not args.dump:
+        print("\n{} of {} files read".format(n_read, len(paths)))
+        for (path, difference, expected, found), count in sorted(
+                counts.iteritems(), key=lambda item: item[0][0]):
+            if difference == "missing":
+                types = expected
+            elif difference == "extra":
+                types = found
+            else:
+                types = "spec: {}, output: {}".format(expected, found)
+            print("{:>5} files  {:<7} {}  ({})".format(count, difference,
+                                                      path, types))
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,108 @@
+"""
+warp_cache.py
+
+Pre-computes the warp meshes of a rig, so that windows load them from the warp
+    cache instead of computing them.  Defaults are read from stim.cfg (in the
+    current folder), like window creation does.
+
+>python -m camstim.utils.warp_cache
+>python -m camstim.utils.warp_cache --warp Spherical --eyepoint 0.5 0.5 --eyepoint 0.5 0.4
+>python -m camstim.utils.warp_cache --warpfile projector.data
+
+"""
+import argparse
+import time
+
+from psychopy import monitors
+
+from camstim.window import Warp, WindowSettingsFromStimCfg, warpCacheKey, \
+    loadWarpMesh, loadWarpfile, warpfileCachePath, WARP_CACHE_DIR
+
+GRID_WARPS = {
+    'Spherical': Warp.Spherical,
+    'Cylindrical': Warp.Cylindrical,
+    'Curvilinear': Warp.Curvilinear,
+}
+
+
+def monitor_dimensions(monitor_name, size=None):
+    """
+    Gets the (width, height, distance) in cm used for a monitor's warp, the
+        same way Window does.
+
+    Args:
+        monitor_name (str): psychopy monitor name.
+        size (tuple): window size (pix).  Defaults to the monitor's size.
+    """
+    monitor = monitors.Monitor(monitor_name)
+    w, h = size or monitor.getSizePix()
+    dist_cm = monitor.getDistance()
+    if dist_cm is None:
+        dist_cm, width_cm = 30.0, 50.0
+    else:
+        width_cm = monitor.getWidth()
+    return width_cm, width_cm / (float(w) / h), dist_cm
+
+
+def warm(monitor_name, warp, eyepoints, gridsize=300, size=None,
+         cache_dir=WARP_CACHE_DIR):
+    """
+    Computes and caches the meshes for each eyepoint.
+    """
+    width_cm, height_cm, dist_cm = monitor_dimensions(monitor_name, size)
+    for eyepoint in eyepoints:
+        args = (width_cm, height_cm, dist_cm, eyepoint, gridsize, gridsize,
+                warp)
+        t0 = time.time()
+        loadWarpMesh(*args, cache_dir=cache_dir)
+        print("{} {} eyepoint={}: {} ({:.3f} s)".format(
+            monitor_name, Warp.asString(warp), tuple(eyepoint),
+            warpCacheKey(*args), time.time() - t0))
+
+
+def warm_warpfile(path, cache_dir=WARP_CACHE_DIR):
+    """
+    Reads a text warpfile into the warp cache.
+    """
+    t0 = time.time()
+    filetype, cols, rows, warpdata = loadWarpfile(path, cache_dir)
+    print("{} ({}x{}): {} ({:.3f} s)".format(
+        path, cols, rows, warpfileCachePath(path, cache_dir),
+        time.time() - t0))
+
+
+def main():
+    settings = WindowSettingsFromStimCfg()
+    default_warp = Warp.asString(settings.warp)
+    if default_warp not in GRID_WARPS:
+        default_warp = 'Spherical'
+
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("--monitor", default=settings.monitor)
+    parser.add_argument("--warp", default=default_warp,
+                        choices=sorted(GRID_WARPS))
+    parser.add_argument("--eyepoint", nargs=2, type=float, action='append',
+                        help="x y, as fractions of the monitor size.  Can be "
+                             "given more than once.")
+    parser.add_argument("--gridsize", type=int, default=300)
+    parser.add_argument("--size", nargs=2, type=int,
+                        help="window size (pix), defaults to monitor size")
+    parser.add_argument("--warpfile", help="text warpfile to cache instead "
+                        "of a grid warp.  Defaults to stim.cfg's if its warp "
+                        "is Warp.Warpfile.")
+    parser.add_argument("--cache_dir", default=WARP_CACHE_DIR)
+    args = parser.parse_args()
+
+    warpfile = args.warpfile
+    if warpfile is None and settings.warp == Warp.Warpfile:
+        warpfile = settings.warpfile
+    if warpfile:
+        warm_warpfile(warpfile, args.cache_dir)
+        return
+    warm(args.monitor, GRID_WARPS[args.warp],
+         args.eyepoint or [settings.eyepoint], args.gridsize, args.size,
+         args.cache_dir)
+
+
+if __name__ == "__main__":
+    main()
@@ -3,6 +3,9 @@
 
 import sys
 import os
+import hashlib
+import tempfile
+from timeit import default_timer
 
 # Ensure setting pyglet.options['debug_gl'] to False is done prior to any
 # other calls to pyglet or pyglet submodules, otherwise it may not get picked
@@ -92,6 +95,11 @@ from OpenGL.arrays import ArrayDatatype as ADT
 from psychopy import visual, monitors
 import ConfigParser
 
+from misc import CAMSTIM_DIR
+
+WARP_CACHE_DIR = os.path.join(CAMSTIM_DIR, "warp_cache")
+WARP_CACHE_VERSION = 1  # change if the mesh computation changes
+
 # DW Set up default monitor
 test_mon = monitors.Monitor("testMonitor")
 if not test_mon.getSizePix():
@@ -122,6 +130,272 @@ class Warp(tuple):
          if warp == Warp.Warpfile: return 'Warpfile'
          return 'Invalid warp value'
 
+class WarpRenderer(tuple):
+    Quads = 0       # four vertices per grid cell, GL_QUADS
+    Indexed = 1     # shared grid vertices, indexed GL_TRIANGLES
+
+
+def warpGrid(width_cm, height_cm, dist_cm, eyepoint, xgrid, ygrid, warp):
+    '''
+    Computes the vertex and texture coordinates of a warp grid.
+
+    Args:
+        width_cm, height_cm: monitor size.
+        dist_cm: eye distance from the monitor.
+        eyepoint: (x, y) eye position, as a fraction of the monitor size.
+        xgrid, ygrid: # of grid points.  Must be equal.
+        warp: Warp.Spherical, Warp.Cylindrical or Warp.Curvilinear.
+
+    Returns:
+        x_coords, y_coords, u_coords, v_coords: (ygrid, xgrid) arrays of the
+            vertex (-1 to 1) and texture (0 to 1) coordinates of each point.
+    '''
+    # eye position in cm
+    xEye = eyepoint[0] * width_cm
+    yEye = eyepoint[1] * height_cm
+
+    # vertex points are spaced equal distances apart
+    equalDistanceX = np.linspace(0, width_cm, xgrid)
+    equalDistanceY = np.linspace(0, height_cm, ygrid)
+
+    # vertex coordinates
+    x_c = np.linspace(-1.0,1.0,xgrid)
+    y_c = np.linspace(-1.0,1.0,ygrid)
+    x_coords, y_coords = np.meshgrid(x_c,y_c)
+
+    x = np.zeros(((xgrid), (ygrid)),dtype='float32')
+    y = np.zeros(((xgrid), (ygrid)),dtype='float32')
+
+    x[:,:] = equalDistanceX - xEye
+    y[:,:] = equalDistanceY - yEye
+    y = np.transpose(y)
+
+    r = np.sqrt(np.square(x) + np.square(y) + np.square(dist_cm))
+
+    azimuth = np.arctan(x / dist_cm)
+    altitude = np.arcsin(y / r)
+
+    # calculate the texture coordinates
+    if warp == Warp.Cylindrical:
+        tx = dist_cm * np.sin(azimuth)
+        ty = dist_cm * np.sin(altitude)
+    else:
+        tx = dist_cm * (1 + x / r)- dist_cm
+        ty = dist_cm * (1 + y / r) - dist_cm
+
+    # prevent div0
+    azimuth[azimuth==0] = np.finfo(np.float32).eps
+    altitude[altitude==0] = np.finfo(np.float32).eps
+
+    # the texture coordinates (which are now lying on the sphere)
+    # need to be remapped back onto the plane of the display.
+    # This effectively stretches the coordinates away from the eyepoint.
+    if warp == Warp.Spherical:
+        centralAngle = np.arccos (np.cos(altitude) * np.cos(np.abs(azimuth)))
+        # distance from eyepoint to texture vertex
+        arcLength = centralAngle * dist_cm
+        # remap the texture coordinate
+        theta = np.arctan2(ty, tx)
+        tx = arcLength * np.cos(theta)
+        ty = arcLength * np.sin(theta)
+    else:
+        # cylindrical, or curvilinear: map texture onto the x, y plane
+        tx = tx * azimuth / np.sin(azimuth)
+        ty = ty * altitude / np.sin(altitude)
+
+    u_coords = tx / width_cm + 0.5
+    v_coords = ty / height_cm + 0.5
+    return x_coords, y_coords, u_coords, v_coords
+
+
+def quadsFromGrid(*grids):
+    '''
+    Assembles the cells of (rows, cols) grids into quads.  Each cell's corners
+        are (y, x), (y, x+1), (y+1, x+1), (y+1, x), cells are in row order.
+
+    Returns:
+        float32 array with one row per quad corner and one column per grid.
+    '''
+    rows, cols = grids[0].shape
+    quads = np.zeros(((cols-1)*(rows-1)*4, len(grids)), dtype='float32')
+    for i, grid in enumerate(grids):
+        corners = np.stack((grid[:-1, :-1], grid[:-1, 1:],
+                            grid[1:, 1:], grid[1:, :-1]), axis=-1)
+        quads[:, i] = corners.reshape(-1)
+    return quads
+
+
+def warpfileQuads(warpdata, cols, rows):
+    '''
+    Assembles the quads of a warpfile's (cols*rows, 5) data: x, y, u, v,
+        opacity of each point, in row order.
+
+    Returns:
+        vertices, tcoords, opacity (RGBA) float32 arrays, one row per quad
+            corner.
+    '''
+    grid = warpdata.reshape(rows, cols, 5)
+    quads = quadsFromGrid(*[grid[:, :, i] for i in range(5)])
+    opacity = np.ones((len(quads), 4), dtype='float32')
+    opacity[:, 3] = quads[:, 4]
+    return quads[:, 0:2].copy(), quads[:, 2:4].copy(), opacity
+
+
+def gridFromQuads(quads, rows, cols):
+    '''
+    Inverse of quadsFromGrid: recovers the (rows*cols, n) grid points, in row
+        order, from the corners of the grid's quads.
+    '''
+    corners = quads.reshape(rows-1, cols-1, 4, -1)
+    grid = np.zeros((rows, cols, quads.shape[1]), dtype=quads.dtype)
+    grid[:-1, :-1] = corners[:, :, 0]   # (y, x)
+    grid[:-1, -1] = corners[:, -1, 1]   # (y, x+1) of the last column
+    grid[-1, -1] = corners[-1, -1, 2]   # (y+1, x+1) of the last cell
+    grid[-1, :-1] = corners[-1, :, 3]   # (y+1, x) of the last row
+    return grid.reshape(rows*cols, -1)
+
+
+def gridIndices(rows, cols):
+    '''
+    Indices of the triangles of a grid's cells, two per cell: (y, x),
+        (y, x+1), (y+1, x+1) and (y, x), (y+1, x+1), (y+1, x).
+
+    Returns:
+        uint32 array, three indices per triangle.
+    '''
+    index = np.arange(rows*cols, dtype=np.uint32).reshape(rows, cols)
+    a, b = index[:-1, :-1], index[:-1, 1:]
+    c, d = index[1:, 1:], index[1:, :-1]
+    return np.stack((a, b, c, a, c, d), axis=-1).reshape(-1)
+
+
+def warpCacheKey(width_cm, height_cm, dist_cm, eyepoint, xgrid, ygrid, warp):
+    '''
+    Hash of the parameters a grid warp mesh is computed from.
+    '''
+    params = (WARP_CACHE_VERSION, Warp.asString(warp), float(width_cm),
+              float(height_cm), float(dist_cm), float(eyepoint[0]),
+              float(eyepoint[1]), int(xgrid), int(ygrid))
+    return hashlib.sha1(repr(params)).hexdigest()
+
+
+def loadWarpMesh(width_cm, height_cm, dist_cm, eyepoint, xgrid, ygrid, warp,
+                 cache_dir=WARP_CACHE_DIR):
+    '''
+    Gets the quads of a grid warp (see warpGrid) from the warp cache, or
+        computes them and adds them to the cache.  Flips aren't applied, so
+        flipped and unflipped windows share meshes.
+
+    Returns:
+        vertices, tcoords: float32 arrays, one row per quad corner.
+    '''
+    args = (width_cm, height_cm, dist_cm, eyepoint, xgrid, ygrid, warp)
+    path = os.path.join(cache_dir, warpCacheKey(*args) + ".npz")
+    if os.path.isfile(path):
+        try:
+            with np.load(path) as data:
+                return data['vertices'], data['tcoords']
+        except Exception as e:
+            logging.warning("Unable to read warp cache {}: {}".format(path, e))
+
+    x_coords, y_coords, u_coords, v_coords = warpGrid(*args)
+    vertices = quadsFromGrid(x_coords, y_coords)
+    tcoords = quadsFromGrid(u_coords, v_coords)
+    try:
+        saveCacheFile(path, vertices=vertices, tcoords=tcoords)
+    except (IOError, OSError) as e:
+        logging.warning("Unable to write warp cache {}: {}".format(path, e))
+    return vertices, tcoords
+
+
+def saveCacheFile(path, **arrays):
+    '''
+    Saves arrays to a warp cache .npz file.  Written to a temp file first, so
+        that a partly written file is never loaded.
+    '''
+    cache_dir = os.path.dirname(path)
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+    fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix=".tmp")
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            np.savez(f, **arrays)
+        if os.path.exists(path):
+            os.remove(path)  # os.rename doesn't replace on Windows
+        os.rename(tmp_path, path)
+    except:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def readWarpfile(path):
+    '''
+    Reads a text warpfile (http://paulbourke.net/dome/warpingfisheye/): a
+        line with the file type, a line with the # of columns and rows, then
+        one line per grid point.
+
+    Returns:
+        filetype, cols, rows, warpdata: warpdata has one row per grid point.
+    '''
+    with open(path) as f:
+        filetype = int(f.readline())
+        cols, rows = map(int, f.readline().split())
+        body = f.read()
+    # the # of values per point, from the first point
+    ncolumns = len(body.lstrip().split('\n', 1)[0].split())
+    warpdata = np.fromstring(body, sep=' ').reshape(-1, ncolumns)
+    return filetype, cols, rows, warpdata
+
+
+def warpfileCachePath(path, cache_dir=WARP_CACHE_DIR):
+    '''
+    Path of the binary copy of a text warpfile in the warp cache.  Changes
+        if the warpfile does.
+    '''
+    stat = os.stat(path)
+    key = repr((WARP_CACHE_VERSION, os.path.abspath(path), stat.st_size,
+                stat.st_mtime))
+    return os.path.join(cache_dir,
+                        "warpfile_" + hashlib.sha1(key).hexdigest() + ".npz")
+
+
+def loadWarpfile(path, cache_dir=WARP_CACHE_DIR):
+    '''
+    Loads a warpfile.  Binary warpfiles (.npz with filetype, cols, rows and
+        warpdata) are loaded directly.  Text warpfiles are read once and then
+        loaded from a binary copy in the warp cache, unless cache_dir is None.
+
+    Returns:
+        filetype, cols, rows, warpdata
+    '''
+    if path.endswith(".npz"):
+        cached_path = path
+    elif cache_dir is None:
+        return readWarpfile(path)
+    else:
+        cached_path = warpfileCachePath(path, cache_dir)
+    if os.path.isfile(cached_path):
+        try:
+            with np.load(cached_path) as data:
+                return (int(data['filetype']), int(data['cols']),
+                        int(data['rows']), data['warpdata'])
+        except Exception as e:
+            if cached_path == path:
+                raise
+            logging.warning("Unable to read warp cache {}: {}".format(
+                cached_path, e))
+
+    filetype, cols, rows, warpdata = readWarpfile(path)
+    try:
+        saveCacheFile(cached_path, filetype=filetype, cols=cols, rows=rows,
+                      warpdata=warpdata)
+    except (IOError, OSError) as e:
+        logging.warning("Unable to write warp cache {}: {}".format(
+            cached_path, e))
+    return filetype, cols, rows, warpdata
+
+
 class Window(visual.Window):
     '''
     Subclass of Window to handle multiple frame packing and warping.
@@ -154,17 +428,32 @@ class Window(visual.Window):
 
     flipVertical: if True, flip the entire warp vertically.
         Default is false.
+
+    warpRenderer: WarpRenderer.Indexed draws the warp grid as indexed
+        triangles that share the grid's vertices, WarpRenderer.Quads draws
+        it as quads with four vertices per grid cell.  Default is
+        WarpRenderer.Indexed.
+
+    warpCache: if True, spherical, cylindrical and curvilinear warp meshes
+        are loaded from WARP_CACHE_DIR, and computed only the first time
+        a set of parameters is used (see utils/warp_cache.py to pre-compute
+        them).  Text warpfiles are also read only once and then loaded from
+        a binary copy.  Default is True.
     '''
 
     def __init__(self, projectorType=Projector.Normal, warp=Warp.Disabled, warpfile = None, warpGridsize = 300, eyepoint=(0.5, 0.5), 
-                flipHorizontal=False, flipVertical=False, *args,**kwargs):
+                flipHorizontal=False, flipVertical=False, warpCache=True,
+                warpRenderer=WarpRenderer.Indexed, *args,**kwargs):
         self.projectorType = projectorType
         self.warp = warp
         self.warpfile = warpfile
         self._eyepoint = eyepoint
         self.flipHorizontal = flipHorizontal
         self.flipVertical = flipVertical
+        self.warpCache = warpCache
+        self.warpRenderer = warpRenderer
         self.flipCounter = 0
+        self.lastWarpDuration = 0.0  # seconds spent on the warp pass last flip
         self.aspect = 1
         self.isPsychoPyV180OrAbove = (psychopy.__version__ >= '1.80')
         self.warpGridsize = warpGridsize
@@ -283,186 +572,44 @@ class Window(visual.Window):
         '''
         Correct perspective on flat screen using either a spherical or cylindrical projection.
         '''
-        self.nverts = (self.xgrid-1)*(self.ygrid-1)*4
-
-        # eye position in cm
-        xEye = self._eyepoint[0] * self.mon_width_cm
-        yEye = self._eyepoint[1] * self.mon_height_cm
-
-        #create vertex grid array, and texture coords
-        #times 4 for quads
-        vertices = np.zeros(((self.xgrid-1)*(self.ygrid-1)*4, 2),dtype='float32')
-        tcoords = np.zeros(((self.xgrid-1)*(self.ygrid-1)*4, 2),dtype='float32')
-
-        equalDistanceX = np.linspace(0, self.mon_width_cm, self.xgrid)
-        equalDistanceY = np.linspace(0, self.mon_height_cm, self.ygrid)
-
-        # vertex coordinates        
-        x_c = np.linspace(-1.0,1.0,self.xgrid)
-        y_c = np.linspace(-1.0,1.0,self.ygrid)
-        x_coords, y_coords = np.meshgrid(x_c,y_c)
-
-        x = np.zeros(((self.xgrid), (self.ygrid)),dtype='float32')
-        y = np.zeros(((self.xgrid), (self.ygrid)),dtype='float32')
-
-        x[:,:] = equalDistanceX - xEye
-        y[:,:] = equalDistanceY - yEye
-        y = np.transpose(y)
-
-        r = np.sqrt(np.square(x) + np.square(y) + np.square(self.dist_cm))
-
-        azimuth = np.arctan(x / self.dist_cm)
-        altitude = np.arcsin(y / r)
-
-        # calculate the texture coordinates
-        if isCylindrical:
-            tx = self.dist_cm * np.sin(azimuth)
-            ty = self.dist_cm * np.sin(altitude)
-        else:
-            tx = self.dist_cm * (1 + x / r)- self.dist_cm
-            ty = self.dist_cm * (1 + y / r) - self.dist_cm
-
-        # prevent div0
-        azimuth[azimuth==0] = np.finfo(np.float32).eps
-        altitude[altitude==0] = np.finfo(np.float32).eps
-
-        # the texture coordinates (which are now lying on the sphere)
-        # need to be remapped back onto the plane of the display.
-        # This effectively stretches the coordinates away from the eyepoint.
-   
         if isCylindrical:
-            tx = tx * azimuth / np.sin(azimuth) 
-            ty = ty * altitude / np.sin(altitude)
+            self.projectionGrid(Warp.Cylindrical)
         else:
-            centralAngle = np.arccos (np.cos(altitude) * np.cos(np.abs(azimuth)))
-            # distance from eyepoint to texture vertex
-            arcLength = centralAngle * self.dist_cm
-            # remap the texture coordinate
-            theta = np.arctan2(ty, tx)
-            tx = arcLength * np.cos(theta)
-            ty = arcLength * np.sin(theta)
-
-        u_coords = tx / self.mon_width_cm + 0.5
-        v_coords = ty / self.mon_height_cm + 0.5
-
-        #loop to create quads
-        vdex = 0
-        for y in xrange(0,self.ygrid-1):
-            for x in xrange(0,self.xgrid-1):
-                index = y*(self.xgrid) + x
-                
-                vertices[vdex+0,0] = x_coords[y,x]
-                vertices[vdex+0,1] = y_coords[y,x]
-                vertices[vdex+1,0] = x_coords[y,x+1]
-                vertices[vdex+1,1] = y_coords[y,x+1]
-                vertices[vdex+2,0] = x_coords[y+1,x+1]
-                vertices[vdex+2,1] = y_coords[y+1,x+1]
-                vertices[vdex+3,0] = x_coords[y+1,x]
-                vertices[vdex+3,1] = y_coords[y+1,x]
-                
-                tcoords[vdex+0,0] = u_coords[y,x]
-                tcoords[vdex+0,1] = v_coords[y,x]
-                tcoords[vdex+1,0] = u_coords[y,x+1]
-                tcoords[vdex+1,1] = v_coords[y,x+1]
-                tcoords[vdex+2,0] = u_coords[y+1,x+1]
-                tcoords[vdex+2,1] = v_coords[y+1,x+1]
-                tcoords[vdex+3,0] = u_coords[y+1,x]
-                tcoords[vdex+3,1] = v_coords[y+1,x]
-                
-                vdex += 4
-        self.createVertexAndTextureBuffers (vertices, tcoords)        
+            self.projectionGrid(Warp.Spherical)
 
-        
     def projectionCurvilinear (self):
         '''
         Correct perspective on flat screen using curvilinear projection.
         http://en.wikipedia.org/wiki/Curvilinear_perspective 
         '''
-        self.nverts = (self.xgrid-1)*(self.ygrid-1)*4
+        self.projectionGrid(Warp.Curvilinear)
 
-        # eye position in cm
-        xEye = self._eyepoint[0] * self.mon_width_cm
-        yEye = self._eyepoint[1] * self.mon_height_cm
-
-        # create vertex grid array, and texture coords times 4 for quads
-        vertices = np.zeros(((self.xgrid-1)*(self.ygrid-1)*4, 2),dtype='float32')
-        tcoords = np.zeros(((self.xgrid-1)*(self.ygrid-1)*4, 2),dtype='float32')
-        
-        # vertex points are spaced equal distances apart
-        equalDistanceX = np.linspace(0, self.mon_width_cm, self.xgrid)
-        equalDistanceY = np.linspace(0, self.mon_height_cm, self.ygrid)
-
-        # vertex coordinates        
-        x_c = np.linspace(-1.0,1.0,self.xgrid)
-        y_c = np.linspace(-1.0,1.0,self.ygrid)
-        x_coords, y_coords = np.meshgrid(x_c,y_c)
-
-        x = np.zeros(((self.xgrid), (self.ygrid)),dtype='float32')
-        y = np.zeros(((self.xgrid), (self.ygrid)),dtype='float32')
-
-        x[:,:] = equalDistanceX - xEye 
-        y[:,:] = equalDistanceY - yEye 
-        y = np.transpose(y)
-
-        r = np.sqrt(np.square(x) + np.square(y) + np.square(self.dist_cm))
-        azimuth = np.arctan(x / self.dist_cm)
-        altitude = np.arcsin(y / r)
-
-        tx = self.dist_cm * (1 + x / r)- self.dist_cm
-        ty = self.dist_cm * (1 + y / r) - self.dist_cm
-        
-        # prevent div0
-        azimuth[azimuth==0] = np.finfo(np.float32).eps
-        altitude[altitude==0] = np.finfo(np.float32).eps
-
-        # map texture onto the x, y plane
-        tx = tx * azimuth / np.sin(azimuth) 
-        ty = ty * altitude / np.sin(altitude)
-
-        u_coords = tx / self.mon_width_cm + 0.5
-        v_coords = ty / self.mon_height_cm + 0.5
-
-        #loop to create quads
-        vdex = 0
-        for y in xrange(0,self.ygrid-1):
-            for x in xrange(0,self.xgrid-1):
-                index = y*(self.xgrid) + x
-                
-                vertices[vdex+0,0] = x_coords[y,x]
-                vertices[vdex+0,1] = y_coords[y,x]
-                vertices[vdex+1,0] = x_coords[y,x+1]
-                vertices[vdex+1,1] = y_coords[y,x+1]
-                vertices[vdex+2,0] = x_coords[y+1,x+1]
-                vertices[vdex+2,1] = y_coords[y+1,x+1]
-                vertices[vdex+3,0] = x_coords[y+1,x]
-                vertices[vdex+3,1] = y_coords[y+1,x]
-                
-                tcoords[vdex+0,0] = u_coords[y,x]
-                tcoords[vdex+0,1] = v_coords[y,x]
-                tcoords[vdex+1,0] = u_coords[y,x+1]
-                tcoords[vdex+1,1] = v_coords[y,x+1]
-                tcoords[vdex+2,0] = u_coords[y+1,x+1]
-                tcoords[vdex+2,1] = v_coords[y+1,x+1]
-                tcoords[vdex+3,0] = u_coords[y+1,x]
-                tcoords[vdex+3,1] = v_coords[y+1,x]
-                
-                vdex += 4
+    def projectionGrid(self, warp):
+        '''
+        Creates the quads of a spherical, cylindrical or curvilinear warp.
+        '''
+        self.nverts = (self.xgrid-1)*(self.ygrid-1)*4
 
-        self.createVertexAndTextureBuffers (vertices, tcoords)        
+        args = (self.mon_width_cm, self.mon_height_cm, self.dist_cm,
+                self._eyepoint, self.xgrid, self.ygrid, warp)
+        if self.warpCache:
+            vertices, tcoords = loadWarpMesh(*args)
+        else:
+            x_coords, y_coords, u_coords, v_coords = warpGrid(*args)
+            vertices = quadsFromGrid(x_coords, y_coords)
+            tcoords = quadsFromGrid(u_coords, v_coords)
+        self.createVertexAndTextureBuffers (vertices, tcoords,
+                                            gridShape=(self.ygrid, self.xgrid))        
         
 
     def projectionWarpfile (self):
         ''' Use a warp definition file to create the projection.
             See: http://paulbourke.net/dome/warpingfisheye/ 
+            Can also be a binary warpfile (.npz), see loadWarpfile.
         '''
         try:
-            fh = open (self.warpfile)
-            lines = fh.readlines()
-            fh.close()
-            filetype = int(lines[0])
-            rc = map(int, lines[1].split())
-            cols, rows = rc[0], rc[1]
-            warpdata = np.loadtxt(self.warpfile, skiprows=2)
+            cache_dir = WARP_CACHE_DIR if self.warpCache else None
+            filetype, cols, rows, warpdata = loadWarpfile(self.warpfile, cache_dir)
         except:
             error = 'Unable to read warpfile: ' + self.warpfile
             logging.warning(error)
@@ -480,54 +627,39 @@ class Window(visual.Window):
           
         self.nverts = (self.xgrid-1)*(self.ygrid-1)*4
 
-        # create vertex grid array, and texture coords times 4 for quads
-        vertices = np.zeros(((self.xgrid-1)*(self.ygrid-1)*4, 2),dtype='float32')
-        tcoords = np.zeros(((self.xgrid-1)*(self.ygrid-1)*4, 2),dtype='float32')
-        # opacity is RGBA
-        opacity = np.ones(((self.xgrid-1)*(self.ygrid-1)*4,4),dtype='float32')
-
-        #loop to create quads
-        vdex = 0
-        for y in xrange(0,self.ygrid-1):
-            for x in xrange(0,self.xgrid-1):
-                index = y*(self.xgrid) + x
-                
-                vertices[vdex+0,0] = warpdata[index,0]          #x_coords[y,x]
-                vertices[vdex+0,1] = warpdata[index,1]          #y_coords[y,x]
-                vertices[vdex+1,0] = warpdata[index+1,0]        #x_coords[y,x+1]
-                vertices[vdex+1,1] = warpdata[index+1,1]        #y_coords[y,x+1]
-                vertices[vdex+2,0] = warpdata[index+cols+1,0]   #x_coords[y+1,x+1]
-                vertices[vdex+2,1] = warpdata[index+cols+1,1]   #y_coords[y+1,x+1]
-                vertices[vdex+3,0] = warpdata[index+cols,0]     #x_coords[y+1,x]
-                vertices[vdex+3,1] = warpdata[index+cols,1]     #y_coords[y+1,x]
-                
-                tcoords[vdex+0,0] = warpdata[index,2]           # u_coords[y,x]
-                tcoords[vdex+0,1] = warpdata[index,3]           # v_coords[y,x]
-                tcoords[vdex+1,0] = warpdata[index+1,2]         # u_coords[y,x+1]
-                tcoords[vdex+1,1] = warpdata[index+1,3]         # v_coords[y,x+1]
-                tcoords[vdex+2,0] = warpdata[index+cols+1,2]    # u_coords[y+1,x+1]
-                tcoords[vdex+2,1] = warpdata[index+cols+1,3]    # v_coords[y+1,x+1]
-                tcoords[vdex+3,0] = warpdata[index+cols,2]      # u_coords[y+1,x]
-                tcoords[vdex+3,1] = warpdata[index+cols,3]      # v_coords[y+1,x]
-                
-                opacity[vdex,3] = warpdata[index, 4]
-                opacity[vdex+1,3] = warpdata[index+1, 4]
-                opacity[vdex+2,3] = warpdata[index+cols+1, 4]
-                opacity[vdex+3,3] = warpdata[index+cols, 4]
-
-                vdex += 4
-
-        self.createVertexAndTextureBuffers (vertices, tcoords, opacity)        
+        vertices, tcoords, opacity = warpfileQuads(warpdata, cols, rows)
+        self.createVertexAndTextureBuffers (vertices, tcoords, opacity,
+                                            gridShape=(rows, cols))        
         
 
-    def createVertexAndTextureBuffers(self, vertices, tcoords, opacity = None):
-        ''' Allocate hardware buffers for vertices, texture coordinates, and optionally opacity '''
+    def createVertexAndTextureBuffers(self, vertices, tcoords, opacity = None, gridShape = None):
+        ''' Allocate hardware buffers for vertices, texture coordinates, and optionally opacity.
+            Quads of a (rows, cols) grid (gridShape) are drawn as indexed triangles if the
+            renderer is WarpRenderer.Indexed.
+        '''
 
         if self.flipHorizontal:
             vertices[:,0] = -vertices[:,0]
         if self.flipVertical:
             vertices[:,1] = -vertices[:,1]
 
+        self.gl_ib = None
+        if gridShape is not None and self.warpRenderer == WarpRenderer.Indexed:
+            rows, cols = gridShape
+            vertices = gridFromQuads(vertices, rows, cols)
+            tcoords = gridFromQuads(tcoords, rows, cols)
+            if opacity is not None:
+                opacity = gridFromQuads(opacity, rows, cols)
+            indices = gridIndices(rows, cols)
+            self.nindices = len(indices)
+
+            #index buffer in hardware
+            self.gl_ib = GL.GLuint()
+            GL.glGenBuffers(1 , self.gl_ib)
+            GL.glBindBuffer(GL.GL_ELEMENT_ARRAY_BUFFER, self.gl_ib)
+            GL.glBufferData(GL.GL_ELEMENT_ARRAY_BUFFER, ADT.arrayByteCount(indices), ADT.voidDataPointer(indices), GL.GL_STATIC_DRAW)
+            GL.glBindBuffer(GL.GL_ELEMENT_ARRAY_BUFFER, 0)
+
         GL.glEnableClientState (GL.GL_VERTEX_ARRAY)
 
         #vertex buffer in hardware
@@ -591,8 +723,14 @@ class Window(visual.Window):
         #GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_WRAP_S, GL.GL_CLAMP_TO_EDGE)
         #GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_WRAP_T, GL.GL_CLAMP_TO_EDGE)
 
-        #draw quads
-        GL.glDrawArrays (GL.GL_QUADS, 0, self.nverts)
+        if self.gl_ib is not None:
+            #draw triangles
+            GL.glBindBuffer(GL.GL_ELEMENT_ARRAY_BUFFER, self.gl_ib)
+            GL.glDrawElements(GL.GL_TRIANGLES, self.nindices, GL.GL_UNSIGNED_INT, None)
+            GL.glBindBuffer(GL.GL_ELEMENT_ARRAY_BUFFER, 0)
+        else:
+            #draw quads
+            GL.glDrawArrays (GL.GL_QUADS, 0, self.nverts)
 
         # cleanup
         GL.glBindBuffer(GL.GL_ARRAY_BUFFER, 0)
@@ -625,6 +763,7 @@ class Window(visual.Window):
         for thisStim in self._toDraw:
             thisStim.draw()
 
+        warpStart = default_timer()
         if self.useFBO:
             if flipThisFrame:
                 if self.isPsychoPyV180OrAbove:
@@ -653,6 +792,7 @@ class Window(visual.Window):
 
                 GL.glEnable(GL.GL_BLEND)
                 GL.glUseProgram(0)
+        self.lastWarpDuration = default_timer() - warpStart
 
         #update the bits++ LUT
         if self.bitsMode in ['fast', 'bits++']:
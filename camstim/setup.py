@@ -25,6 +25,9 @@ setup(
         "pyside>=1.2.4",
         "pyyaml",
     ],
+    extras_require={
+        "hdf5": ["h5py"],  # columnar output files in HDF5 instead of .npz
+    },
     entry_points = {
         'console_scripts': [
             'camstim_agent = camstim.zro.agent:main'
@@ -0,0 +1,26 @@
+"""
+helpers.py
+
+Checks shared by the output tests.
+
+"""
+import numpy as np
+
+
+def assert_same(a, b):
+    """ Compares two outputs (dicts, lists, tuples, arrays and scalars) item
+            by item, including their types.
+    """
+    if isinstance(a, dict):
+        assert sorted(a) == sorted(b)
+        for k in a:
+            assert_same(a[k], b[k])
+    elif isinstance(a, (list, tuple)):
+        assert type(a) == type(b) and len(a) == len(b)
+        for x, y in zip(a, b):
+            assert_same(x, y)
+    elif isinstance(a, np.ndarray):
+        assert a.dtype == b.dtype
+        np.testing.assert_array_equal(a, b)
+    else:
+        assert type(a) == type(b) and a == b
@@ -0,0 +1,118 @@
+"""
+test_headless.py
+
+Runs the full SweepStim frame loop against the headless window.
+
+"""
+import os
+import shutil
+
+import numpy as np
+import pytest
+
+import camstim.stim
+import camstim.sweepstim
+from camstim import SweepStim, Stimulus, MovieStim
+from camstim.headless import NullWindow, NullStimulus
+
+
+@pytest.fixture
+def window():
+    return NullWindow()
+
+
+@pytest.fixture
+def camstim_dir(tmpdir, monkeypatch):
+    """ Keeps the config and output files of a session in tmpdir, and doesn't
+        open the control stream socket.
+    """
+    path = str(tmpdir.mkdir("camstim"))
+    monkeypatch.setattr(camstim.stim, "CAMSTIM_DIR", path)
+    monkeypatch.setattr(camstim.sweepstim, "CAMSTIM_DIR", path)
+    monkeypatch.setattr(SweepStim, "_setup_controlstream", lambda self: None)
+    return path
+
+
+def test_null_stimulus():
+    stim = NullStimulus()
+    stim.setOri(45)
+    stim.setPos((10, 20))
+    assert stim.ori == 45
+    assert stim.pos == (10, 20)
+    # these are handled by `Stimulus`
+    assert not hasattr(stim, "setTF")
+    assert not hasattr(stim, "setPosX")
+
+
+def test_headless_run(window, camstim_dir):
+    null_stim = NullStimulus()
+    stim = Stimulus(null_stim, {'Ori': ([0, 90, 180], 0), 'TF': ([2.0], 1)},
+                    sweep_length=0.5, fps=60.0)
+    ss = SweepStim(window, stimuli=[stim], pre_blank_sec=0.1,
+                   post_blank_sec=0.1)
+    with pytest.raises(SystemExit):
+        ss.run()
+    assert null_stim.draw_count == 90
+    assert null_stim.ori == 180
+    assert len(window.frameIntervals) >= 90
+    assert 'control_stream' not in ss.items
+    outputs = os.listdir(os.path.join(camstim_dir, "output"))
+    assert [os.path.splitext(f)[1] for f in outputs] == [".pkl"]
+
+
+def test_headless_movie_read_ahead(window, camstim_dir, tmpdir, monkeypatch):
+    movie_path = str(tmpdir.join("movie.npy"))
+    np.save(movie_path, np.arange(10*4*6, dtype=np.uint8).reshape(10, 4, 6))
+    monkeypatch.setattr(camstim.sweepstim, "ImageStimNumpyuByte",
+                        lambda window, **kwargs: NullStimulus())
+    monkeypatch.setattr(MovieStim, "_local_copy", lambda self, source: source)
+    movie = MovieStim(movie_path, window, frame_length=1/30.0, fps=60.0,
+                      mmap_mode='r', read_ahead=4)
+    read_ahead = movie._read_ahead
+    assert read_ahead._thread.is_alive()
+    ss = SweepStim(window, stimuli=[movie], pre_blank_sec=0.0,
+                   post_blank_sec=0.0)
+    with pytest.raises(SystemExit):
+        ss.run()
+    # the read-ahead thread is stopped when the session ends
+    assert not read_ahead._thread.is_alive()
+    assert movie._read_ahead is None
+
+
+def run_session(window, params):
+    stim = Stimulus(NullStimulus(), {'Ori': ([0, 90], 0)}, sweep_length=0.1,
+                    fps=60.0)
+    ss = SweepStim(window, stimuli=[stim], pre_blank_sec=0.0,
+                   post_blank_sec=0.0, params=params)
+    with pytest.raises(SystemExit):
+        ss.run()
+    return ss
+
+
+def test_stream_backups(window, camstim_dir, tmpdir):
+    backupdir = str(tmpdir.join("backup"))
+    output_dir = os.path.join(camstim_dir, "output")
+    for _ in range(2):
+        run_session(window, dict(stream_output=True, backupdir=backupdir,
+                                 mouseid="mouse"))
+        # the local output was moved off the rig, the backups weren't
+        shutil.rmtree(output_dir)
+    backups = sorted(os.listdir(os.path.join(backupdir, "mouse", "output")),
+                     key=len)
+    assert len(backups) == 2
+    assert backups[0].endswith(".stream")
+    # the second backup is prefixed with the date and time
+    assert backups[1].endswith("-" + backups[0])
+
+
+def test_pkl_backups(window, camstim_dir, tmpdir):
+    backupdir = str(tmpdir.join("backup"))
+    output_dir = os.path.join(camstim_dir, "output")
+    for _ in range(2):
+        run_session(window, dict(backupdir=backupdir, mouseid="mouse"))
+        shutil.rmtree(output_dir)
+    backups = sorted(os.listdir(os.path.join(backupdir, "mouse", "output")),
+                     key=len)
+    assert len(backups) == 2
+    assert backups[0].endswith(".pkl")
+    assert backups[1].endswith("-" + backups[0])
@@ -0,0 +1,161 @@
+"""
+test_movies.py
+
+Checks that indexed movies play the same frames as the full movies they
+    replace, and that they share their frame arrays and cached frames.
+
+"""
+import os
+
+import numpy as np
+import pytest
+
+from camstim.movies import IndexedMovie, save_indexed_movie, \
+    get_frames_path, load_frames, clear_frame_stores, MovieStager, \
+    FrameCache, CachedMovie, unique_frames_nbytes
+
+
+def scrubbed(movie):
+    """ The forward/reverse scrubbed movie from movie_transformer. """
+    reversed_movie = np.flipud(movie)
+    return np.concatenate((movie[0:90], reversed_movie[180:270], movie[0:90]))
+
+
+@pytest.fixture
+def frames_path(tmpdir):
+    clear_frame_stores()
+    path = str(tmpdir.join("movie_frames.npy"))
+    frames = np.random.RandomState(0).randint(0, 256, (270, 4, 6))
+    np.save(path, frames.astype(np.uint8))
+    return path
+
+
+@pytest.mark.parametrize("mmap_mode", [None, 'r'])
+def test_indexed_movie(frames_path, mmap_mode):
+    frames = np.load(frames_path)
+    fwd = np.arange(270)
+    index = np.concatenate((fwd[0:90], fwd[::-1][180:270], fwd[0:90]))
+    path = os.path.join(os.path.dirname(frames_path), "movie_2.npz")
+    save_indexed_movie(path, frames_path, index)
+    assert get_frames_path(path) == frames_path
+
+    movie = IndexedMovie.from_file(path, mmap_mode)
+    expected = scrubbed(frames)
+    assert len(movie) == len(expected)
+    assert movie.shape == expected.shape
+    assert movie.ndim == 3 and movie.dtype == np.uint8
+    for i in [0, 89, 90, 179, 180, 269]:
+        np.testing.assert_array_equal(movie[i], expected[i])
+    np.testing.assert_array_equal(movie.to_array(), expected)
+    np.testing.assert_array_equal(list(movie), expected)
+    np.testing.assert_array_equal(movie[100:110].to_array(), expected[100:110])
+
+
+def test_shared_frames(frames_path):
+    folder = os.path.dirname(frames_path)
+    movies = []
+    for name, index in [("fwd", range(270)), ("rev", range(269, -1, -1))]:
+        path = os.path.join(folder, name + ".npz")
+        save_indexed_movie(path, frames_path, index)
+        movies.append(IndexedMovie.from_file(path, 'r'))
+    assert movies[0].frames is movies[1].frames
+    assert load_frames(frames_path, 'r') is movies[0].frames
+    np.testing.assert_array_equal(movies[0][269], movies[1][0])
+
+
+def test_unique_frames_nbytes(frames_path):
+    folder = os.path.dirname(frames_path)
+    paths = []
+    for name, index in [("fwd", range(90)), ("rev", range(179, 44, -1))]:
+        paths.append(os.path.join(folder, name + ".npz"))
+        save_indexed_movie(paths[-1], frames_path, index)
+    # frames 0-179, 45-89 are used by both
+    assert unique_frames_nbytes(paths) == 180 * 4 * 6
+    assert unique_frames_nbytes(paths[:1]) == 90 * 4 * 6
+    # every frame of a plain movie
+    assert unique_frames_nbytes([frames_path] + paths) == 270 * 4 * 6
+
+
+def test_bad_index(frames_path):
+    frames = load_frames(frames_path)
+    with pytest.raises(IndexError):
+        IndexedMovie(frames, [0, 270])
+    with pytest.raises(ValueError):
+        save_indexed_movie("elsewhere/movie.npz", frames_path, [0])
+
+
+def test_frame_cache_lru():
+    frame = np.zeros((4, 6), dtype=np.uint8)
+    cache = FrameCache(3 * frame.nbytes)
+    for key in ['a', 'b', 'c']:
+        cache.get(key, lambda: frame)
+    cache.get('a', lambda: frame)  # 'b' is now least recently used
+    cache.get('d', lambda: frame)
+    assert 'b' not in cache
+    assert all(key in cache for key in ['a', 'c', 'd'])
+    assert cache.nbytes == 3 * frame.nbytes
+    assert (cache.hits, cache.misses) == (1, 4)
+    # too big to cache
+    cache.get('e', lambda: np.zeros((40, 6), dtype=np.uint8))
+    assert 'e' not in cache and len(cache) == 3
+
+
+@pytest.mark.parametrize("mmap_mode", [None, 'r'])
+def test_cached_movie(frames_path, mmap_mode):
+    frames = load_frames(frames_path, mmap_mode)
+    index = np.concatenate((np.arange(90), np.arange(90)[::-1]))
+    cache = FrameCache(1e9)
+    fwd = CachedMovie(IndexedMovie(frames, index[:90]), frames_path, cache)
+    rev = CachedMovie(IndexedMovie(frames, index[90:]), frames_path, cache)
+    assert len(rev) == 90
+    for i in range(90):
+        np.testing.assert_array_equal(fwd[i], frames[i])
+    # the reversed movie uses the same frames
+    assert all(rev.is_cached(i) for i in range(90))
+    for i in range(90):
+        np.testing.assert_array_equal(rev[i], frames[89 - i])
+    assert (cache.hits, cache.misses) == (90, 90)
+    assert not fwd[0].flags.writeable
+    plain = CachedMovie(np.load(frames_path), frames_path, cache)
+    assert plain.is_cached(-181)
+    assert not plain.is_cached(-1)
+
+
+def test_stager(tmpdir):
+    source_dir = tmpdir.mkdir("share")
+    sources = []
+    for i in range(3):
+        path = str(source_dir.join("m0{}.npy".format(i)))
+        np.save(path, np.full((5, 4, 6), i, dtype=np.uint8))
+        sources.append(path)
+    local_dir = str(tmpdir.join("local"))
+
+    stager = MovieStager(local_dir, threads=2)
+    local_paths = stager.stage(sources)
+    for source, local_path in zip(sources, local_paths):
+        assert open(local_path, 'rb').read() == open(source, 'rb').read()
+    assert sorted(os.listdir(local_dir)) == ["m00.npy", "m01.npy", "m02.npy",
+                                             "manifest.json"]
+
+    # valid copies are reused
+    stager = MovieStager(local_dir)
+    assert all(stager.is_valid(source) for source in sources)
+
+    # truncated copies aren't
+    with open(local_paths[1], 'r+b') as f:
+        f.truncate(10)
+    assert not stager.is_valid(sources[1])
+    stager.stage(sources)
+    assert open(local_paths[1], 'rb').read() == open(sources[1], 'rb').read()
+
+
+def test_stager_source_manifest(tmpdir):
+    source_dir = tmpdir.mkdir("share")
+    source = str(source_dir.join("m00.npy"))
+    np.save(source, np.zeros((5, 4, 6), dtype=np.uint8))
+    source_dir.join("manifest.json").write(
+        '{"m00.npy": {"size": %d, "md5": "0"}}' % os.path.getsize(source))
+    stager = MovieStager(str(tmpdir.join("local")))
+    with pytest.raises(IOError):
+        stager.stage([source])
+    assert os.listdir(stager.local_dir) == []
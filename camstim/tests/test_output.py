@@ -0,0 +1,79 @@
+"""
+test_output.py
+
+Checks that columnar output files load the same as the output they were
+    saved from, and that single fields can be read from them.
+
+"""
+import cPickle as pickle
+
+import numpy as np
+import pytest
+
+from camstim.output import save_output, open_output, pkl2output
+
+from helpers import assert_same
+
+
+def make_output():
+    return {
+        'intervalsms': np.linspace(16.0, 17.0, 100000),
+        'vsynccount': 100000,
+        'script': "movie.py",
+        'stimuli': [
+            {'stim_path': "gratings", 'sweep_order': [2, 0, 1, 1],
+             'sweep_table': [(0, 0.04, "a"), (90, 0.04, "b"), (0, 0.08, "c")],
+             'frame_list': np.arange(-1, 50000) % 3, 'pos': (0.0, 10.0),
+             'display_sequence': None},
+            {'stim_path': "movie", 'sweep_order': [], 'fps': 30.0},
+        ],
+        'items': {'encoder': {'dx': [0.5, 0.25, -1.0], 'gain': 1.5,
+                              'reward_times': [(1.5, 90), (3.0, 180)]},
+                  'empty': {}},
+        'config': {'mouse/id': "test", 'bgcolor': (0, 0, 0), 'trigger': None},
+        'unpickleable': ['callback'],
+    }
+
+
+@pytest.mark.parametrize("format", ["npz", "hdf5"])
+def test_output_round_trip(tmpdir, format):
+    if format == "hdf5":
+        pytest.importorskip("h5py")
+    output = make_output()
+    path = save_output(output, str(tmpdir.join("session")), format)
+    with open_output(path) as f:
+        assert_same(f.load(), output)
+        assert_same(f.load("stimuli/1"), output['stimuli'][1])
+
+
+@pytest.mark.parametrize("format", ["npz", "hdf5"])
+def test_output_fields(tmpdir, format):
+    if format == "hdf5":
+        pytest.importorskip("h5py")
+    output = make_output()
+    path = save_output(output, str(tmpdir.join("session")), format)
+    with open_output(path) as f:
+        assert sorted(f.keys()) == sorted(output)
+        assert sorted(f.keys("stimuli/0")) == sorted(output['stimuli'][0])
+        assert f.attrs("stimuli/0") == {'stim_path': "gratings"}
+        assert_same(f["intervalsms"], output['intervalsms'])
+        assert_same(f["stimuli/0/sweep_order"], [2, 0, 1, 1])
+        assert_same(f["stimuli/0/sweep_table"],
+                    output['stimuli'][0]['sweep_table'])
+        assert_same(f["/items/encoder/"], output['items']['encoder'])
+        assert f["vsynccount"] == 100000
+        assert "mouse/id" in f.keys("config")
+        assert "stimuli/2" not in f
+        with pytest.raises(KeyError):
+            f["stimuli/0/missing"]
+
+
+def test_pkl2output(tmpdir):
+    output = make_output()
+    pkl_path = str(tmpdir.join("session.pkl"))
+    with open(pkl_path, 'wb') as f:
+        pickle.dump(output, f)
+    path = pkl2output(pkl_path, format="npz")
+    assert path == str(tmpdir.join("session.npz"))
+    with open_output(path) as f:
+        assert_same(f.load(), output)
@@ -0,0 +1,57 @@
+"""
+test_output_file.py
+
+Checks that output dictionaries pickled item by item load the same as when
+    pickled whole, and that unpickleable items are left out the same way.
+
+"""
+import io
+import cPickle as pickle
+
+import numpy as np
+import pytest
+
+from camstim.misc import wecanpicklethat, dump_pickleable
+
+from helpers import assert_same
+
+
+def make_output():
+    class Local(float):
+        """ Can't be pickled, the class can't be found by name. """
+
+    shared = [1, 2, (3, 4)]
+    return {
+        'intervalsms': np.linspace(16.0, 17.0, 1000),
+        'stimuli': [{'frame_list': np.arange(100), 'name': 'grating',
+                     'pos': (0, 0), 'shared': shared}],
+        'items': {'encoder': {'dx': [0.5]*100, 'shared': [shared, shared]}},
+        'shared': [shared, shared],
+        'vsynccount': 1000,
+        'script': u"movie.py",
+        'callback': lambda: None,
+        'local': [1.0, Local(2.0)],
+        '_private': 1,
+        5: "not a string key",
+    }
+
+
+def test_wecanpicklethat():
+    output = wecanpicklethat(make_output())
+    assert sorted(output['unpickleable']) == sorted([5, 'callback', 'local'])
+    assert '_private' not in output
+    assert sorted(output) == ['intervalsms', 'items', 'script', 'shared',
+                              'stimuli', 'unpickleable', 'vsynccount']
+
+
+@pytest.mark.parametrize("protocol", [0, 2])
+def test_dump_pickleable(protocol):
+    data = make_output()
+    expected = pickle.loads(pickle.dumps(wecanpicklethat(data), protocol))
+    f = io.BytesIO()
+    unpickleable = dump_pickleable(data, f, protocol)
+    assert sorted(unpickleable) == sorted(expected['unpickleable'])
+    output = pickle.loads(f.getvalue())
+    assert_same(output, expected)
+    # references are kept within an item
+    assert output['shared'][0] is output['shared'][1]
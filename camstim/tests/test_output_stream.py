@@ -0,0 +1,93 @@
+"""
+test_output_stream.py
+
+Checks that a streamed session output reads back the same as the output it
+    replaces, and that the streamed data survives a session that doesn't
+    finish.
+
+"""
+import os
+import cPickle as pickle
+
+import numpy as np
+
+from camstim.experiment import OutputStream, read_output_stream, stream2pkl
+
+from helpers import assert_same
+
+
+class Recorder(object):
+    """ Stand-in for an item that records data every frame. """
+    def __init__(self):
+        self.dx = []
+        self.reward_times = []
+
+    def update(self, frame):
+        self.dx.append(np.sin(frame / 10.0))
+        if frame % 7 == 0:
+            self.reward_times.append((frame / 60.0, frame))
+
+    def package(self):
+        return {'dx': np.array(self.dx, dtype=np.float32),
+                'reward_times': list(self.reward_times),
+                'gain': 1.5}
+
+
+class Window(object):
+    def __init__(self):
+        self.frameIntervals = []
+
+
+def run_session(path, n_frames, chunk_frames=25):
+    window, recorder = Window(), Recorder()
+    stream = OutputStream(path, chunk_frames)
+    stream.add_source(("intervalsms",), window, "frameIntervals", 1000)
+    stream.add_source(("items", "encoder", "dx"), recorder, "dx")
+    stream.add_source(("items", "encoder", "reward_times"), recorder,
+                      "reward_times")
+    for frame in range(n_frames):
+        recorder.update(frame)
+        window.frameIntervals.append(1 / 60.0 + frame * 1e-6)
+        stream.update(frame)
+    return stream, window, recorder
+
+
+def package(window, recorder):
+    return {'intervalsms': np.array(window.frameIntervals)*1000,
+            'items': {'encoder': recorder.package()},
+            'vsynccount': len(window.frameIntervals)}
+
+
+def test_output_stream(tmpdir):
+    path = str(tmpdir.join("session.stream"))
+    stream, window, recorder = run_session(path, 1000)
+    expected = package(window, recorder)
+    output = package(window, recorder)
+    stream.close(output)
+    # streamed values aren't in the tail
+    assert 'intervalsms' not in output
+    assert sorted(output['items']['encoder']) == ['gain']
+
+    assert_same(read_output_stream(path), expected)
+
+    pkl_path = stream2pkl(path)
+    with open(pkl_path, 'rb') as f:
+        assert_same(pickle.load(f), expected)
+
+
+def test_incomplete_stream(tmpdir):
+    path = str(tmpdir.join("session.stream"))
+    stream, window, recorder = run_session(path, 1000)
+    stream.flush()
+    stream._records.put(None)  # session crashed, no tail
+    stream._thread.join()
+    with open(path, 'ab') as f:
+        f.write(b"\x80\x02(U")  # partly written record
+
+    output = read_output_stream(path)
+    assert output['incomplete']
+    streams = output['streams']
+    assert streams[("items", "encoder", "dx")] == recorder.dx
+    assert streams[("intervalsms",)] == window.frameIntervals
+    assert streams[("items", "encoder", "reward_times")] == \
+        recorder.reward_times
@@ -0,0 +1,97 @@
+"""
+test_output_tools.py
+
+Checks output type schemas, their cache, and how they are compared to the
+    output spec.
+
+"""
+import os
+import datetime
+import cPickle as pickle
+
+import numpy as np
+
+from camstim.utils.output_tools import dict2types, item2typestr, \
+    cached_output2types, diff_schema, iter_schemas, load_spec
+
+
+def make_output():
+    return {
+        'intervalsms': [16.7]*100,
+        'start_time': datetime.datetime(2018, 2, 23),
+        'items': {'behavior': {'ai': None, 'dx': np.zeros(10),
+                               'lick_events': [(1.5, 90)]}},
+        'unpickleable': ['window'],
+    }
+
+
+def write_output(path, output):
+    with open(path, 'wb') as f:
+        pickle.dump(output, f)
+    return path
+
+
+def test_item2typestr():
+    assert [item2typestr(v) for v in [1, 1.0, "a", u"a", None, (1,), True]] \
+        == ['int', 'float', 'str', 'unicode', 'None', 'tuple', 'bool']
+    assert item2typestr(np.zeros(1)) == 'numpy.ndarray'
+    assert item2typestr(np.float64(1)) == 'numpy.float64'
+    assert item2typestr(datetime.datetime.now()) == 'datetime.datetime'
+
+
+def test_diff_schema():
+    schema = dict2types(make_output())
+    assert schema['intervalsms'] == ['float']*20
+    spec = {'intervalsms': ['float', '...'],
+            'start_time': 'datetime.datetime',
+            'items': {'behavior': {'ai': 'None', 'dx': ['float', '...'],
+                                   'lick_events': [], 'encoders': []}},
+            'unpickleable': ['str', '...']}
+    assert sorted(diff_schema(schema, spec)) == [
+        ('/items/behavior/dx', 'type', 'list', 'numpy.ndarray'),
+        ('/items/behavior/encoders', 'missing', 'list', None),
+    ]
+    schema['intervalsms'][3] = 'int'
+    schema['platform_info'] = {}
+    diffs = diff_schema(schema, spec)
+    assert ('/intervalsms/[]', 'type', 'float', 'int') in diffs
+    assert ('/platform_info', 'extra', None, 'dict') in diffs
+    # the output spec in docs/spec
+    spec = load_spec()
+    assert spec['items']['behavior']['intervalsms'] == ['float', '...']
+    assert spec['items']['behavior']['ai'] == 'None'
+
+
+def test_schema_cache(tmpdir):
+    path = write_output(str(tmpdir.join("output.pkl")), make_output())
+    cache_dir = str(tmpdir.join("cache"))
+    schema = cached_output2types(path, cache_dir)
+    assert schema == dict2types(make_output())
+    cache_files = os.listdir(cache_dir)
+    assert len(cache_files) == 1
+    # the cached schema is used for the same file contents
+    cache_path = os.path.join(cache_dir, cache_files[0])
+    with open(cache_path, 'wb') as f:
+        pickle.dump({'cached': 'str'}, f)
+    assert cached_output2types(path, cache_dir) == {'cached': 'str'}
+    # a bad cache file is replaced
+    with open(cache_path, 'wb') as f:
+        f.write(b"not a schema")
+    assert cached_output2types(path, cache_dir) == schema
+
+
+def test_iter_schemas(tmpdir):
+    paths = [write_output(str(tmpdir.join("output%d.pkl" % i)), make_output())
+             for i in range(3)]
+    bad_path = str(tmpdir.join("bad.pkl"))
+    with open(bad_path, 'wb') as f:
+        f.write(b"not an output")
+    expected = dict2types(make_output())
+    for processes in [1, 2]:
+        results = sorted(iter_schemas(paths + [bad_path], processes, None))
+        assert [r[0] for r in results] == sorted(paths + [bad_path])
+        for path, schema, error in results:
+            if path == bad_path:
+                assert schema is None and error
+            else:
+                assert schema == expected and error is None
@@ -0,0 +1,67 @@
+"""
+test_profiler.py
+
+Checks the frame profiler ring buffer and dropped frame attribution.
+
+"""
+import numpy as np
+
+from camstim.profiler import FrameProfiler, PHASES
+
+
+def run_frames(profiler, frames, slow={}):
+    """ Fake frame loop.  `slow` maps frame # -> (phase, extra seconds). """
+    t = 0.0
+    for frame in range(frames):
+        durations = dict(stimuli=0.001, items=0.0005, warp=0.0005,
+                         flip=0.0145, keys=0.0001)
+        if frame in slow:
+            phase, extra = slow[frame]
+            durations[phase] += extra
+        t0 = t
+        t1 = t0 + durations['stimuli']
+        t2 = t1 + durations['items']
+        t3 = t2 + durations['warp'] + durations['flip']
+        t4 = t3 + durations['keys']
+        profiler.record(frame, t0, t1, t2, t3, t4, durations['warp'])
+        t = t4
+
+
+def test_record():
+    profiler = FrameProfiler(length=10)
+    run_frames(profiler, 4)
+    timings = profiler.get_timings()
+    assert timings.shape == (4, len(profiler.columns))
+    np.testing.assert_array_equal(timings[:, 0], range(4))
+    np.testing.assert_allclose(timings[0, 2:],
+                               [0.001, 0.0005, 0.0005, 0.0145, 0.0001])
+
+
+def test_ring_buffer():
+    profiler = FrameProfiler(length=10)
+    run_frames(profiler, 25)
+    timings = profiler.get_timings()
+    assert profiler.count == 25
+    np.testing.assert_array_equal(timings[:, 0], range(15, 25))
+    assert (np.diff(timings[:, 1]) > 0).all()
+
+
+def test_dropped_frames():
+    profiler = FrameProfiler()
+    slow = {10: ('stimuli', 0.02), 50: ('items', 0.03), 70: ('warp', 0.02)}
+    run_frames(profiler, 100, slow)
+    summary = profiler.summary()
+    assert summary['frames'] == [10, 50, 70]
+    assert summary['phases'] == ['stimuli', 'items', 'warp']
+    assert summary['phase_counts'] == dict(stimuli=1, items=1, warp=1,
+                                           flip=0, keys=0)
+    assert set(summary['phase_medians']) == set(PHASES)
+    package = profiler.package()
+    assert package['frames_recorded'] == 100
+    assert package['dropped']['frames'] == [10, 50, 70]
+
+
+def test_empty():
+    profiler = FrameProfiler(length=5)
+    assert profiler.summary()['frames'] == []
+    assert profiler.get_timings().shape == (0, len(profiler.columns))
@@ -0,0 +1,128 @@
+"""
+test_schedule.py
+
+Checks that run-length frame schedules match the dense frame lists, and that
+    the active stimulus scheduler only dispatches stimuli that have something
+    to show.
+
+"""
+import cPickle as pickle
+
+import numpy as np
+import pytest
+
+from camstim.misc import build_frame_list, apply_display_sequence
+from camstim.schedule import FrameSchedule, ActiveStimulusScheduler
+
+
+SWEEP_ORDERS = [
+    [],
+    [0],
+    [0, 1, 2, 3, -1, 4, 5, 6, 7, -1],
+    [3, 3, 3, -1, -1, 2],
+    list(np.random.RandomState(0).permutation(50)),
+]
+
+
+def check_schedule(schedule, expected):
+    np.testing.assert_array_equal(schedule.to_array(), expected)
+    assert schedule.get_total_frames() == len(expected)
+    # sequential and random access lookups
+    assert [schedule[i] for i in range(len(expected))] == expected.tolist()
+    for i in np.random.RandomState(1).permutation(len(expected))[:50]:
+        assert schedule[i] == expected[i]
+    with pytest.raises(IndexError):
+        schedule[len(expected)]
+
+
+@pytest.mark.parametrize("sweep_order", SWEEP_ORDERS)
+@pytest.mark.parametrize("sweep_frames", [1, 18, 60])
+@pytest.mark.parametrize("blank_frames", [0, 30])
+@pytest.mark.parametrize("start_frame", [0, 90])
+@pytest.mark.parametrize("stop_frame", [None, 0, 120, 540])
+def test_from_sweeps(sweep_order, sweep_frames, blank_frames, start_frame,
+                     stop_frame):
+    schedule = FrameSchedule.from_sweeps(sweep_order, sweep_frames,
+                                         blank_frames, start_frame, stop_frame)
+    expected = build_frame_list(sweep_order, sweep_frames, blank_frames,
+                                start_frame, stop_frame)
+    check_schedule(schedule, expected)
+
+
+DISPLAY_SEQUENCES = [
+    [(0.0, 1.0)],
+    [(2.5, 3.0), (4.0, 4.75), (10.0, 19.0)],
+    [(1.0, 100.0), (200.0, 300.0), (400.0, 500.0)],
+    [(30, 39), (150, 159), (270, 279)],
+]
+
+
+@pytest.mark.parametrize("sweep_order", SWEEP_ORDERS)
+@pytest.mark.parametrize("sweep_frames", [2, 18])
+@pytest.mark.parametrize("blank_frames", [0, 30])
+@pytest.mark.parametrize("display_sequence", DISPLAY_SEQUENCES)
+def test_display(sweep_order, sweep_frames, blank_frames, display_sequence):
+    fps = 60.0
+    display_sequence = np.array(display_sequence)
+    schedule = FrameSchedule.from_sweeps(sweep_order, sweep_frames,
+                                         blank_frames).display(display_sequence,
+                                                               fps)
+    base = build_frame_list(sweep_order, sweep_frames, blank_frames)
+    expected = apply_display_sequence(base, display_sequence, fps)
+    check_schedule(schedule, expected)
+
+
+def test_from_frame_list():
+    frame_list = build_frame_list([0, 1, 1, -1, 4], 10, 5, 20, 70)
+    schedule = FrameSchedule.from_frame_list(frame_list)
+    check_schedule(schedule, frame_list)
+
+
+def test_get_upcoming():
+    schedule = FrameSchedule.from_sweeps([0, 1, 2, -1, 3], 10, 5, 20)
+    assert schedule.get_upcoming(0, 2) == [0, 1]
+    assert schedule.get_upcoming(20, 2) == [1, 2]
+    assert schedule.get_upcoming(45, 5) == [2, 3]
+    assert schedule.get_upcoming(80, 5) == []
+
+
+def test_pickle():
+    schedule = FrameSchedule.from_sweeps(range(10), 30, 15, 60)
+    copy = pickle.loads(pickle.dumps(schedule))
+    check_schedule(copy, schedule.to_array())
+
+
+class FakeStimulus(object):
+    def __init__(self, frame_schedule=None):
+        self.frame_schedule = frame_schedule
+
+
+def test_active_stimuli():
+    fps = 60.0
+    stimuli = [
+        FakeStimulus(FrameSchedule.from_sweeps(range(5), 30, 0, 60)),
+        FakeStimulus(FrameSchedule.from_sweeps([0, -1, 1, 2], 20, 10, 100,
+                                               220)),
+        FakeStimulus(),
+        FakeStimulus(FrameSchedule.from_sweeps(range(10), 6).display(
+            np.array([(1.0, 1.5), (3.0, 3.5)]), fps)),
+        FakeStimulus(FrameSchedule()),
+    ]
+    scheduler = ActiveStimulusScheduler(stimuli)
+    total_frames = max(s.frame_schedule.get_total_frames() for s in stimuli
+                       if s.frame_schedule is not None) + 10
+
+    def expected(frame):
+        active = []
+        for stim in stimuli:
+            if stim.frame_schedule is None:
+                active.append(stim)
+            elif frame < stim.frame_schedule.get_total_frames() and \
+                    stim.frame_schedule[frame] != -1:
+                active.append(stim)
+        return active
+
+    for frame in range(total_frames):
+        assert list(scheduler.get_active(frame)) == expected(frame)
+    for frame in np.random.RandomState(2).permutation(total_frames)[:100]:
+        assert list(scheduler.get_active(frame)) == expected(frame)
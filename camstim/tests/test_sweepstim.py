@@ -0,0 +1,239 @@
+"""
+test_sweepstim.py
+
+Checks that the numpy frame list builders produce the same frame lists as the
+    original list-based implementation in `Stimulus`, that lazy sweep tables
+    match the expanded ones, and that sweep params are applied through the
+    precompiled setters.
+
+"""
+import cPickle as pickle
+import itertools
+
+import numpy as np
+import pytest
+
+from camstim.misc import build_frame_list, apply_display_sequence, \
+    getSweepFrames, buildSweepTable, SweepTable
+from camstim.sweepstim import Stimulus, MovieReadAhead
+
+
+def legacy_sweep_frames(sweeporder, sweeptime, preexpsec, postexpsec,
+                        postsweepsec, fps):
+    sweepframelist = []
+    frame = int(preexpsec * fps)
+    for i in range(len(sweeporder)):
+        frames = (frame, frame + int(fps * sweeptime) - 1)
+        sweepframelist.append(frames)
+        frame = frames[1] + int(fps) * postsweepsec + 1
+    return sweepframelist
+
+
+def legacy_base_list(sweep_order, sweep_length, blank_length, fps):
+    seq = []
+    sweep_frames = legacy_sweep_frames(sweep_order, sweep_length, 0, 0,
+                                       blank_length, fps)
+    for index, sweep in enumerate(sweep_frames):
+        seq.extend([sweep_order[index]]*(int(sweep[1]-sweep[0]+1)))
+        seq.extend([-1]*int(fps*blank_length))
+    return seq
+
+
+def legacy_frame_list(sweep_order, sweep_length, blank_length, start_time,
+                      stop_time, fps):
+    seq = [-1]*int(fps*start_time)
+    seq.extend(legacy_base_list(sweep_order, sweep_length, blank_length, fps))
+    if stop_time:
+        seq = seq[:int(fps*stop_time)]
+    return np.array(seq, dtype=np.int32)
+
+
+def legacy_display_list(sweep_order, sweep_length, blank_length,
+                        display_intervals, fps):
+    display_intervals = np.array(display_intervals)
+    seq0 = legacy_base_list(sweep_order, sweep_length, blank_length, fps)
+    seq = [-1]*int(fps*display_intervals[0, 0])
+    for i, (start, stop) in enumerate(display_intervals):
+        frames_to_add = int((stop-start)*fps)
+        seq.extend(seq0[:frames_to_add])
+        try:
+            next_start = display_intervals[i+1, 0]
+        except IndexError:
+            break
+        seq.extend([-1]*int((next_start-stop)*fps))
+        seq0 = seq0[frames_to_add:]
+    return np.array(seq, dtype=np.int32)
+
+
+SWEEP_ORDERS = [
+    [],
+    [0],
+    [0, 1, 2, 3, -1, 4, 5, 6, 7, -1],
+    list(np.random.RandomState(0).permutation(50)),
+]
+
+
+@pytest.mark.parametrize("sweep_order", SWEEP_ORDERS)
+@pytest.mark.parametrize("sweep_length", [1.0/30, 0.3, 1.0, 2.5])
+@pytest.mark.parametrize("blank_length", [0, 0.5, 1.0])
+@pytest.mark.parametrize("fps", [60.0, 30.0])
+def test_sweep_frames(sweep_order, sweep_length, blank_length, fps):
+    assert getSweepFrames(sweep_order, sweep_length, 0, 0, blank_length,
+                          fps) == legacy_sweep_frames(sweep_order, sweep_length,
+                                                      0, 0, blank_length, fps)
+
+
+@pytest.mark.parametrize("sweep_order", SWEEP_ORDERS)
+@pytest.mark.parametrize("sweep_length", [1.0/30, 0.3, 1.0])
+@pytest.mark.parametrize("blank_length", [0, 0.5])
+@pytest.mark.parametrize("start_time", [0.0, 1.5])
+@pytest.mark.parametrize("stop_time", [None, 0.0, 2.0, 9.0])
+def test_frame_list(sweep_order, sweep_length, blank_length, start_time,
+                    stop_time):
+    fps = 60.0
+    stop_frame = int(fps*stop_time) if stop_time else None
+    frame_list = build_frame_list(sweep_order,
+                                  int(fps*sweep_length),
+                                  int(fps*blank_length),
+                                  int(fps*start_time),
+                                  stop_frame)
+    expected = legacy_frame_list(sweep_order, sweep_length, blank_length,
+                                 start_time, stop_time, fps)
+    assert frame_list.dtype == np.int32
+    np.testing.assert_array_equal(frame_list, expected)
+
+
+DISPLAY_SEQUENCES = [
+    [(0.0, 1.0)],
+    [(30.0, 480.0)],
+    [(2.5, 3.0), (4.0, 4.75), (10.0, 19.0)],
+    # more display time than there are sweeps
+    [(1.0, 100.0), (200.0, 300.0), (400.0, 500.0)],
+    # movie style blocks with integer start/stop times
+    [(30, 39), (150, 159), (270, 279)],
+]
+
+
+@pytest.mark.parametrize("sweep_order", SWEEP_ORDERS)
+@pytest.mark.parametrize("sweep_length", [1.0/30, 0.3])
+@pytest.mark.parametrize("blank_length", [0, 0.5])
+@pytest.mark.parametrize("display_sequence", DISPLAY_SEQUENCES)
+def test_display_sequence(sweep_order, sweep_length, blank_length,
+                          display_sequence):
+    fps = 60.0
+    base = build_frame_list(sweep_order, int(fps*sweep_length),
+                            int(fps*blank_length))
+    frame_list = apply_display_sequence(base, np.array(display_sequence), fps)
+    expected = legacy_display_list(sweep_order, sweep_length, blank_length,
+                                   display_sequence, fps)
+    assert frame_list.dtype == np.int32
+    np.testing.assert_array_equal(frame_list, expected)
+
+
+DIMLISTS = [
+    [],
+    [[0, 90, 180]],
+    [[0, 45], [1.0, 2.0, 4.0], ["a", "b"]],
+    [[(i, i % 3) for i in range(500)], [0.1, 0.2], [True]],
+    [[1, 2], []],
+]
+
+
+@pytest.mark.parametrize("dimlist", DIMLISTS)
+def test_sweep_table(dimlist):
+    table = SweepTable(dimlist)
+    expected = list(itertools.product(*dimlist))
+    assert len(table) == len(expected)
+    assert list(table) == expected
+    assert [table[i] for i in range(len(table))] == expected
+    assert table[-len(table):] == expected
+    with pytest.raises(IndexError):
+        table[len(table)]
+    copy = pickle.loads(pickle.dumps(table))
+    assert list(copy) == expected
+    assert copy.dimlist == dimlist
+
+
+def test_sweep_table_pickles_small():
+    sweep_params = {
+        'OriSurp': ([(i, i % 4) for i in range(2000)], 0),
+        'PosSizesAll': ([0, 1, 2, 3], 1),
+    }
+    table, order, dimnames = buildSweepTable(sweep_params)
+    assert dimnames == ['OriSurp', 'PosSizesAll']
+    assert len(table) == len(order) == 8000
+    assert table[4*7 + 3] == ((7, 3), 3)
+    expanded = list(itertools.product(*table.dimlist))
+    assert len(pickle.dumps(table)) * 3 < len(pickle.dumps(expanded))
+
+
+class FakePsychopyStim(object):
+    def __init__(self):
+        self.pos = (0, 0)
+        self.ori = None
+        self.phase = None
+
+    def setOri(self, ori):
+        self.ori = ori
+
+    def setPos(self, pos):
+        self.pos = pos
+
+    def setPhase(self, phase):
+        self.phase = phase
+
+    def draw(self):
+        pass
+
+
+def test_sweep_setters():
+    sweep_params = {
+        'Ori': ([0, 90], 0),
+        'TF': ([2.0], 1),
+        'PosX': ([10, 30], 2),
+        'PosY': ([20], 3),
+        'NotAParam': ([1], 4),
+    }
+    stim = Stimulus(FakePsychopyStim(), sweep_params, sweep_length=1.0,
+                    fps=60.0)
+    frame_list = stim.frame_list
+    for frame in range(stim.get_total_frames()):
+        stim.update(frame)
+        ori, tf, pos_x, pos_y, _ = stim.sweep_table[frame_list[frame]]
+        assert stim.stim.ori == ori
+        assert stim.stim.pos == (pos_x, pos_y)
+        assert stim.on_draw == {'TF': tf}
+        assert stim.stim.phase == tf*frame/60.0
+
+
+def test_movie_read_ahead(tmpdir):
+    path = str(tmpdir.join("movie.npy"))
+    movie = np.arange(10*4*6, dtype=np.uint8).reshape(10, 4, 6)
+    np.save(path, movie)
+    movie = np.load(path, mmap_mode='r')
+    assert movie[3].nbytes == 24
+    read_ahead = MovieReadAhead(movie, path)
+    read_ahead.request([2, 3, 4])
+    read_ahead.request([8, 9, 10])
+    read_ahead.close()
+    read_ahead._thread.join(5.0)
+    assert not read_ahead._thread.is_alive()
+    assert read_ahead.offset + 10*read_ahead.frame_bytes == \
+        len(open(path, 'rb').read())
+
+
+def test_packaged_sweep_table():
+    sweep_params = {
+        'Ori': ([0, 90], 0),
+        'PosX': ([10, 30], 1),
+    }
+    stim = Stimulus(FakePsychopyStim(), sweep_params, sweep_length=1.0,
+                    fps=60.0)
+    output = stim.package()
+    # plain python, not a camstim.misc.SweepTable
+    assert type(output['sweep_table']) is dict
+    assert output['sweep_table']['dimnames'] == ['Ori', 'PosX']
+    dimlist = output['sweep_table']['dimlist']
+    assert list(itertools.product(*dimlist)) == \
+        [(0, 10), (0, 30), (90, 10), (90, 30)]
+    assert 'camstim' not in pickle.dumps(output)
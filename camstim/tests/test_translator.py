@@ -2,14 +2,18 @@
 test_translator.py
 
 This trial translator is used to convert foraging2-style trials to
-    foraging1-style trials for backwards compatibility.
+    foraging1-style trials for backwards compatibility.  Also checks that the
+    array logs of a translated file match the legacy ones.
 
 """
 import os
 import pickle
 import pytest
 
-from camstim.translator import TrialTranslator
+import numpy as np
+
+from camstim.translator import TrialTranslator, STIM_LOG_DTYPE, \
+    RESPONSE_LOG_DTYPE, REWARD_DTYPE
 
 NEW_TRIAL = {
     'index': 2,
@@ -54,3 +58,61 @@ def test_translate_file(tmpdir, translator):
     new_trials = t.find_trial_logs(exp_data)
     old_trial_log = t.translate_file(path, out_path)
     assert len(new_trials) == len(old_trial_log)
+
+def make_exp_data(vsyncs=100, intervals=()):
+    no_lick_trial = dict(NEW_TRIAL, index=3, licks=[], rewards=[])
+    return {'items': {'behavior': {
+        'update_count': vsyncs,
+        'intervalsms': list(intervals),
+        'stimuli': {'natural_scenes': {'draw_log': [i // 3 % 2
+                                                    for i in range(vsyncs)]}},
+        'trial_log': [NEW_TRIAL, no_lick_trial, NEW_TRIAL],
+        'params': {},
+        'encoders': [{'dx': [0.0]*vsyncs}],
+    }}}
+
+
+def test_stim_log():
+    exp_data = make_exp_data()
+    legacy = TrialTranslator(legacy_logs=True).make_stim_log(exp_data)
+    log = TrialTranslator().make_stim_log(exp_data)
+    assert log.dtype.names == ('frame', 'state', 'ori')
+    assert len(log) == len(legacy) == 100
+    for row, entry in zip(log, legacy):
+        assert (row['frame'], row['state'], row['ori']) == \
+            (entry['frame'], entry['state'], entry['ori'])
+
+
+def test_response_log_and_rewards(translator):
+    exp_data = make_exp_data()
+    legacy = TrialTranslator(legacy_logs=True)
+    assert translator.make_response_log(exp_data)['frame'].tolist() == \
+        [e['frame'] for e in legacy.make_response_log(exp_data)] == \
+        [1208, 1208]
+    rewards = translator.find_rewards(exp_data)
+    legacy_rewards = legacy.find_rewards(exp_data)
+    assert legacy_rewards.shape == (2, 2)
+    assert rewards['time'].tolist() == legacy_rewards[:, 0].tolist()
+    assert rewards['frame'].tolist() == legacy_rewards[:, 1].tolist()
+
+
+@pytest.mark.parametrize("intervals", [(), (16.7,)*100])
+def test_vsyncs(translator, intervals):
+    exp_data = make_exp_data(intervals=intervals)
+    legacy = TrialTranslator(legacy_logs=True).find_vsyncs(exp_data)
+    vsyncs = translator.find_vsyncs(exp_data)
+    assert vsyncs.dtype == np.float64
+    assert vsyncs.tolist() == list(legacy)
+    assert len(vsyncs) == 100
+
+
+def test_translate_file_arrays(tmpdir, translator):
+    out_path = str(tmpdir) + "/output.pkl"
+    old_trial_log = translator.translate_file(make_exp_data(), out_path)
+    assert [t['index'] for t in old_trial_log] == [2, 3, 2]
+    with open(out_path, 'rb') as f:
+        translated = pickle.load(f)
+    assert translated['stimuluslog'].dtype == STIM_LOG_DTYPE
+    assert translated['responselog'].dtype == RESPONSE_LOG_DTYPE
+    assert translated['rewards'].dtype == REWARD_DTYPE
+    assert translated['vsyncintervals'].tolist() == [16.0]*100
@@ -0,0 +1,164 @@
+"""
+test_warp.py
+
+Checks that the warp meshes are the same, bit for bit, as the ones built
+    quad by quad, that they are the same when loaded from the warp cache, and
+    that indexed triangles cover the same quads.  Also checks warpfile loading.
+
+"""
+import os
+
+import numpy as np
+import pytest
+
+from camstim.window import Warp, warpGrid, quadsFromGrid, warpfileQuads, \
+    loadWarpMesh, warpCacheKey, gridFromQuads, gridIndices, readWarpfile, \
+    loadWarpfile, warpfileCachePath
+
+
+def loop_quads(x_coords, y_coords, u_coords, v_coords):
+    """ Quads as they were built before vectorizing. """
+    ygrid, xgrid = x_coords.shape
+    vertices = np.zeros(((xgrid-1)*(ygrid-1)*4, 2), dtype='float32')
+    tcoords = np.zeros(((xgrid-1)*(ygrid-1)*4, 2), dtype='float32')
+    vdex = 0
+    for y in xrange(0, ygrid-1):
+        for x in xrange(0, xgrid-1):
+            for i, (yi, xi) in enumerate([(y, x), (y, x+1), (y+1, x+1),
+                                          (y+1, x)]):
+                vertices[vdex+i, 0] = x_coords[yi, xi]
+                vertices[vdex+i, 1] = y_coords[yi, xi]
+                tcoords[vdex+i, 0] = u_coords[yi, xi]
+                tcoords[vdex+i, 1] = v_coords[yi, xi]
+            vdex += 4
+    return vertices, tcoords
+
+
+def loop_warpfile_quads(warpdata, cols, rows):
+    """ Warpfile quads as they were built before vectorizing. """
+    vertices = np.zeros(((cols-1)*(rows-1)*4, 2), dtype='float32')
+    tcoords = np.zeros(((cols-1)*(rows-1)*4, 2), dtype='float32')
+    opacity = np.ones(((cols-1)*(rows-1)*4, 4), dtype='float32')
+    vdex = 0
+    for y in xrange(0, rows-1):
+        for x in xrange(0, cols-1):
+            index = y*cols + x
+            for i, j in enumerate([index, index+1, index+cols+1,
+                                   index+cols]):
+                vertices[vdex+i] = warpdata[j, 0:2]
+                tcoords[vdex+i] = warpdata[j, 2:4]
+                opacity[vdex+i, 3] = warpdata[j, 4]
+            vdex += 4
+    return vertices, tcoords, opacity
+
+
+def assert_identical(a, b):
+    assert a.dtype == b.dtype and a.shape == b.shape
+    assert a.tobytes() == b.tobytes()
+
+
+@pytest.mark.parametrize("warp", [Warp.Spherical, Warp.Cylindrical,
+                                  Warp.Curvilinear])
+@pytest.mark.parametrize("eyepoint", [(0.5, 0.5), (0.3, 0.65)])
+def test_grid_quads(warp, eyepoint):
+    grid = warpGrid(51.0, 51.0/1.6, 15.0, eyepoint, 40, 40, warp)
+    expected = loop_quads(*grid)
+    assert_identical(quadsFromGrid(grid[0], grid[1]), expected[0])
+    assert_identical(quadsFromGrid(grid[2], grid[3]), expected[1])
+
+
+def test_warpfile_quads():
+    cols, rows = 7, 5
+    warpdata = np.random.RandomState(0).uniform(-1, 1, (cols*rows, 5))
+    expected = loop_warpfile_quads(warpdata, cols, rows)
+    for result, expect in zip(warpfileQuads(warpdata, cols, rows), expected):
+        assert_identical(result, expect)
+
+
+def test_indexed_triangles():
+    cols, rows = 7, 5
+    warpdata = np.random.RandomState(0).uniform(-1, 1, (cols*rows, 5))
+    vertices, tcoords, opacity = warpfileQuads(warpdata, cols, rows)
+    points = gridFromQuads(vertices, rows, cols)
+    assert_identical(points, warpdata[:, 0:2].astype('float32'))
+    assert_identical(gridFromQuads(tcoords, rows, cols),
+                     warpdata[:, 2:4].astype('float32'))
+    assert len(points) == rows*cols < len(vertices)
+    # each quad (a, b, c, d) is drawn as triangles (a, b, c) and (a, c, d)
+    for quads in (vertices, tcoords, opacity):
+        triangles = gridFromQuads(quads, rows, cols)[gridIndices(rows, cols)]
+        corners = quads.reshape(-1, 4, quads.shape[1])[:, [0, 1, 2, 0, 2, 3]]
+        assert_identical(triangles, corners.reshape(-1, quads.shape[1]))
+
+
+def test_warp_cache(tmpdir):
+    cache_dir = str(tmpdir)
+    args = (51.0, 51.0/1.6, 15.0, (0.5, 0.5), 40, 40, Warp.Spherical)
+    grid = warpGrid(*args)
+    expected = quadsFromGrid(grid[0], grid[1]), quadsFromGrid(grid[2], grid[3])
+    path = os.path.join(cache_dir, warpCacheKey(*args) + ".npz")
+    assert not os.path.exists(path)
+    for result, expect in zip(loadWarpMesh(*args, cache_dir=cache_dir),
+                              expected):
+        assert_identical(result, expect)
+    assert os.listdir(cache_dir) == [os.path.basename(path)]
+    for result, expect in zip(loadWarpMesh(*args, cache_dir=cache_dir),
+                              expected):
+        assert_identical(result, expect)
+    # any parameter change is a different mesh
+    assert warpCacheKey(*args) != warpCacheKey(*(args[:3] + ((0.5, 0.4),) +
+                                                 args[4:]))
+    assert warpCacheKey(*args) != warpCacheKey(*(args[:6] +
+                                                 (Warp.Cylindrical,)))
+    # a corrupt cache file is replaced
+    with open(path, 'wb') as f:
+        f.write(b"not a mesh")
+    for result, expect in zip(loadWarpMesh(*args, cache_dir=cache_dir),
+                              expected):
+        assert_identical(result, expect)
+    with np.load(path) as data:
+        assert_identical(data['tcoords'], expected[1])
+
+
+def write_warpfile(path, warpdata, cols, rows):
+    with open(path, 'w') as f:
+        f.write("2\n%s %s\n" % (cols, rows))
+        for point in warpdata:
+            f.write(" ".join(repr(v) for v in point) + "\n")
+
+
+def test_read_warpfile(tmpdir):
+    cols, rows = 7, 5
+    warpdata = np.random.RandomState(0).uniform(-1, 1, (cols*rows, 5))
+    path = str(tmpdir.join("warpfile.data"))
+    write_warpfile(path, warpdata, cols, rows)
+    filetype, c, r, data = readWarpfile(path)
+    assert (filetype, c, r) == (2, cols, rows)
+    assert_identical(data, np.loadtxt(path, skiprows=2))
+
+
+def test_load_warpfile(tmpdir):
+    cols, rows = 7, 5
+    warpdata = np.random.RandomState(0).uniform(-1, 1, (cols*rows, 5))
+    path = str(tmpdir.join("warpfile.data"))
+    cache_dir = str(tmpdir.mkdir("cache"))
+    write_warpfile(path, warpdata, cols, rows)
+    expected = readWarpfile(path)
+
+    cached_path = warpfileCachePath(path, cache_dir)
+    for _ in range(2):
+        result = loadWarpfile(path, cache_dir)
+        assert os.path.isfile(cached_path)
+        assert result[:3] == expected[:3]
+        assert_identical(result[3], expected[3])
+
+    # binary warpfiles load directly
+    result = loadWarpfile(cached_path)
+    assert result[:3] == expected[:3]
+    assert_identical(result[3], expected[3])
+
+    # a changed warpfile gets a new binary copy
+    write_warpfile(path, warpdata[:-cols], cols, rows - 1)
+    os.utime(path, (0, 0))
+    assert warpfileCachePath(path, cache_dir) != cached_path
+    assert loadWarpfile(path, cache_dir)[2] == rows - 1
@@ -0,0 +1,55 @@
+"""
+bench_lspawncoords.py
+
+Times respawning squares moving in a diagonal direction: the per-element loop
+    previously in OurStims._newStimsXY vs. the vectorized lspawncoords.
+
+>python bench_lspawncoords.py [n_elements]
+
+"""
+import sys
+import timeit
+
+import numpy as np
+
+from full_pipeline_script import lspawncoords
+
+
+def loopspawncoords(coords_main, coords_buff, init_wid, init_hei, ratio, buffsign):
+    """Previous per-element implementation, for comparison."""
+    coords = np.concatenate((coords_main[:, np.newaxis], coords_buff[:, np.newaxis]), axis=1)
+    for i, val in enumerate(coords):
+        if val[0] > init_wid*ratio:
+            new_main = val[0] - init_wid*ratio
+            coords[i][0] = (val[1] - init_wid/2)*buffsign[0]
+            coords[i][1] = new_main*ratio - init_hei/2
+        elif val[0] < 0.1:
+            coords[i][0] = (val[0] - init_wid/2)*buffsign[0]
+            coords[i][1] = (val[1] - init_hei/2)*buffsign[1]
+        else:
+            coords[i][0] = val[0]*ratio - init_wid/2
+            coords[i][1] = (val[1] - init_hei/2)*buffsign[1]
+    return coords
+
+
+def main(n_elements=5000, repeats=50):
+    init_wid, init_hei = 1920.0, 1200.0
+    buff = 100.0
+    ratio = 0.5 # 45 deg
+    leng = init_wid*ratio + init_hei/ratio
+    buffsign = [1, -1]
+    rng = np.random.RandomState(0)
+    coords_main = rng.uniform(-buff, leng, n_elements)
+    coords_buff = rng.uniform(-buff, 0, n_elements)
+
+    args = (coords_main, coords_buff, init_wid, init_hei, ratio, buffsign)
+    np.testing.assert_array_equal(loopspawncoords(*args), lspawncoords(*args))
+
+    for func in [loopspawncoords, lspawncoords]:
+        t = min(timeit.repeat(lambda: func(*args), number=1, repeat=repeats))
+        print("{:<16} {} elements: {:.3f} ms".format(func.__name__, n_elements, t*1000))
+
+
+if __name__ == "__main__":
+    n_elements = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    main(n_elements)
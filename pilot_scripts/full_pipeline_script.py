@@ -5,10 +5,15 @@ Everything is randomized for each session for each animal (positions, sizes and
 orientations of Gabors).
 """
 import camstim
+import camstim.movies
 from camstim import Stimulus, SweepStim, Foraging, Window, Warp, MovieStim
 
+import atexit
 import random
 import os
+import sys
+import tempfile
+import time
 import yaml
 
 import numpy as np
@@ -20,6 +25,89 @@ from psychopy.tools.arraytools import val2array
 import argparse
 
 
+class ArrayRecorder(object):
+    """
+    Records arrays (rounded to int16), e.g. element positions at every frame, 
+    in place, into a preallocated n_rows x row_shape array. 
+    If a path is given, the array is a memory-mapped .npy file instead, for 
+    long blocks.
+    The array grows if more rows are recorded than were preallocated.
+    Pickles as a plain array of the recorded rows.
+    close() deletes the memory-mapped file, once the output has been saved.
+    """
+    
+    def __init__(self, n_rows, row_shape, path=None):
+        self.row_shape = tuple(row_shape)
+        self.path = path
+        self.count = 0
+        self._rounded = np.empty(self.row_shape)
+        self.data = self._alloc(max(int(n_rows), 1))
+    
+    def _alloc(self, n_rows, path=None):
+        shape = (n_rows,) + self.row_shape
+        path = path or self.path
+        if path is None:
+            return np.empty(shape, dtype=np.int16)
+        return np.lib.format.open_memmap(path, mode='w+', dtype=np.int16, shape=shape)
+    
+    def _grow(self, n_rows=0):
+        n_rows = max(len(self.data) + max(len(self.data)//2, 1), n_rows)
+        if self.path is None:
+            data = self._alloc(n_rows)
+            data[:self.count] = self.data[:self.count]
+            self.data = data
+        else: # copy to a new file, then replace the old one
+            tmp_path = self.path + '.tmp'
+            data = self._alloc(n_rows, tmp_path)
+            data[:self.count] = self.data[:self.count]
+            data.flush()
+            del data
+            self.data = None # closes the old file
+            os.remove(self.path)
+            os.rename(tmp_path, self.path)
+            self.data = np.lib.format.open_memmap(self.path, mode='r+')
+    
+    def append(self, row):
+        if self.count == len(self.data):
+            self._grow()
+        np.around(row, out=self._rounded)
+        self.data[self.count] = self._rounded
+        self.count += 1
+    
+    def extend(self, rows):
+        end = self.count + len(rows)
+        if end > len(self.data):
+            self._grow(end)
+        self.data[self.count:end] = np.around(rows)
+        self.count = end
+    
+    def get_array(self):
+        """Returns the recorded rows (a view, not a copy)."""
+        return self.data[:self.count]
+    
+    def __len__(self):
+        return self.count
+    
+    def __getitem__(self, item):
+        return self.get_array()[item]
+    
+    def __reduce__(self):
+        if self.path is not None:
+            self.data.flush()
+        # a plain ndarray view: the rows are read from the file as they are
+        # pickled, not copied into memory first
+        return np.asarray(self.get_array()).__reduce__()
+    
+    def close(self):
+        """Drops the recorded rows and deletes the memory-mapped file, if any."""
+        path, self.data, self.count = self.path, None, 0
+        if path is not None and os.path.exists(path):
+            try:
+                os.remove(path)
+            except OSError as e:
+                logging.warning("Could not delete {}: {}".format(path, e))
+
+
 class OurStims(ElementArrayStim):
     """
     This stimulus class allows what I want it to...
@@ -41,6 +129,7 @@ class OurStims(ElementArrayStim):
                  flipdirec=[], # intervals during which to flip direction [start, end (optional)]S
                  flipfrac=0.0, # fraction of elements that should be flipped (0 to 1)
                  duration=-1, # duration in seconds (-1 for no end)
+                 posfile=None, # .npy file to record positions to (memory-mapped), instead of memory
                  currval=None, # pass some values for the first initialization (from fliparray)
                  initScr=True, # initialize elements on the screen
                  rng=None,
@@ -104,6 +193,12 @@ class OurStims(ElementArrayStim):
             self._orikappa = orikappa
             self._initOriArrays()
             
+            # function returning the (OriSurp, PosSizesAll) values of the sweeps 
+            # to be shown, used to precompute their orientations at block onset
+            self._sweeps = None
+            self._oribank = None
+            self._oribankidx = 0
+            
             self.duration = duration*float(fps)
             self.initScr = initScr
             
@@ -113,11 +208,14 @@ class OurStims(ElementArrayStim):
             self.starttime = core.getTime()
             
             if self.defaultspeed != 0.0:
-                # initialize list to compile pos_x, pos_y by frame (as int16)
-                self.posByFrame = list()
+                # preallocate array to compile pos_x, pos_y by frame (as int16)
+                # use 1 min if no duration, will grow as needed
+                n_frames = self.duration if self.duration > 0 else 60*float(fps)
+                self.posByFrame = ArrayRecorder(n_frames, (self.nElements, 2), posfile)
             else: # assuming if no speed, that it is gabors!
-                # initialize list to compile orientations at every change (as int16)
-                self.orisByImg = list()
+                # initialize array to compile orientations at every change (as int16)
+                # filled up front with the orientation bank, if there is one
+                self.orisByImg = ArrayRecorder(0, (self.nElements,))
                 
             
             if possizes is None:
@@ -184,16 +282,22 @@ class OurStims(ElementArrayStim):
         is a surprise (90 deg shift and U locations and sizes).
         """
         
+        # precompute orientations for the whole block at onset
+        if self._oribank is None and self._sweeps is not None:
+            self._initOriBank(self._sweeps())
+        
         self._orimu = oriparsurp[0] # set orientation mu (deg)
         
         # set if surprise set
         self._surp = oriparsurp[1]
         
         # set orientations
+        banked = self._oribank is not None and self._oribankidx < len(self._oribank)
         self.setOriParams(operation, log)
 
-        # compile orientations at every sweep (as int16)
-        self.orisByImg.extend([np.around(self.oris).astype(np.int16)])
+        # compile orientations at every sweep (as int16), unless precomputed
+        if not banked:
+            self.orisByImg.append(self.oris)
         
         
     def setOriKappa(self, ori_kappa, operation='', log=None):
@@ -212,6 +316,9 @@ class OurStims(ElementArrayStim):
         """
         if self._orikappa is None: # no dispersion
             ori_array = self._orimu
+        elif self._oribank is not None and self._oribankidx < len(self._oribank):
+            ori_array = self._oribank[self._oribankidx]
+            self._oribankidx += 1
         else:
             if self.rng is not None:
                 ori_array_rad = self.rng.vonmises(np.deg2rad(self._orimu), self._orikappa, self.nElements)
@@ -222,6 +329,35 @@ class OurStims(ElementArrayStim):
         self.setOris(ori_array, operation, log)
         self._needupdate = True
     
+    def _initOriBank(self, sweeps):
+        """Precomputes the orientations for a list of (OriSurp, PosSizesAll) 
+        sweep values, so that sweeps only have to look them up.
+        Each sweep draws twice, with the same mus and in the same order as 
+        setOriSurp and setPosSizesAll, so the values are identical as long as 
+        nothing else draws from the rng in between (i.e., during the block).
+        The first draw of each sweep is the one recorded in orisByImg.
+        """
+        if self._orikappa is None or len(sweeps) == 0:
+            return
+        
+        mus = []
+        for oriparsurp, combo in sweeps:
+            orimu, surp = oriparsurp[0], oriparsurp[1]
+            mus.append(orimu)
+            _, orimu = self._nextPosSize(combo, orimu, surp)
+            mus.append(orimu)
+        
+        mus = np.deg2rad(mus)[:, np.newaxis]
+        shape = (len(mus), self.nElements)
+        if self.rng is not None:
+            oribank = np.rad2deg(self.rng.vonmises(mus, self._orikappa, shape))
+        else:
+            oribank = np.rad2deg(np.random.vonmises(mus, self._orikappa, shape))
+        
+        self.orisByImg.extend(oribank[::2])
+        self._oribank = oribank
+        self._oribankidx = 0
+    
     def setSizesAll(self, sizes, operation='', log=None):
         """Set new sizes.
         Pass list (same size as nStims)
@@ -298,48 +434,51 @@ class OurStims(ElementArrayStim):
         #    self.ctrl = False
 
         # Determine trial type and rotate mu's accordingly
-
+        possize_idx, self._orimu = self._nextPosSize(combo, self._orimu, self._surp)
+        pos = self.possizes[possize_idx][0]
+        sizes = self.possizes[possize_idx][1]
+        
+        self.setXYs(pos, operation, log)
+        self.setSizes(sizes, operation, log)
+        self._adjustSF(sizes)
+    
+        # resample orientations each time new positions and sizes are set
+        self.setOriParams(operation, log)
+        self._needupdate = True
+    
+    def _nextPosSize(self, combo, orimu, surp):
+        """Returns the pos/size combo index and orientation mu to use for a
+        pos/size combo, given the current mu and surprise type.
+        """
         if self._ctrl == True: 
-            if self._surp != 0 and combo == 3:
+            if surp != 0 and combo == 3:
 
-                if self._surp == 1:
+                if surp == 1:
                     possize_idx = 4
-                elif self._surp == 2:
+                elif surp == 2:
                     possize_idx = 3
                 else:
                     raise ValueError("self._surp must be 0, 1 or 2.")
 
-                pos = self.possizes[possize_idx][0]
-                sizes = self.possizes[possize_idx][1]
-                self._orimu = (self._orimu + 180)%360
+                orimu = (orimu + 180)%360
             else:
-                pos = self.possizes[combo][0]
-                sizes = self.possizes[combo][1]
-                self._orimu = (self._orimu + combo*90)%360
+                possize_idx = combo
+                orimu = (orimu + combo*90)%360
         
         if self._ctrl == False:
-            if self._surp != 0 and combo == 3:
-                if self._surp == 1:
+            if surp != 0 and combo == 3:
+                if surp == 1:
                     possize_idx = 4
-                elif self._surp == 2:
+                elif surp == 2:
                     possize_idx = 3
                 else:
                     raise ValueError("self._surp must be 0, 1 or 2.")
 
-                pos = self.possizes[possize_idx][0]
-                sizes = self.possizes[possize_idx][1]
-                self._orimu = (self._orimu + 90)%360
+                orimu = (orimu + 90)%360
             else:
-                pos = self.possizes[combo][0]
-                sizes = self.possizes[combo][1]
+                possize_idx = combo
         
-        self.setXYs(pos, operation, log)
-        self.setSizes(sizes, operation, log)
-        self._adjustSF(sizes)
-    
-        # resample orientations each time new positions and sizes are set
-        self.setOriParams(operation, log)
-        self._needupdate = True
+        return possize_idx, orimu
     
 #    def _check_keys(self):
 #        for keys in event.getKeys(timeStamped=True):
@@ -455,18 +594,8 @@ class OurStims(ElementArrayStim):
                     coords_main = self.rng.uniform(-self._buff, self._leng, newStims)[:, np.newaxis]
                 else:
                     coords_main = np.random.uniform(-self._buff, self._leng, newStims)[:, np.newaxis]
-                coords = np.concatenate((coords_main, coords_buff), axis=1)
-                for i, val in enumerate(coords):
-                    if val[0] > self.init_wid*self._ratio: # samples in the height area
-                        new_main = val[0] - self.init_wid*self._ratio # for val over wid -> hei
-                        coords[i][0] = (val[1] - self.init_wid/2)*self._buffsign[0] 
-                        coords[i][1] = new_main*self._ratio - self.init_hei/2
-                    elif val[0] < 0.1: # samples in the corner area
-                        coords[i][0] = (val[0] - self.init_wid/2)*self._buffsign[0]
-                        coords[i][1] = (val[1] - self.init_hei/2)*self._buffsign[1]
-                    else: # samples in the width area
-                        coords[i][0] = val[0]*self._ratio - self.init_wid/2
-                        coords[i][1] = (val[1] - self.init_hei/2)*self._buffsign[1]
+                coords = lspawncoords(coords_main[:, 0], coords_buff[:, 0], self.init_wid, 
+                                      self.init_hei, self._ratio, self._buffsign)
             return coords
         
         else:
@@ -595,7 +724,7 @@ class OurStims(ElementArrayStim):
         # log current posx, posy (rounded to int16) if stim is moving
         # shape is n_frames x n_elements x 2
         if self.defaultspeed != 0.0:
-            self.posByFrame.extend([np.around(self._coords).astype(np.int16)])
+            self.posByFrame.append(self._coords)
         
         super(OurStims, self).draw()
         
@@ -653,6 +782,11 @@ SQUARE_PARAMS = {
                 'reg_len': [30, 90], # range of durations (sec) for reg flow
                 'surp_len': [2, 4], # range of durations (sec) for mismatch flow
                 
+                # blocks longer than this (sec) record positions to a memory-mapped
+                # file in spill_dir (temp dir if None), instead of memory (None to never)
+                'spill_len': None,
+                'spill_dir': None,
+                
                 ### Changing these will require tweaking downstream...
                 'units': 'pix', # avoid using deg, comes out wrong at least on my computer (scaling artifact? 1.7)
                 
@@ -667,6 +801,29 @@ MOVIE_PARAMS = {
                 'surp_len': [10, 30], # range of durations (sec) for seq of surprise sets
                 'seg_len': 10, # duration (sec) of each segment (somewhat arbitrary) 
                 'vids_per_block': 12, # Number of videos per block 
+                'movie_ext': '.npy', # '.npz' for indexed clips (shared frames) from movie_transformer
+                'mmap_mode': 'r', # memory-map clips instead of loading them (None to load)
+                'read_ahead': 30, # number of upcoming frames read in the background
+                'frame_cache_mb': 2048, # max memory (MB) for frames reused across blocks, no cache if they don't fit (None: no limit)
+                }
+
+MONITOR_PARAMS = {
+                'dist': 15.0, # viewing distance (cm)
+                'wid': 52.0, # monitor width (cm)
+                'size_pix': [1920, 1200], # monitor size (pix)
+                }
+
+
+GRATING_PARAMS = {
+                'sweep_params': {
+                               'Contrast': ([0.8], 0),
+                               'SF': ([0.08], 1),
+                               'Ori': (range(0, 180, 30), 2),
+                               'Phase': ([0.0, 0.25, 0.5, 0.75], 3),
+                               },
+                'sweep_length': 0.3, # duration (sec) of each sweep
+                'blank_sweeps': 25, # blank sweep after every N sweeps
+                'run_len': 14.7, # display time (sec) per run (gratings_dur is in runs)
                 }
 
 
@@ -675,36 +832,67 @@ def winVar(win, units, small_angle_approx=True):
     Takes window and units.
     Uses small angle approximation, by default # AMENDED FOR PILOT V2
     """
-    dist = win.monitor.getDistance()
-    width = win.monitor.getWidth()
-    
+    return monVar(win.size, win.monitor.getDistance(), win.monitor.getWidth(),
+                  units, small_angle_approx)
+
+def monVar(size, dist, width, units, small_angle_approx=True):
+    """Same as winVar, but takes the window size (pix), and the monitor 
+    distance and width (cm) instead of a window, so it can be used without 
+    opening one.
+    """
     # get values to convert deg to pixels
     if small_angle_approx:
-        pix_wid = float(width)/win.size[0]
+        pix_wid = float(width)/size[0]
         deg_per_pix = np.rad2deg(pix_wid/dist) # about 0.10 if width is 1920
     else:
         deg_wid = np.rad2deg(np.arctan((0.5*width)/dist)) * 2 # about 120
-        deg_per_pix = deg_wid/win.size[0] # about 0.06 if width is 1920
+        deg_per_pix = deg_wid/size[0] # about 0.06 if width is 1920
 
     if units == 'deg':
         if small_angle_approx:
             raise NotImplementedError('fieldSize in degrees is ill-defined, if using small angle approximation.')
         
-        deg_hei = deg_per_pix * win.size[1] # about 67
+        deg_hei = deg_per_pix * size[1] # about 67
         # Something is wrong with deg as this does not fill screen
         init_wid = deg_wid
         init_hei = deg_hei
         fieldSize = [init_wid, init_hei]
 
     elif units == 'pix':
-        init_wid = win.size[0]
-        init_hei = win.size[1]
+        init_wid = size[0]
+        init_hei = size[1]
         fieldSize = [init_wid, init_hei]
     
     else:
         raise ValueError('Only implemented for deg or pixel units so far.')
     
     return fieldSize, deg_per_pix
+
+def lspawncoords(coords_main, coords_buff, init_wid, init_hei, ratio, buffsign):
+    """Maps samples along the L-shaped area around the window, from which
+    stimuli moving in a diagonal direction are respawned, to x, y coordinates.
+    Takes samples along the L (from -buff to wid*ratio + hei/ratio) and into 
+    the buffer (from -buff to 0), window width and height, ratio of the 
+    direction and buffer signs. 
+    Returns a N x 2 array.
+    """
+    coords_main = np.asarray(coords_main, dtype=float)
+    coords_buff = np.asarray(coords_buff, dtype=float)
+    
+    height = coords_main > init_wid*ratio # samples in the height area
+    corner = ~height & (coords_main < 0.1) # samples in the corner area
+    
+    # samples in the width area
+    x = coords_main*ratio - init_wid/2
+    y = (coords_buff - init_hei/2)*buffsign[1]
+    
+    x[corner] = (coords_main[corner] - init_wid/2)*buffsign[0]
+    
+    # for val over wid -> hei
+    x[height] = (coords_buff[height] - init_wid/2)*buffsign[0]
+    y[height] = (coords_main[height] - init_wid*ratio)*ratio - init_hei/2
+    
+    return np.column_stack((x, y))
         
 def posarray(rng, fieldsize, n_elem, n_im):
     """Returns 2D array of positions in field.
@@ -939,17 +1127,41 @@ def fliporder(rng, seg_len, reg_len, surp_len, block_len):
 
     return fliplist
 
+def shownsweeps(stim, params):
+    """Returns the values of params for each sweep a Stimulus will show, in 
+    the order its setters are called (consecutive repeats of a sweep, e.g. 
+    around a blank, do not call them again).
+    """
+    cols = [stim.dimnames.index(param) for param in params]
+    sweeps = [sweep for sweep in stim.frame_schedule.sweeps if sweep != -1]
+    sweeps = [sweep for i, sweep in enumerate(sweeps) if i == 0 or sweep != sweeps[i-1]]
+    return [tuple(stim.sweep_table[sweep][col] for col in cols) for sweep in sweeps]
+
+def squaresizes(fieldsize, deg_per_pix, square_params):
+    """Returns the size of each square (in units) and the number of squares
+    needed to reach the square density.
+    """
+    if square_params['units'] == 'pix':
+        size = np.around(square_params['size']/deg_per_pix)
+    else:
+        size = square_params['size']
+    
+    # calculate number of squares for each square size
+    n_Squares = int(square_params['density']*fieldsize[0]*fieldsize[1] \
+                /np.square(size))
+    
+    return size, n_Squares
+
 def init_run_squares(window, direc, session_params, recordPos, square_params=SQUARE_PARAMS):
 
     # get fieldsize in units and deg_per_pix
     fieldsize, deg_per_pix = winVar(window, square_params['units'])
     
     # convert values to pixels if necessary
+    size, n_Squares = squaresizes(fieldsize, deg_per_pix, square_params)
     if square_params['units'] == 'pix':
-        size = np.around(square_params['size']/deg_per_pix)
         speed = square_params['speed']/deg_per_pix
     else:
-        size = square_params['size']
         speed = square_params['speed']
     
     # convert speed for units/s to units/frame
@@ -958,10 +1170,6 @@ def init_run_squares(window, direc, session_params, recordPos, square_params=SQU
     # to get actual frame rate
     act_fps = window.getMsPerFrame() # returns average, std, median
     
-    # calculate number of squares for each square size
-    n_Squares = int(square_params['density']*fieldsize[0]*fieldsize[1] \
-                /np.square(size))
-    
     # check whether it is a habituation session. If so, remove any surprise
     # segments
     if session_params['type'] == 'hab':
@@ -993,11 +1201,24 @@ def init_run_squares(window, direc, session_params, recordPos, square_params=SQU
             'Flip': (fliparray, 0),
             }
     
+    # record positions to a file for long blocks
+    posfile = None
+    if recordPos and square_params['spill_len'] is not None and session_params['sq_dur'] > square_params['spill_len']:
+        fd, posfile = tempfile.mkstemp(prefix='posbyframe_{}_'.format(direc), suffix='.npy',
+                                       dir=square_params['spill_dir'])
+        os.close(fd)
+    
     # Create the stimulus array
     squares = OurStims(window, elemPar, fieldsize, direc=direc, speed=speed,
                          flipfrac=square_params['flipfrac'],
+                         duration=session_params['sq_dur'],
+                         posfile=posfile,
                          currval=fliparray[0],
                          rng=session_params['rng'])
+    if posfile is not None:
+        # the spill file is only needed until the output is saved, which
+        # SweepStim does before exiting
+        atexit.register(squares.posByFrame.close)
     
     # Add these attributes for the logs
     squares.square_params = square_params
@@ -1117,6 +1338,9 @@ def init_run_gabors(window, session_params, recordOris, gabor_params=GABOR_PARAM
                   shuffle=False,
                   )
     
+    # precompute orientations at block onset, once the display sequence is set
+    gabors._sweeps = lambda: shownsweeps(gb, ['OriSurp', 'PosSizesAll'])
+    
     # record attributes from OurStims
     if recordOris: # potentially large array
         session_params['orisbyimg'] = gabors.orisByImg
@@ -1221,6 +1445,9 @@ def init_rotate_gabors(window, session_params, recordOris, gabor_params=GABOR_PA
                   runs=1,
                   )
     
+    # precompute orientations at block onset, once the display sequence is set
+    gabors._sweeps = lambda: shownsweeps(rgb, ['OriSurp', 'PosSizesAll'])
+    
     # record attributes from OurStims
     if recordOris: # potentially large array
         session_params['orisbyimg'] = gabors.orisByImg
@@ -1239,11 +1466,12 @@ def init_rotate_gabors(window, session_params, recordOris, gabor_params=GABOR_PA
     
     return rgb
     
-def init_run_movies(window, session_params, movie_params, surp, movie_folder):
-    
-    # Propblocks sets the order for presentation of clips in a proportional manner.
-    # In ophys, each clip is played once per block
-    # In habituation, each fw clip is played the desired number of times
+def moviepropblocks(session_params, movie_params):
+    """Returns the clips to play in each movie block.
+    Propblocks sets the order for presentation of clips in a proportional manner.
+    In ophys, each clip is played once per block
+    In habituation, each fw clip is played the desired number of times
+    """
     propblocks = []
 
     if session_params['type'] == 'hab':
@@ -1253,6 +1481,12 @@ def init_run_movies(window, session_params, movie_params, surp, movie_folder):
         
     elif session_params['type'] == 'ophys':    
         propblocks = np.random.permutation(np.arange(movie_params['vids_per_block']))
+    
+    return propblocks
+
+def init_run_movies(window, session_params, movie_params, surp, movie_folder):
+    
+    propblocks = moviepropblocks(session_params, movie_params)
 
     # Set parameters for loading each clip into MovieStim
     path = movie_folder
@@ -1262,19 +1496,41 @@ def init_run_movies(window, session_params, movie_params, surp, movie_folder):
     count = 0
     movindex = 0
     
+    # copy all clips locally at once (reuses valid local copies)
+    movie_paths = [os.path.join(path, "m"+str(j//4)+str(j%4)+movie_params['movie_ext']) 
+                   for j in np.arange(movie_params['vids_per_block'])]
+    local_paths = camstim.movies.get_stager().stage(movie_paths)
+    
+    # frames shown in one block are kept for the next ones (shared by all clips). 
+    # The cache holds every unique frame of the clips: all frames of '.npy' clips, 
+    # e.g. 3 x 270 with '.npz' clips. Every clip plays once per block, so an LRU 
+    # cache smaller than that evicts each frame before it is shown again and never 
+    # hits. The clips are then left to the mmap and the OS page cache.
+    frame_cache = None
+    cache_bytes = camstim.movies.unique_frames_nbytes(local_paths)
+    max_mb = movie_params['frame_cache_mb']
+    if max_mb is None or cache_bytes <= max_mb*2**20:
+        frame_cache = camstim.movies.FrameCache(cache_bytes)
+    else:
+        logging.warning("Not caching movie frames: the clips' frames need {} MB, "
+                        "frame_cache_mb is {}".format(cache_bytes//2**20, max_mb))
+    
     # Use duel counters to set the movie path to correspond to the clip name.
     # Iterate for all clips.        
     for j in np.arange(movie_params['vids_per_block']):
         
         mov[str(j)] = MovieStim(
-                movie_path=os.path.join(path, "m"+str(movindex)+str(count)+'.npy'),
+                movie_path=movie_paths[j],
                 window=window,
                 stop_time=9.0,
                 blank_length=0,                            
                 frame_length=1.0 / 30,
                 size=(1920, 1080),
                 runs= maxruns,   
-                flip_v=True
+                flip_v=True,
+                mmap_mode=movie_params['mmap_mode'],
+                read_ahead=movie_params['read_ahead'],
+                frame_cache=frame_cache,
             )
         
         if movindex == 0:
@@ -1318,16 +1574,11 @@ def init_run_gratings(window, session_params):
                     texRes=256,
                     sf=0.1,
                     ),
-                    sweep_params={
-                                   'Contrast': ([0.8], 0),
-                                   'SF': ([0.08], 1),
-                                   'Ori': (range(0, 180, 30), 2),
-                                   'Phase': ([0.0, 0.25, 0.5, 0.75], 3),
-                                   },
-                    sweep_length=0.3,
+                    sweep_params=dict(GRATING_PARAMS['sweep_params']),
+                    sweep_length=GRATING_PARAMS['sweep_length'],
                     start_time=0.0,
                     blank_length=0.0,
-                    blank_sweeps=25,
+                    blank_sweeps=GRATING_PARAMS['blank_sweeps'],
                     runs=session_params['gratings_dur'],
                     shuffle=True,
                     save_sweep_table=True,
@@ -1338,19 +1589,10 @@ def init_run_gratings(window, session_params):
     
     return grt
     
-if __name__ == "__main__":
-    # This part load parameters from mtrain
-    parser = argparse.ArgumentParser()
-    parser.add_argument("json_path", nargs="?", type=str, default="")
-
-    args, _ = parser.parse_known_args() # <- this ensures that we ignore other arguments that might be needed by camstim
-    
-    # print args
-    with open(args.json_path, 'r') as f:
-        # we use the yaml package here because the json package loads as unicode, which prevents using the keys as parameters later
-        json_params = yaml.load(f)
-    # end of mtrain part
-    
+def session_params_from_dict(json_params):
+    """Returns the session parameters and monitor name from the mtrain 
+    parameters, filling in defaults for anything missing.
+    """
     # mtrain should be providing : a path to a network folder or a local folder with the entire repo pulled
     SESSION_PARAMS_type = json_params.get('type', 'hab')
     SESSION_PARAMS_session_dur = json_params.get('session_dur', 50*60)
@@ -1367,10 +1609,6 @@ if __name__ == "__main__":
 
     # mtrain should be providing : Gamma1.Luminance50
     monitor_name = json_params.get('monitor_name', "testMonitor")
-
-    dist = 15.0
-    wid = 52.0
-    SIZEPIX = [1920, 1200]
     
     SESSION_PARAMS = {'type': SESSION_PARAMS_type, # type of session (hab or ophys)
                                    # entering 'hab' will remove any surprises
@@ -1391,7 +1629,312 @@ if __name__ == "__main__":
                   'gratings_dur': SESSION_PARAMS_gratings_dur,
                   'movie_folder': SESSION_PARAMS_movie_folder
                   }
+    
+    return SESSION_PARAMS, monitor_name
+
+def load_session_params(json_path):
+    """Returns the session parameters and monitor name from an mtrain 
+    JSON/YAML parameter file.
+    """
+    with open(json_path, 'r') as f:
+        # we use the yaml package here because the json package loads as unicode, which prevents using the keys as parameters later
+        json_params = yaml.load(f)
+    
+    return session_params_from_dict(json_params)
+
+def load_stages(json_path):
+    """Returns a list of (stage name, session parameters, monitor name) for 
+    each stage of a regimen file (with a 'stages' section). A plain parameter
+    file is treated as a single stage.
+    Stages can be a dict or list of parameter dicts, optionally nested under
+    'parameters'.
+    """
+    with open(json_path, 'r') as f:
+        json_params = yaml.load(f)
+    
+    if 'stages' not in json_params:
+        name = os.path.splitext(os.path.basename(json_path))[0]
+        return [(name,) + session_params_from_dict(json_params)]
+    
+    stages = json_params['stages']
+    if isinstance(stages, dict):
+        stages = sorted(stages.items())
+    else:
+        stages = [(stage.get('name', str(i)), stage) for i, stage in enumerate(stages)]
+    
+    compiled = []
+    for name, stage in stages:
+        stage_params = stage.get('parameters', stage) or {}
+        compiled.append((name,) + session_params_from_dict(stage_params))
+    
+    return compiled
+
+def session_total(session_params, movie_params=MOVIE_PARAMS, grating_params=GRATING_PARAMS):
+    """Returns the session duration (sec) expected from the block durations.
+    """
+    # AMENDED FOR PRODUCTION V2
+    n_stim = (session_params['sq_dur'] != 0) * 2 + (session_params['gab_dur'] != 0) * 2 + \
+                (session_params['rot_gab_dur'] != 0) * 2 + (session_params['movie_blocks'] != 0) #\
+    tot_calc = session_params['pre_blank'] + session_params['post_blank'] + \
+               (n_stim - 1)*session_params['inter_blank'] + 2*session_params['gab_dur'] + \
+               2*session_params['sq_dur'] + 2*session_params['rot_gab_dur'] +\
+                (movie_params['movie_len']*movie_params['vids_per_block'])*session_params['movie_blocks'] + session_params['gratings_dur']*grating_params['run_len']
+    
+    return tot_calc
+
+def block_orders(session_params):
+    """Returns the shuffled order of the stimulus blocks, and of the stimuli 
+    within each block. Shuffles use the session random number generator.
+    """
+    # AMENDED FOR PRODUCTION V2
+    stim_order = []
+    sq_order = []
+    gab_order = []
+    rot_gab_order = []
+    gab_block_order = []
+
+    if session_params['gab_dur'] != 0:
+        stim_order.append('g')
+        gab_order = [1, 2]
+        gab_block_order = [1, 2]
+    if session_params['rot_gab_dur'] != 0:
+        rot_gab_order = [1, 2]
+    if session_params['sq_dur'] != 0:
+        stim_order.append('b')
+        sq_order = ['l', 'r']
+    if session_params['movie_dur'] != 0:
+        stim_order.append('m')
+    if session_params['gratings_dur'] != 0:
+        stim_order.append('grt')
+
+    session_params['rng'].shuffle(stim_order) # in place shuffling
+    session_params['rng'].shuffle(sq_order) # in place shuffling
+    session_params['rng'].shuffle(gab_order) # in place shuffling
+    session_params['rng'].shuffle(rot_gab_order) # in place shuffling
+    session_params['rng'].shuffle(gab_block_order) # in place shuffling
+    
+    return {'stim_order': stim_order,
+            'sq_order': sq_order,
+            'gab_order': gab_order,
+            'rot_gab_order': rot_gab_order,
+            'gab_block_order': gab_block_order,
+            }
+
+def display_layout(session_params, orders, propblocks, movie_params=MOVIE_PARAMS, grating_params=GRATING_PARAMS):
+    """Returns the display sequence of each stimulus as a list of 
+    (stimulus name, [(start, stop), ...]), in the order the stimuli are 
+    passed to SweepStim.
+    Names are gb_1, gb_2, rgb_1, rgb_2, sq_left, sq_right, mov_<clip #> and grt.
+    """
+    start = session_params['pre_blank'] # initial blank
+    layout = []
+    
+    displayorder = {}
+    clips = []
+    if session_params['type'] == 'ophys':    
+        clips = np.arange(movie_params['vids_per_block'])
+    elif session_params['type'] == 'hab':
+        clips = np.arange(0, movie_params['vids_per_block'], 4)
+    for i in clips:
+        displayorder[str(i)] = []
+    
+    for i in orders['stim_order']:
+        if i == 'g':
+            for l in orders['gab_block_order']:
+                if l == 1:
+                    for j in orders['gab_order']:
+                        layout.append(('gb_{}'.format(j), [(start, start+session_params['gab_dur'])]))
+                        # update the new starting point for the next stim
+                        start += session_params['gab_dur'] 
+                elif l == 2:
+                    for j in orders['rot_gab_order']:
+                        layout.append(('rgb_{}'.format(j), [(start, start+session_params['rot_gab_dur'])]))
+                        # NOTE: advances by gab_dur, not rot_gab_dur (flagged by compile_session)
+                        start += session_params['gab_dur']
+                        # update the new starting point for the next stim
+                start += session_params['inter_blank']
+        elif i == 'b':
+            for j in orders['sq_order']:
+                if j == 'l':
+                    layout.append(('sq_left', [(start, start+session_params['sq_dur'])]))
+                elif j == 'r':
+                    layout.append(('sq_right', [(start, start+session_params['sq_dur'])]))
+                # update the new starting point for the next stim
+                start += session_params['sq_dur'] + session_params['inter_blank'] 
+        elif i == 'm':
+            if len(clips):
+                for ii in np.arange(session_params['movie_blocks']):
+                    propblocksshuf = np.random.permutation(propblocks)
+                    for j in propblocksshuf:
+                        displayorder[str(j)].append((start, start+(movie_params['movie_len'])-1))
+                        start += movie_params['movie_len']
+                for j in clips:
+                    layout.append(('mov_{}'.format(j), displayorder[str(j)]))
+            start += session_params['inter_blank']
+            # update the new starting point for the next stim
+    if session_params['gratings_dur'] != 0:
+        layout.append(('grt', [(start, (start + session_params['gratings_dur']*grating_params['run_len']))]))
+    
+    return layout
+
+def compile_session(session_params, movie_params=MOVIE_PARAMS, gabor_params=GABOR_PARAMS,
+                    square_params=SQUARE_PARAMS, grating_params=GRATING_PARAMS,
+                    monitor_params=MONITOR_PARAMS, fps=60):
+    """Compiles the session timeline without opening a window or building any
+    stimuli.
+    
+    The block orders are drawn from the session rng, but since no stimuli are
+    built beforehand, the rng is in a different state than in a real session 
+    with the same seed: the order is one possible order, not THE order.
+    
+    Returns a dictionary with the display sequence and number of frames of 
+    each stimulus, the session duration, estimates of the memory used by
+    posByFrame/orisByImg, and a list of warnings.
+    """
+    session_params = session_params.copy()
+    if 'rng' not in session_params:
+        session_params['seed'] = random.choice(range(0, 48000))
+        session_params['rng'] = np.random.RandomState(session_params['seed'])
+    
+    warnings = []
+    tot_calc = session_total(session_params, movie_params, grating_params)
+    if tot_calc != session_params['session_dur']:
+        warnings.append('Session should add up to {} s, but adds up to {} s.'
+                        .format(session_params['session_dur'], tot_calc))
+    
+    orders = block_orders(session_params)
+    propblocks = moviepropblocks(session_params, movie_params)
+    layout = display_layout(session_params, orders, propblocks, movie_params, grating_params)
+    
+    # frames per stimulus, counted the same way as Stimulus.set_display_sequence
+    stimuli = []
+    for name, intervals in layout:
+        if len(intervals) == 0:
+            warnings.append('{} has no display intervals, set_display_sequence will fail.'.format(name))
+            stimuli.append({'name': name, 'intervals': [], 'display_sec': 0, 'frames': 0})
+            continue
+        intervals = np.array(intervals, dtype=float)
+        shown = ((intervals[:, 1] - intervals[:, 0])*fps).astype(int)
+        grey = ((intervals[1:, 0] - intervals[:-1, 1])*fps).astype(int).clip(0)
+        stimuli.append({'name': name, 
+                        'intervals': intervals.tolist(),
+                        'display_sec': float((intervals[:, 1] - intervals[:, 0]).sum()),
+                        'frames': int(fps*intervals[0, 0]) + int(shown.sum() + grey.sum()),
+                        })
+    
+    stim_frames = max([stim['frames'] for stim in stimuli] + [0])
+    total_frames = stim_frames + int(session_params['post_blank']*fps)
+    end = float(total_frames)/fps
+    if abs(end - session_params['session_dur']) >= 1.0/fps:
+        warnings.append('Timeline ends at {} s (incl. post blank), but session_dur is {} s.'
+                        .format(end, session_params['session_dur']))
+    
+    # known problems with the parameters
+    if session_params['rot_gab_dur'] != 0 and session_params['gab_dur'] == 0:
+        warnings.append('rot_gab_dur is set but gab_dur is 0: rotating gabors are never shown '
+                        'and init_rotate_gabors needs the gabor positions/sizes.')
+    elif session_params['rot_gab_dur'] != session_params['gab_dur'] and session_params['rot_gab_dur'] != 0:
+        warnings.append('rot_gab blocks advance start by gab_dur ({} s) instead of rot_gab_dur ({} s).'
+                        .format(session_params['gab_dur'], session_params['rot_gab_dur']))
+    if session_params['movie_dur'] != 0:
+        movie_sec = movie_params['movie_len']*movie_params['vids_per_block']*session_params['movie_blocks']
+        if movie_sec != session_params['movie_dur']:
+            warnings.append('movie_dur is {} s but movie_blocks*vids_per_block*movie_len is {} s.'
+                            .format(session_params['movie_dur'], movie_sec))
+    if session_params['gratings_dur'] != 0:
+        n_sweeps = int(np.prod([len(v[0]) for v in grating_params['sweep_params'].values()]))
+        n_blanks = n_sweeps // grating_params['blank_sweeps']
+        grating_sec = session_params['gratings_dur']*(n_sweeps + n_blanks)*grating_params['sweep_length']
+        grating_disp = session_params['gratings_dur']*grating_params['run_len']
+        if abs(grating_sec - grating_disp) > 1e-6:
+            warnings.append('Gratings have {} s of sweeps but are given {} s of display time.'
+                            .format(grating_sec, grating_disp))
+    
+    # overlapping stimuli
+    all_intervals = sorted((start, stop, stim['name']) for stim in stimuli 
+                            for start, stop in stim['intervals'])
+    for (start_0, stop_0, name_0), (start_1, stop_1, name_1) in zip(all_intervals[:-1], all_intervals[1:]):
+        if start_1 < stop_0:
+            warnings.append('{} ({}-{} s) overlaps {} ({}-{} s).'
+                            .format(name_0, start_0, stop_0, name_1, start_1, stop_1))
+    
+    # memory used recording orientations (gabors) and positions (squares)
+    memory = {}
+    set_len = gabor_params['im_len']*(gabor_params['n_im'] + 1)
+    fieldsize, deg_per_pix = monVar(monitor_params['size_pix'], monitor_params['dist'],
+                                    monitor_params['wid'], square_params['units'])
+    _, n_squares = squaresizes(fieldsize, deg_per_pix, square_params)
+    for stim in stimuli:
+        if stim['name'].startswith(('gb_', 'rgb_')):
+            # one entry per non-blank image, precomputed
+            n_sets = int(stim['display_sec']/set_len)
+            rem = int(round((stim['display_sec'] - n_sets*set_len)/gabor_params['im_len'], 6))
+            entries = n_sets*gabor_params['n_im'] + min(rem, gabor_params['n_im'])
+            nbytes = entries*gabor_params['n_gabors']*2
+            memory[stim['name']] = {'array': 'orisByImg', 'entries': entries, 'bytes': nbytes}
+        elif stim['name'].startswith('sq_'):
+            # one frame per frame drawn, preallocated
+            entries = int(stim['display_sec']*fps)
+            nbytes = entries*n_squares*2*2
+            memory[stim['name']] = {'array': 'posByFrame', 'entries': entries, 'bytes': nbytes}
+    
+    return {'seed': session_params.get('seed'),
+            'type': session_params['type'],
+            'session_dur': session_params['session_dur'],
+            'tot_calc': tot_calc,
+            'orders': orders,
+            'stimuli': stimuli,
+            'total_frames': total_frames,
+            'end_sec': end,
+            'memory': memory,
+            'warnings': warnings,
+            }
 
+def print_session_report(name, report):
+    """Prints a compiled session (see compile_session).
+    """
+    print('=== {} ({} session, seed {}) ==='.format(name, report['type'], report['seed']))
+    print('session_dur: {} s   block total: {} s   timeline end: {} s   frames: {}'
+          .format(report['session_dur'], report['tot_calc'], report['end_sec'], report['total_frames']))
+    print('block order: {}'.format(report['orders']['stim_order']))
+    for stim in report['stimuli']:
+        if stim['intervals']:
+            span = '{:>8.1f} - {:>8.1f} s'.format(stim['intervals'][0][0], stim['intervals'][-1][1])
+        else:
+            span = '{:>21}'.format('-')
+        print('  {:<10} {}  {:>3} interval(s)  {:>7} frames'
+              .format(stim['name'], span, len(stim['intervals']), stim['frames']))
+    for stim_name, mem in sorted(report['memory'].items()):
+        print('  {:<10} {}: {} entries, ~{:.1f} MB'
+              .format(stim_name, mem['array'], mem['entries'], mem['bytes']/1e6))
+    for warning in report['warnings']:
+        print('  WARNING: {}'.format(warning))
+    
+if __name__ == "__main__":
+    # This part load parameters from mtrain
+    parser = argparse.ArgumentParser()
+    parser.add_argument("json_path", nargs="?", type=str, default="")
+    parser.add_argument("--dry_run", action="store_true",
+                        help="compile the session timeline for each stage and exit, without opening a window")
+
+    args, _ = parser.parse_known_args() # <- this ensures that we ignore other arguments that might be needed by camstim
+    
+    if args.dry_run:
+        for name, stage_params, _ in load_stages(args.json_path):
+            compile_start = time.time()
+            report = compile_session(stage_params)
+            print_session_report(name, report)
+            print('  compiled in {:.3f} s'.format(time.time() - compile_start))
+        sys.exit(0)
+    
+    # print args
+    SESSION_PARAMS, monitor_name = load_session_params(args.json_path)
+    # end of mtrain part
+
+    dist = MONITOR_PARAMS['dist']
+    wid = MONITOR_PARAMS['wid']
+    SIZEPIX = MONITOR_PARAMS['size_pix']
+    
     # Record orientations of gabors at each sweep (LEAVE AS TRUE)
     recordOris = True
 
@@ -1417,25 +1960,14 @@ if __name__ == "__main__":
                     )
 
     # check session params add up to correct total time
-    # AMENDED FOR PRODUCTION V2
-    n_stim = (SESSION_PARAMS['sq_dur'] != 0) * 2 + (SESSION_PARAMS['gab_dur'] != 0) * 2 + \
-                (SESSION_PARAMS['rot_gab_dur'] != 0) * 2 + (SESSION_PARAMS['movie_blocks'] != 0) #\
-    tot_calc = SESSION_PARAMS['pre_blank'] + SESSION_PARAMS['post_blank'] + \
-               (n_stim - 1)*SESSION_PARAMS['inter_blank'] + 2*SESSION_PARAMS['gab_dur'] + \
-               2*SESSION_PARAMS['sq_dur'] + 2*SESSION_PARAMS['rot_gab_dur'] +\
-                (MOVIE_PARAMS['movie_len']*MOVIE_PARAMS['vids_per_block'])*SESSION_PARAMS['movie_blocks'] + SESSION_PARAMS['gratings_dur']*14.7
+    tot_calc = session_total(SESSION_PARAMS)
     if tot_calc != SESSION_PARAMS['session_dur']:
         print('Session should add up to {} s, but adds up to {} s.'
               .format(SESSION_PARAMS['session_dur'], tot_calc))
 
     # initialize the stimuli # AMENDED FOR PRODUCTION V2
-    stim_order = []
-    sq_order = []
-    gab_order = []
-    rot_gab_order = []
-    mov_order = []
-    grt_order = []
-    gab_block_order = []
+    stims = {}
+    propblocks = []
 
     if SESSION_PARAMS['gab_dur'] != 0:
         gb_1 = init_run_gabors(window, SESSION_PARAMS.copy(), recordOris, surp=2)
@@ -1445,104 +1977,32 @@ if __name__ == "__main__":
         gb_2_session_params['possize'] = gb_1.stim_params['session_params']['possize']
         gb_2 = init_run_gabors(window, gb_2_session_params, recordOris, surp=2)
         
-        stim_order.append('g')
-        gab_order = [1, 2]
-        gab_block_order = [1, 2]
+        stims['gb_1'], stims['gb_2'] = gb_1, gb_2
     if SESSION_PARAMS['rot_gab_dur'] != 0:
         rgb_1 = init_rotate_gabors(window, gb_2_session_params, recordOris, surp=2)
         
         # share positions and sizes from original Gabors. Keeps possize the same
         rgb_2 = init_rotate_gabors(window, gb_2_session_params, recordOris, surp=2)
-        rot_gab_order = [1, 2]
+        stims['rgb_1'], stims['rgb_2'] = rgb_1, rgb_2
     if SESSION_PARAMS['sq_dur'] != 0:
         sq_left = init_run_squares(window, 'left', SESSION_PARAMS.copy(), recordPos)
         sq_right = init_run_squares(window, 'right', SESSION_PARAMS.copy(), recordPos)
-        stim_order.append('b')
-        sq_order = ['l', 'r']
+        stims['sq_left'], stims['sq_right'] = sq_left, sq_right
     if SESSION_PARAMS['movie_dur'] != 0:
         mov, propblocks = init_run_movies(window, SESSION_PARAMS.copy(), MOVIE_PARAMS, 1, SESSION_PARAMS['movie_folder'])
-        stim_order.append('m')
-        mov_order = np.arange(MOVIE_PARAMS['movie_n'])
+        for j, movie in mov.items():
+            stims['mov_{}'.format(j)] = movie
     if SESSION_PARAMS['gratings_dur'] != 0:
         grt = init_run_gratings(window, SESSION_PARAMS.copy())
-        stim_order.append('grt')
+        stims['grt'] = grt
 
     # initialize display order and times # AMENDED FOR PRODUCTION V2
-    SESSION_PARAMS['rng'].shuffle(stim_order) # in place shuffling
-    SESSION_PARAMS['rng'].shuffle(sq_order) # in place shuffling
-    SESSION_PARAMS['rng'].shuffle(gab_order) # in place shuffling
-    SESSION_PARAMS['rng'].shuffle(rot_gab_order) # in place shuffling
-    SESSION_PARAMS['rng'].shuffle(gab_block_order) # in place shuffling
-
-    start = SESSION_PARAMS['pre_blank'] # initial blank
-    stimuli = []
+    orders = block_orders(SESSION_PARAMS)
     
-    displayorder = {}
-    if SESSION_PARAMS['type'] == 'ophys':    
-        for i in np.arange(MOVIE_PARAMS['vids_per_block']):
-            displayorder[str(i)] = []
-    elif SESSION_PARAMS['type'] == 'hab':
-        for i in np.arange(0, MOVIE_PARAMS['vids_per_block'], 4):
-            displayorder[str(i)] = []
-    
-    for i in stim_order:
-        if i == 'g':
-            for l in gab_block_order:
-                if l == 1:
-                    for j in gab_order:
-                        if j == 1:
-                            stimuli.append(gb_1)
-                            gb_1.set_display_sequence([(start, start+SESSION_PARAMS['gab_dur'])])
-                        elif j == 2:
-                            stimuli.append(gb_2)
-                            gb_2.set_display_sequence([(start, start+SESSION_PARAMS['gab_dur'])])
-                        # update the new starting point for the next stim
-                        start += SESSION_PARAMS['gab_dur'] 
-                elif l == 2:
-                    for j in rot_gab_order:
-                        if j == 1:
-                            stimuli.append(rgb_1)
-                            rgb_1.set_display_sequence([(start, start+SESSION_PARAMS['rot_gab_dur'])])
-                        elif j == 2:
-                            stimuli.append(rgb_2)
-                            rgb_2.set_display_sequence([(start, start+SESSION_PARAMS['rot_gab_dur'])])
-                        start += SESSION_PARAMS['gab_dur']
-                        # update the new starting point for the next stim
-                start += SESSION_PARAMS['inter_blank']
-        elif i == 'b':
-            for j in sq_order:
-                if j == 'l':
-                    stimuli.append(sq_left)
-                    sq_left.set_display_sequence([(start, start+SESSION_PARAMS['sq_dur'])])
-                elif j == 'r':
-                    stimuli.append(sq_right)
-                    sq_right.set_display_sequence([(start, start+SESSION_PARAMS['sq_dur'])])
-                # update the new starting point for the next stim
-                start += SESSION_PARAMS['sq_dur'] + SESSION_PARAMS['inter_blank'] 
-        elif i == 'm':
-            if SESSION_PARAMS['type'] == 'ophys':
-                for ii in np.arange(SESSION_PARAMS['movie_blocks']):
-                    propblocksshuf = np.random.permutation(propblocks)
-                    for j in propblocksshuf:
-                        displayorder[str(j)].append((start, start+(MOVIE_PARAMS['movie_len'])-1))
-                        start += MOVIE_PARAMS['movie_len']
-                for j in np.arange(MOVIE_PARAMS['vids_per_block']):
-                    mov[str(j)].set_display_sequence(displayorder[str(j)])
-                    stimuli.append(mov[str(j)])
-            elif SESSION_PARAMS['type'] == 'hab':
-                for ii in np.arange(SESSION_PARAMS['movie_blocks']):
-                    propblocksshuf = np.random.permutation(propblocks)
-                    for j in propblocksshuf:
-                        displayorder[str(j)].append((start, start+(MOVIE_PARAMS['movie_len'])-1))
-                        start += MOVIE_PARAMS['movie_len']
-                for j in np.arange(0, MOVIE_PARAMS['vids_per_block'], 4):
-                    mov[str(j)].set_display_sequence(displayorder[str(j)])
-                    stimuli.append(mov[str(j)])    
-            start += SESSION_PARAMS['inter_blank']
-            # update the new starting point for the next stim
-    if SESSION_PARAMS['gratings_dur'] != 0:
-        grt.set_display_sequence([(start, (start + SESSION_PARAMS['gratings_dur']*14.7))])
-        stimuli.append(grt)
+    stimuli = []
+    for name, intervals in display_layout(SESSION_PARAMS, orders, propblocks):
+        stims[name].set_display_sequence(intervals)
+        stimuli.append(stims[name])
 
     ss = SweepStim(window,
                    stimuli=stimuli,
@@ -1559,4 +2019,4 @@ if __name__ == "__main__":
     ss.add_item(f, "foraging")
     
     # run it
-    ss.run()
\ No newline at end of file
+    ss.run()
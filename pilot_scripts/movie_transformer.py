@@ -2,6 +2,8 @@ import os
 import numpy as np
 from glob import glob
 
+from camstim.movies import save_indexed_movie
+
 def generatemovies(rawmovie):
     
     # Creates the 4 varients of each movie we require
@@ -36,6 +38,28 @@ def generatemovies(rawmovie):
 
     return npymovies
 
+def generateindices(n_frames=270):
+
+    # Same 4 varients as generatemovies, but as the indices of the frames of 
+    # the shortened movie to show, so each frame only needs to be stored once
+
+    fwd = np.arange(n_frames)
+    rev = fwd[::-1]
+    seg = n_frames//3
+
+    indices = {
+        '0' : fwd,
+        '1' : rev,
+        '2' : np.concatenate((fwd[0:seg], rev[2*seg:n_frames], fwd[0:seg])),
+        '3' : np.concatenate((rev[0:seg], fwd[2*seg:n_frames], rev[0:seg]))
+    }
+
+    return indices
+
+# Save each varient as an indexed movie (.npz) sharing one frame array,
+# instead of one full movie (.npy) per varient
+indexed = True
+
 loadpath = ".\\natural_movies\\"
 savepath = ".\\natural_movies\\stims\\"
 
@@ -52,11 +76,18 @@ for j, stimulus_path in enumerate(stimulus_paths):
     nameindex = nameindex + 1
     moviename = 'Movie'+str(nameindex)
     rawmovie = np.load(stimulus_path)
-    npymovies = generatemovies(rawmovie)
     os.mkdir(savepath+str(j)+"\\")
 
-    for key in npymovies:
-        np.save(savepath+str(j)+"\\"+'Movie'+str(j)+key+'.npy', npymovies[key])
+    if indexed:
+        framespath = savepath+str(j)+"\\"+'Movie'+str(j)+'_frames.npy'
+        np.save(framespath, rawmovie[0:270])
+        indices = generateindices()
+        for key in indices:
+            save_indexed_movie(savepath+str(j)+"\\"+'Movie'+str(j)+key+'.npz', framespath, indices[key])
+    else:
+        npymovies = generatemovies(rawmovie)
+        for key in npymovies:
+            np.save(savepath+str(j)+"\\"+'Movie'+str(j)+key+'.npy', npymovies[key])
 
 # If you try to do this for more than 9 movies or with more than 9 variations,
 # this method will probably break.